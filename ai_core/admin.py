@@ -1,44 +1,40 @@
 from django.contrib import admin, messages
-from django.conf import settings
-import ollama
-from .models import DataSource, SchemaTable, SchemaColumn
-from .services import sync_database_schema
-from .tasks import task_reindex_vectors
-
-
-INTERESTING_KEYWORDS = [
-    'name', 'title', 'status', 'type', 'category', 'city', 'region', 'country',
-    'date', 'year', 'month', 'day', 'time',
-    'price', 'cost', 'budget', 'amount', 'total', 'sum', 'revenue', 'profit',
-    'count', 'qty', 'quantity', 'rate', 'score', 'percent', 'ratio',
-    'user', 'client', 'manager', 'agent', 'owner'
-]
-
-JUNK_KEYWORDS = [
-    'token', 'secret', 'password', 'hash', 'slug',
-    'created_at', 'updated_at', 'modified', 'version',
-    'lft', 'rght', 'tree_id', 'level',
-    'is_staff', 'is_superuser', 'last_login'
-]
-
-
-def is_column_interesting(col_name):
-    """Определяет, полезна ли колонка для аналитики."""
-    col_name = col_name.lower()
-    if col_name == 'id': return False
-    if any(k in col_name for k in JUNK_KEYWORDS): return False
-    if any(k in col_name for k in INTERESTING_KEYWORDS): return True
-    return False
-
-
-def generate_ai_desc_safe(prompt_text, model_name):
-    """Безопасный вызов AI"""
-    try:
-        client = ollama.Client(host=settings.OLLAMA_HOST)
-        response = client.generate(model=model_name, prompt=prompt_text, options={'temperature': 0.5})
-        return response['response'].strip().replace('"', '').replace("'", "")
-    except:
-        return None
+from django.core.cache import cache
+from django.db import transaction
+from .models import DataSource, DataSourceEndpoint, SchemaTable, SchemaColumn, SchemaSyncJob, SQLCacheEntry
+from .curation import enqueue_reembedding, invalidate_schema_caches
+from .result_cache import QueryResultCache
+from .services import format_sync_stats
+from .sql_cache import SemanticSQLCache
+from .tasks import (
+    task_reindex_vectors, task_sync_schema, task_index_column_values, task_curate_tables, task_describe_columns,
+    sync_job_is_stale, resume_sync_job, VECTOR_INDEX_PROGRESS_KEY, CURATION_PROGRESS_KEY,
+)
+
+
+def show_curation_progress(model_admin, request):
+    """Снимок прогресса последней фоновой задачи AI-курирования (общий для таблиц и колонок)."""
+    progress = cache.get(CURATION_PROGRESS_KEY)
+    if not progress:
+        model_admin.message_user(request, "AI-курирование еще не запускалось.", level=messages.INFO)
+        return
+
+    if progress.get('error'):
+        model_admin.message_user(
+            request,
+            f"AI-курирование прервано на {progress.get('done', 0)}/{progress.get('total', 0)}: {progress['error']}",
+            level=messages.ERROR
+        )
+        return
+
+    status = "завершено" if progress.get('finished') else "выполняется"
+    model_admin.message_user(
+        request,
+        f"AI-курирование {status}: {progress.get('done', 0)}/{progress.get('total', 0)} описаний, "
+        f"ошибок LLM: {progress.get('failed', 0)}, скорость: {progress.get('per_second', 0)} в сек, "
+        f"прошло {progress.get('elapsed_sec', 0)} сек.",
+        level=messages.INFO
+    )
 
 
 # ==========================================
@@ -58,7 +54,7 @@ class SchemaTableAdmin(admin.ModelAdmin):
     list_filter = ('data_source', 'is_enabled')
     search_fields = ('table_name', 'description_ru')
     inlines = [SchemaColumnInline]
-    actions = ['enable_tables', 'disable_tables', 'auto_curate_table']
+    actions = ['enable_tables', 'disable_tables', 'auto_curate_table', 'show_curation_progress']
 
     def short_desc(self, obj):
         return obj.description_ru[:50] + "..." if obj.description_ru else "-"
@@ -70,55 +66,41 @@ class SchemaTableAdmin(admin.ModelAdmin):
 
     columns_count.short_description = "Колонок"
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if 'description_ru' in form.changed_data:
+            enqueue_reembedding(table_ids=[obj.id])
+
+    def save_formset(self, request, form, formset, change):
+        super().save_formset(request, form, formset, change)
+        changed_columns = [
+            f.instance.id for f in formset.forms
+            if f.instance.pk and 'description_ru' in f.changed_data
+        ]
+        enqueue_reembedding(column_ids=changed_columns)
+
     @admin.action(description="✅ Включить выбранные таблицы")
     def enable_tables(self, request, queryset):
         rows = queryset.update(is_enabled=True)
+        invalidate_schema_caches(queryset.values_list('id', flat=True))
         messages.success(request, f"Включено таблиц: {rows}")
 
     @admin.action(description="❌ Выключить выбранные таблицы")
     def disable_tables(self, request, queryset):
         rows = queryset.update(is_enabled=False)
+        invalidate_schema_caches(queryset.values_list('id', flat=True))
         messages.success(request, f"Выключено таблиц: {rows}")
 
     @admin.action(description="🚀 AI: Полная авто-настройка (Описание + Колонки)")
     def auto_curate_table(self, request, queryset):
-        for table in queryset:
-            table.is_enabled = True
-
-            if not table.description_ru:
-                prompt = f"Опиши одной фразой на русском, какие данные хранит таблица '{table.table_name}' в базе аналитики."
-                desc = generate_ai_desc_safe(prompt, settings.OLLAMA_SUMMARY_MODEL)
-                if desc: table.description_ru = desc
-
-            table.save()
-
-            columns = table.columns.all()
-            enabled_count = 0
-
-            for col in columns:
-                is_useful = is_column_interesting(col.column_name)
-                col.is_enabled = is_useful
-
-                if is_useful:
-                    enabled_count += 1
-                    name = col.column_name.lower()
-                    dtype = col.data_type.upper()
-
-                    is_num = any(t in dtype for t in ['INT', 'DECIMAL', 'FLOAT', 'NUMERIC'])
-                    if is_num and any(x in name for x in ['budget', 'cost', 'price', 'amount', 'sum', 'count', 'cnt']):
-                        col.is_metric = True
-                    else:
-                        col.is_dimension = True
-
-                    if not col.description_ru:
-                        prompt_col = f"Переведи название колонки '{col.column_name}' (таблица {table.table_name}) на русский бизнес-язык, с синонимами (минимум 2)."
-                        desc_col = generate_ai_desc_safe(prompt_col, settings.OLLAMA_SUMMARY_MODEL)
-                        if desc_col: col.description_ru = desc_col
-
-                col.save()
+        table_ids = list(queryset.values_list('id', flat=True))
+        task = task_curate_tables.delay(table_ids)
+        messages.success(request, f"Авто-настройка {len(table_ids)} таблиц запущена в фоне (ID: {task.id}). "
+                                  f"Прогресс - в действии «Прогресс AI-курирования».")
 
-            messages.success(request,
-                             f"Таблица {table.table_name}: Обработано, включено {enabled_count} из {columns.count()} колонок.")
+    @admin.action(description="📈 Прогресс AI-курирования")
+    def show_curation_progress(self, request, queryset):
+        show_curation_progress(self, request)
 
 
 # ==========================================
@@ -136,7 +118,8 @@ class SchemaColumnAdmin(admin.ModelAdmin):
     )
     search_fields = ('column_name', 'description_ru', 'schema_table__table_name')
     list_per_page = 100
-    actions = ['generate_column_desc', 'auto_detect_type', 'enable_selected', 'disable_selected']
+    actions = ['generate_column_desc', 'auto_detect_type', 'enable_selected', 'disable_selected',
+               'show_curation_progress']
 
     def get_table(self, obj):
         return obj.schema_table.table_name
@@ -148,33 +131,21 @@ class SchemaColumnAdmin(admin.ModelAdmin):
 
     short_desc.short_description = "Описание"
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if 'description_ru' in form.changed_data:
+            enqueue_reembedding(column_ids=[obj.id])
+
     @admin.action(description="✨ AI: Сгенерировать описание колонки")
     def generate_column_desc(self, request, queryset):
-        count = 0
-        for col in queryset:
-            prompt = f"""
-            Ты - Data Engineer. Переведи техническое название колонки в понятное бизнес-описание на РУССКОМ языке.
-            Используй синонимы, чтобы поиск работал лучше.
-
-            Таблица: "{col.schema_table.table_name}"
-            Колонка: "{col.column_name}"
-            Тип данных: {col.data_type}
-
-            Примеры:
-            "budget_usd" -> "Бюджет в долларах, расходы, стоимость, затраты"
-            "click_cnt" -> "Количество кликов, переходы"
-            "client_nm" -> "Имя клиента, название бренда"
-
-            Твой ответ (только текст описания):
-            """
-
-            desc = generate_ai_desc_safe(prompt, settings.OLLAMA_SUMMARY_MODEL)
-            if desc:
-                col.description_ru = desc.replace('"', '').replace("'", "")
-                col.save(update_fields=['description_ru'])
-                count += 1
+        column_ids = list(queryset.values_list('id', flat=True))
+        task = task_describe_columns.delay(column_ids)
+        messages.success(request, f"Генерация описаний для {len(column_ids)} колонок запущена в фоне (ID: {task.id}). "
+                                  f"Прогресс - в действии «Прогресс AI-курирования».")
 
-        messages.success(request, f"AI сгенерировал описания для {count} колонок.")
+    @admin.action(description="📈 Прогресс AI-курирования")
+    def show_curation_progress(self, request, queryset):
+        show_curation_progress(self, request)
 
     @admin.action(description="⚡ Авто-расстановка Метрик/Измерений")
     def auto_detect_type(self, request, queryset):
@@ -205,40 +176,148 @@ class SchemaColumnAdmin(admin.ModelAdmin):
     @admin.action(description="✅ Включить выбранные")
     def enable_selected(self, request, queryset):
         queryset.update(is_enabled=True)
+        invalidate_schema_caches(queryset.values_list('schema_table_id', flat=True))
 
     @admin.action(description="❌ Выключить выбранные")
     def disable_selected(self, request, queryset):
         queryset.update(is_enabled=False)
+        invalidate_schema_caches(queryset.values_list('schema_table_id', flat=True))
 
 
 # ==========================================
 # 🔌 ИСТОЧНИКИ (DataSource)
 # ==========================================
 # Убрали декоратор @admin.register
+class DataSourceEndpointInline(admin.TabularInline):
+    model = DataSourceEndpoint
+    extra = 0
+    fields = ('role', 'host', 'port', 'is_enabled', 'is_healthy', 'last_latency_ms', 'last_checked')
+    readonly_fields = ('is_healthy', 'last_latency_ms', 'last_checked')
+
+
 class DataSourceAdmin(admin.ModelAdmin):
-    list_display = ('name', 'engine', 'host', 'db_name', 'last_inspected', 'is_active')
-    actions = ['run_schema_sync', 'run_vectorization_bg']
+    list_display = ('name', 'engine', 'host', 'db_name', 'last_inspected', 'sync_status', 'is_active')
+    inlines = [DataSourceEndpointInline]
+    actions = ['run_schema_sync', 'run_value_index', 'run_vectorization_bg', 'show_vectorization_progress',
+               'show_result_cache_stats']
 
     @admin.action(description='Запустить интроспекцию (Загрузить схему)')
     def run_schema_sync(self, request, queryset):
-        success_count = 0
+        """По задаче Celery на источник; упавшая синхронизация продолжается с места остановки."""
+        started, resumed = 0, 0
         for datasource in queryset:
-            is_success, error_msg = sync_database_schema(datasource)
-            if is_success:
-                success_count += 1
+            last_job = datasource.sync_jobs.first()
+            stale = last_job is not None and sync_job_is_stale(last_job)
+            if last_job and not last_job.is_finished and not stale:
+                messages.warning(request, f"{datasource.name}: синхронизация уже "
+                                          f"{last_job.get_status_display().lower()}.")
+                continue
+
+            if stale or (last_job and last_job.status == 'failed' and last_job.table_names
+                         and last_job.tables_done < len(last_job.table_names)):
+                job = last_job
+                resume_sync_job(job)
+                resumed += 1
             else:
-                messages.error(request, f"Ошибка {datasource.name}: {error_msg}")
-        if success_count > 0:
-            messages.success(request, f"Синхронизировано {success_count} источников.")
+                job = SchemaSyncJob.objects.create(data_source=datasource)
+                started += 1
+            transaction.on_commit(lambda job_id=job.id: task_sync_schema.delay(job_id))
+
+        if started or resumed:
+            messages.success(request, f"Синхронизация запущена в фоне: новых {started}, продолжено {resumed}. "
+                                      f"Статус - в колонке «Синхронизация».")
+
+    @admin.action(description='🔤 Обновить индекс значений измерений')
+    def run_value_index(self, request, queryset):
+        for datasource in queryset:
+            task_index_column_values.delay(datasource.id)
+        messages.success(request, f"Выборка значений измерений запущена в фоне для {queryset.count()} источников.")
+
+    @admin.display(description='Синхронизация')
+    def sync_status(self, obj):
+        job = obj.sync_jobs.first()
+        if not job:
+            return '-'
+        if job.status == 'done':
+            return f"Готово: {format_sync_stats(job.stats)}" if job.stats.get('tables_total') is not None \
+                else "Готово"
+        progress = f"{job.tables_done}/{len(job.table_names)} таблиц ({job.progress_percent}%)"
+        if job.status == 'failed':
+            return f"Ошибка на {progress}: {job.error[:100]}"
+        return f"{job.get_status_display()}: {progress}"
 
     @admin.action(description='🧠 Запустить Векторизацию (Фоновая задача)')
     def run_vectorization_bg(self, request, queryset):
-        task_reindex_vectors.delay()
+        task = task_reindex_vectors.delay()
         self.message_user(request,
-                          "Задача векторизации запущена в фоне! Процесс займет несколько минут. Проверьте логи позже.",
+                          f"Задача векторизации запущена в фоне (ID: {task.id}). "
+                          f"Прогресс - в действии «Прогресс векторизации».",
                           level=messages.SUCCESS)
 
+    @admin.action(description='📈 Прогресс векторизации')
+    def show_vectorization_progress(self, request, queryset):
+        progress = cache.get(VECTOR_INDEX_PROGRESS_KEY)
+        if not progress:
+            self.message_user(request, "Векторизация еще не запускалась.", level=messages.INFO)
+            return
+
+        status = "завершена" if progress.get('finished') else "выполняется"
+        self.message_user(
+            request,
+            f"Векторизация {status}: {progress.get('done', 0)}/{progress.get('total', 0)} объектов, "
+            f"ошибок: {progress.get('failed', 0)}, скорость: {progress.get('per_second', 0)} объектов/сек, "
+            f"прошло {progress.get('elapsed_sec', 0)} сек.",
+            level=messages.INFO
+        )
+
+
+    @admin.action(description='📊 Статистика кэша результатов')
+    def show_result_cache_stats(self, request, queryset):
+        try:
+            stats = QueryResultCache.stats()
+        except Exception as e:
+            self.message_user(request, f"Кэш результатов недоступен: {e}", level=messages.ERROR)
+            return
+        self.message_user(
+            request,
+            f"Кэш результатов: попаданий {stats['hits']}, промахов {stats['misses']}, "
+            f"hit ratio {stats['hit_ratio']:.1%}, записей {stats['entries']}, "
+            f"память {stats['memory_bytes'] / 1024 / 1024:.1f} МБ.",
+            level=messages.INFO
+        )
+
+
+# ==========================================
+# ⚡ КЭШ SQL (SQLCacheEntry)
+# ==========================================
+class SQLCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ('short_question', 'data_source', 'hit_count', 'created_at', 'last_used_at')
+    list_filter = ('data_source',)
+    search_fields = ('question', 'sql_query')
+    readonly_fields = ('data_source', 'question', 'schema_version', 'tables', 'sql_query',
+                       'hit_count', 'created_at', 'last_used_at')
+    exclude = ('embedding',)
+    actions = ['show_stats', 'run_eviction']
+
+    def short_question(self, obj):
+        return obj.question[:60]
 
+    short_question.short_description = "Вопрос"
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description="📈 Показать статистику кэша")
+    def show_stats(self, request, queryset):
+        stats = SemanticSQLCache().stats()
+        messages.info(request,
+                      f"Попаданий: {stats['hits']}, промахов: {stats['misses']}, "
+                      f"hit ratio: {stats['hit_ratio']:.1%}, записей: {stats['entries']}")
+
+    @admin.action(description="🧹 Вытеснить устаревшие записи (TTL/LRU)")
+    def run_eviction(self, request, queryset):
+        deleted = SemanticSQLCache().evict()
+        messages.success(request, f"Удалено записей: {deleted}")
 
 
 try:
@@ -254,4 +333,29 @@ except admin.sites.AlreadyRegistered:
 try:
     admin.site.register(DataSource, DataSourceAdmin)
 except admin.sites.AlreadyRegistered:
-    pass
\ No newline at end of file
+    pass
+
+class SchemaSyncJobAdmin(admin.ModelAdmin):
+    list_display = ('data_source', 'status', 'progress', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('status', 'data_source')
+    readonly_fields = ('data_source', 'status', 'task_id', 'tables_done', 'stats', 'attempts', 'error',
+                       'created_at', 'finished_at')
+    exclude = ('table_names',)
+
+    @admin.display(description='Прогресс')
+    def progress(self, obj):
+        return f"{obj.tables_done}/{len(obj.table_names)} ({obj.progress_percent}%)"
+
+    def has_add_permission(self, request):
+        return False
+
+
+try:
+    admin.site.register(SchemaSyncJob, SchemaSyncJobAdmin)
+except admin.sites.AlreadyRegistered:
+    pass
+
+try:
+    admin.site.register(SQLCacheEntry, SQLCacheEntryAdmin)
+except admin.sites.AlreadyRegistered:
+    pass
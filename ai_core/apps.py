@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class AiCoreConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'ai_core'
+
+    def ready(self):
+        # Подключаем обработчики сигналов (инвалидация кэшей)
+        from . import signals  # noqa: F401
@@ -3,11 +3,18 @@ import plotly.express as px
 import logging
 from pandas.api.types import is_numeric_dtype, is_datetime64_any_dtype
 import textwrap
+from django.conf import settings
+
+from .downsampling import downsample_line
 
 logger = logging.getLogger(__name__)
 
 
 class ChartGenerator:
+    def __init__(self):
+        # Сколько строк пришло и сколько точек ушло в график последнего generate_plotly_json
+        self.last_chart_meta = {}
+
     def _is_plottable(self, df: pd.DataFrame) -> bool:
         # 1. Должно быть минимум 2 колонки (X и Y)
         if df.empty or len(df.columns) < 2:
@@ -55,6 +62,7 @@ class ChartGenerator:
         return 'bar'
 
     def generate_plotly_json(self, df: pd.DataFrame, prompt: str) -> str | None:
+        self.last_chart_meta = {'original_rows': len(df)}
         try:
             if not self._is_plottable(df):
                 logger.info("Данные не подходят для графика.")
@@ -80,6 +88,14 @@ class ChartGenerator:
             fig = None
 
             if chart_type == 'line':
+                # Длинный ряд прореживаем (LTTB): форма сохраняется, JSON остается маленьким
+                max_points = getattr(settings, 'LINE_CHART_MAX_POINTS', 500)
+                if len(df) > max_points:
+                    original_rows = len(df)
+                    df = downsample_line(df, x_col, y_col, max_points)
+                    wrapped_title += f"<br><sup>{len(df)} из {original_rows} точек</sup>"
+                    logger.info(f"Линейный график: прорежено {original_rows} -> {len(df)} точек (LTTB).")
+
                 fig = px.line(
                     df, x=x_col, y=y_col,
                     title=wrapped_title, markers=True, labels=labels
@@ -127,6 +143,7 @@ class ChartGenerator:
                 plot_bgcolor='white',
             )
 
+            self.last_chart_meta['points'] = len(df)
             return fig.to_json()
 
         except Exception as e:
@@ -0,0 +1,217 @@
+# AI-курирование схемы (описания таблиц/колонок + флаги метрика/измерение) для фоновых задач.
+# Вызовы Ollama идут параллельно (не больше CURATION_CONCURRENCY одновременно),
+# результат пишется bulk_update, кэши промпта/SQL сбрасываются явно (bulk сигналов не шлет).
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+
+from . import schema_prompt
+from .models import SchemaTable, SchemaColumn
+from .ollama_registry import get_client
+from .services import IndexingProgress
+from .sql_cache import invalidate_tables
+
+logger = logging.getLogger(__name__)
+
+INTERESTING_KEYWORDS = [
+    'name', 'title', 'status', 'type', 'category', 'city', 'region', 'country',
+    'date', 'year', 'month', 'day', 'time',
+    'price', 'cost', 'budget', 'amount', 'total', 'sum', 'revenue', 'profit',
+    'count', 'qty', 'quantity', 'rate', 'score', 'percent', 'ratio',
+    'user', 'client', 'manager', 'agent', 'owner'
+]
+
+JUNK_KEYWORDS = [
+    'token', 'secret', 'password', 'hash', 'slug',
+    'created_at', 'updated_at', 'modified', 'version',
+    'lft', 'rght', 'tree_id', 'level',
+    'is_staff', 'is_superuser', 'last_login'
+]
+
+METRIC_KEYWORDS = ['budget', 'cost', 'price', 'amount', 'sum', 'count', 'cnt']
+NUMERIC_TYPES = ['INT', 'DECIMAL', 'FLOAT', 'NUMERIC']
+
+
+def is_column_interesting(col_name):
+    """Определяет, полезна ли колонка для аналитики."""
+    col_name = col_name.lower()
+    if col_name == 'id': return False
+    if any(k in col_name for k in JUNK_KEYWORDS): return False
+    if any(k in col_name for k in INTERESTING_KEYWORDS): return True
+    return False
+
+
+def generate_ai_desc_safe(prompt_text, model_name):
+    """Безопасный вызов AI"""
+    try:
+        client = get_client(settings.OLLAMA_HOST)
+        response = client.generate(model=model_name, prompt=prompt_text, options={'temperature': 0.5})
+        return response['response'].strip().replace('"', '').replace("'", "")
+    except:
+        return None
+
+
+def invalidate_schema_caches(table_ids):
+    """
+    queryset.update() и bulk_update не вызывают сигналы, поэтому для массовых
+    изменений инвалидируем кэш промпта и кэш SQL явно.
+    """
+    table_ids = set(table_ids)
+    schema_prompt.invalidate(table_ids)
+
+    by_source = {}
+    for ds_id, table_name in SchemaTable.objects.filter(id__in=table_ids).values_list('data_source_id', 'table_name'):
+        by_source.setdefault(ds_id, set()).add(table_name)
+    for ds_id, names in by_source.items():
+        invalidate_tables(ds_id, names)
+
+
+def enqueue_reembedding(table_ids=(), column_ids=()):
+    """Точечная переиндексация после правки описаний (после коммита текущей транзакции)."""
+    from .tasks import task_reindex_vectors
+
+    table_ids, column_ids = list(table_ids), list(column_ids)
+    if table_ids or column_ids:
+        transaction.on_commit(
+            lambda: task_reindex_vectors.delay(table_ids=table_ids, column_ids=column_ids)
+        )
+
+
+def _table_prompt(table) -> str:
+    return f"Опиши одной фразой на русском, какие данные хранит таблица '{table.table_name}' в базе аналитики."
+
+
+def _column_prompt(col, table_name: str) -> str:
+    return (f"Переведи название колонки '{col.column_name}' (таблица {table_name}) "
+            f"на русский бизнес-язык, с синонимами (минимум 2).")
+
+
+def _column_prompt_detailed(col) -> str:
+    return f"""
+            Ты - Data Engineer. Переведи техническое название колонки в понятное бизнес-описание на РУССКОМ языке.
+            Используй синонимы, чтобы поиск работал лучше.
+
+            Таблица: "{col.schema_table.table_name}"
+            Колонка: "{col.column_name}"
+            Тип данных: {col.data_type}
+
+            Примеры:
+            "budget_usd" -> "Бюджет в долларах, расходы, стоимость, затраты"
+            "click_cnt" -> "Количество кликов, переходы"
+            "client_nm" -> "Имя клиента, название бренда"
+
+            Твой ответ (только текст описания):
+            """
+
+
+def _classify_column(col):
+    """Эвристика включения и метрика/измерение (в памяти, без сохранения)."""
+    col.is_enabled = is_column_interesting(col.column_name)
+    if not col.is_enabled:
+        return
+    name = col.column_name.lower()
+    dtype = col.data_type.upper()
+    is_num = any(t in dtype for t in NUMERIC_TYPES)
+    if is_num and any(x in name for x in METRIC_KEYWORDS):
+        col.is_metric = True
+    else:
+        col.is_dimension = True
+
+
+def _generate_all(requests, progress: IndexingProgress):
+    """
+    requests - [(obj, prompt)]. Описания генерируются параллельно (CURATION_CONCURRENCY
+    одновременных запросов к Ollama) и кладутся в obj.description_ru.
+    Возвращает объекты, для которых описание получено.
+    """
+    if not requests:
+        return []
+    model_name = settings.OLLAMA_SUMMARY_MODEL
+    concurrency = getattr(settings, 'CURATION_CONCURRENCY', 4)
+
+    described = []
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='curate') as pool:
+        futures = {pool.submit(generate_ai_desc_safe, prompt, model_name): obj for obj, prompt in requests}
+        for future in as_completed(futures):
+            obj = futures[future]
+            desc = future.result()
+            if desc:
+                obj.description_ru = desc
+                described.append(obj)
+                progress.advance(done=1)
+            else:
+                progress.advance(failed=1)
+    return described
+
+
+def curate_tables(table_ids, progress_callback=None) -> dict:
+    """
+    Полная авто-настройка таблиц: включение, описание таблицы, эвристика колонок
+    и описания полезных колонок без описания. Таблицы идут по одной (запись после каждой),
+    вызовы LLM внутри таблицы - параллельно.
+    """
+    tables = list(SchemaTable.objects.filter(id__in=table_ids).prefetch_related(
+        Prefetch('columns', queryset=SchemaColumn.objects.order_by('id'), to_attr='all_columns')
+    ))
+
+    plans = []
+    for table in tables:
+        for col in table.all_columns:
+            _classify_column(col)
+        requests = [(table, _table_prompt(table))] if not table.description_ru else []
+        requests += [(col, _column_prompt(col, table.table_name))
+                     for col in table.all_columns if col.is_enabled and not col.description_ru]
+        plans.append((table, requests))
+
+    progress = IndexingProgress(total=sum(len(r) for _, r in plans), callback=progress_callback,
+                                label='AI-курирование')
+    progress.advance()  # Стартовый снимок (0/N)
+
+    enabled_total, columns_total = 0, 0
+    for table, requests in plans:
+        _generate_all(requests, progress)
+        table.is_enabled = True
+
+        with transaction.atomic():
+            table.save(update_fields=['is_enabled', 'description_ru'])
+            SchemaColumn.objects.bulk_update(
+                table.all_columns, ['is_enabled', 'is_metric', 'is_dimension', 'description_ru'], batch_size=500
+            )
+            table_id, column_ids = table.id, [c.id for c in table.all_columns]
+            transaction.on_commit(lambda t=table_id: invalidate_schema_caches([t]))
+            enqueue_reembedding(table_ids=[table_id], column_ids=column_ids)
+
+        enabled = sum(1 for c in table.all_columns if c.is_enabled)
+        enabled_total += enabled
+        columns_total += len(table.all_columns)
+        logger.info(f"Таблица {table.table_name}: включено {enabled} из {len(table.all_columns)} колонок.")
+
+    return {**progress.snapshot(), 'tables': len(tables), 'columns_enabled': enabled_total,
+            'columns_total': columns_total}
+
+
+def describe_columns(column_ids, progress_callback=None) -> dict:
+    """Описания выбранных колонок (подробный промпт), запись пачками по мере готовности."""
+    columns = list(SchemaColumn.objects.filter(id__in=column_ids).select_related('schema_table'))
+    write_chunk = getattr(settings, 'CURATION_WRITE_CHUNK', 100)
+
+    progress = IndexingProgress(total=len(columns), callback=progress_callback, label='AI-описания колонок')
+    progress.advance()
+
+    described = 0
+    for start in range(0, len(columns), write_chunk):
+        chunk = columns[start:start + write_chunk]
+        done = _generate_all([(col, _column_prompt_detailed(col)) for col in chunk], progress)
+        if not done:
+            continue
+        with transaction.atomic():
+            SchemaColumn.objects.bulk_update(done, ['description_ru'], batch_size=500)
+            table_ids, column_ids = {c.schema_table_id for c in done}, [c.id for c in done]
+            transaction.on_commit(lambda t=table_ids: invalidate_schema_caches(t))
+            enqueue_reembedding(column_ids=column_ids)
+        described += len(done)
+
+    return {**progress.snapshot(), 'described': described}
@@ -1,9 +1,15 @@
 import pandas as pd
 import logging
+import time
 from django.conf import settings
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from sqlalchemy.engine import URL
 from sqlalchemy.exc import OperationalError
+from . import engine_registry, query_cancel, replica_router
+from .result_cache import QueryResultCache
+from .query_guard import QueryPlanGuard
+from .query_limits import QueryLimits, concurrency_slot, override_timeout, check_result_size
+from .fetch import read_frame
 from .models import DataSource
 
 logger = logging.getLogger(__name__)
@@ -20,16 +26,67 @@ class DatabaseExecutor:
 
     def __init__(self, datasource: DataSource = None):
         # Если передан DataSource, используем его. Иначе - default из settings.
+        # Engine (пул соединений) берется из реестра процесса, а не создается заново:
+        # пароль расшифровывается и соединения открываются только при первом обращении.
+        # Лимиты источника (таймаут, строки, байты, параллельность); пустые - из settings
+        self.limits = QueryLimits.for_datasource(datasource)
+        self.datasource = datasource
         if datasource:
-            self.engine_url = self._get_datasource_url(datasource)
+            # Основной узел; запросы чата идут на реплики (replica_router), он - резерв
+            self.engine = self.engine_for(replica_router.primary_endpoint(datasource))
         else:
-            self.engine_url = self._get_default_url()
-
-        self.engine = create_engine(self.engine_url)
+            self.engine = engine_registry.get_engine(
+                key='default', fingerprint=f'default:{self.limits.timeout_ms}', url_factory=self._get_default_url,
+                timeout_ms=self.limits.timeout_ms,
+            )
+
+        self.engine_url = self.engine.url
+        self.datasource_id = datasource.id if datasource else None
+        self.current_endpoint = None  # узел последнего соединения (для отмены запроса)
+        # Результаты запросов общие для задачи чата и выгрузки Excel
+        self.result_cache = QueryResultCache(namespace=datasource.id if datasource else 'default')
+        self.plan_guard = QueryPlanGuard(datasource)
+        self.fetch_mode = getattr(settings, 'QUERY_FETCH_MODE', 'arrow')
+        # Оценка плана vs факт последнего execute_query (для подбора порогов)
+        self.last_plan = None
+
+    def engine_for(self, endpoint):
+        """Свой пул на каждый узел источника (основной host или реплика)."""
+        return engine_registry.get_engine(
+            key=engine_registry.datasource_key(self.datasource.id, endpoint.endpoint_id),
+            fingerprint=f"{engine_registry.datasource_fingerprint(self.datasource)}|{endpoint}",
+            url_factory=lambda: self._get_datasource_url(self.datasource, endpoint.host, endpoint.port),
+            timeout_ms=self.limits.timeout_ms,
+        )
 
-    def _get_datasource_url(self, ds: DataSource) -> URL:
+    def _connect(self):
+        """
+        Соединение с первым доступным узлом: реплики (по задержке или по кругу),
+        затем основной host. Недоступный узел временно исключается (failover).
+        Время выдачи соединения (с pre_ping) - замер задержки узла.
+        """
+        if self.datasource is None:
+            return self.engine.connect()
+
+        last_error = None
+        for endpoint in replica_router.read_endpoints(self.datasource):
+            started = time.monotonic()
+            try:
+                connection = self.engine_for(endpoint).connect()
+            except OperationalError as e:
+                replica_router.report_failure(self.datasource.id, endpoint)
+                last_error = e
+                continue
+            replica_router.report_success(self.datasource.id, endpoint, (time.monotonic() - started) * 1000)
+            self.current_endpoint = endpoint
+            return connection
+        raise last_error
+
+    def _get_datasource_url(self, ds: DataSource, host: str = None, port: int = None) -> URL:
         """Создает URL подключения на основе настроек DataSource из админки"""
-        logger.info(f"DatabaseExecutor: Подключение к внешнему источнику '{ds.name}' ({ds.host})")
+        host = host or ds.host
+        port = port or ds.port
+        logger.info(f"DatabaseExecutor: Новый пул для внешнего источника '{ds.name}' ({host}:{port})")
 
         driver_map = {
             'django.db.backends.postgresql': 'postgresql',
@@ -45,8 +102,8 @@ class DatabaseExecutor:
             drivername=driver,
             username=ds.db_user,
             password=ds.db_password,
-            host=ds.host,
-            port=ds.port,
+            host=host,
+            port=port,
             database=ds.db_name,
             query=query,
         )
@@ -79,7 +136,7 @@ class DatabaseExecutor:
         """
         Телохранитель:
         - запрещает SELECT *
-        - гарантирует наличие LIMIT
+        - гарантирует наличие LIMIT (max_rows источника)
         """
         upper_sql = sql_query.upper()
 
@@ -87,28 +144,58 @@ class DatabaseExecutor:
             raise PermissionError("Запрос заблокирован: `SELECT *` не разрешен.")
 
         if "LIMIT" not in upper_sql:
-            sql_query = f"{sql_query.rstrip(';')} LIMIT {QUERY_ROW_LIMIT};"
+            sql_query = f"{sql_query.rstrip(';')} LIMIT {self.limits.max_rows};"
 
         return sql_query
 
-    def execute_query(self, sql_query: str) -> pd.DataFrame:
+    def execute_query(self, sql_query: str, use_cache: bool = True, cancel_key: str = None) -> pd.DataFrame:
         """
         Выполняет безопасный SQL и возвращает DataFrame.
         Использует SQLAlchemy 2.x + pandas.read_sql_query + text().
+        Свежий результат того же запроса берется из кэша (QueryResultCache).
+        cancel_key (ID задачи Celery) - по нему запрос можно прервать из другого процесса
+        (query_cancel.cancel).
         """
+        self.last_plan = None
         try:
             sql_query_safe = self._apply_bodyguard_rules(sql_query)
+
+            if use_cache:
+                cached_df = self.result_cache.get(sql_query_safe)
+                if cached_df is not None:
+                    return cached_df
+
             logger.info(f"Выполнение SQL: {sql_query_safe[:200]}...")
 
-            with self.engine.connect() as connection:
-                # Для PostgreSQL задаём таймаут выполнения запроса
-                if 'postgresql' in str(self.engine_url):
-                    connection.execute(text(f"SET statement_timeout = {QUERY_TIMEOUT_MS}"))
+            # Таймаут уже задан на соединениях пула (query_limits.native_timeout_options)
+            with concurrency_slot(self.datasource_id, self.limits.max_concurrent, self.limits.timeout_ms), \
+                    self._connect() as connection:
+                # EXPLAIN до выполнения: тяжелый план -> быстрая понятная ошибка
+                # Телохранитель меняет запрос только дописывая LIMIT
+                sql_to_run, estimate = self.plan_guard.check(connection, sql_query_safe,
+                                                             limit_added=sql_query_safe != sql_query)
 
                 # ВАЖНО: оборачиваем строку в text() для SQLAlchemy 2.x
-                stmt = text(sql_query_safe)
-                df = pd.read_sql_query(stmt, con=connection)
-
+                stmt = text(sql_to_run)
+                started = time.monotonic()
+                with query_cancel.register(connection, cancel_key, self.datasource_id, self.current_endpoint):
+                    # arrow: пачками, Arrow-колонки, стоп по max_result_bytes (ai_core.fetch)
+                    df = read_frame(connection, stmt, mode=self.fetch_mode,
+                                    chunk_size=getattr(settings, 'QUERY_FETCH_CHUNK_SIZE', 2000),
+                                    max_bytes=self.limits.max_result_bytes)
+
+            check_result_size(df, self.limits.max_result_bytes)
+
+            if estimate is not None:
+                self.last_plan = {
+                    **estimate.as_dict(),
+                    'actual_rows': len(df),
+                    'actual_ms': int((time.monotonic() - started) * 1000),
+                }
+                logger.info("План vs факт", extra={'query_plan': self.last_plan})
+
+            if use_cache:
+                self.result_cache.set(sql_query_safe, df)
             return df
 
         except OperationalError as e:
@@ -117,3 +204,37 @@ class DatabaseExecutor:
         except Exception as e:
             logger.error(f"Ошибка SQL: {e}", exc_info=True)
             raise
+
+    def stream_query(self, sql_query: str, chunk_size: int = None, cancel_key: str = None):
+        """
+        Генератор для больших выгрузок: первым элементом отдает список колонок,
+        затем - пачки строк (list of tuples) по chunk_size.
+        Строки читаются серверным курсором (stream_results), поэтому память не растет
+        с размером результата. LIMIT по QUERY_ROW_LIMIT не добавляется - ограничение
+        только EXPORT_MAX_ROWS (если задан). Кэш результатов не используется.
+        """
+        chunk_size = chunk_size or getattr(settings, 'EXPORT_CHUNK_SIZE', 5000)
+        max_rows = getattr(settings, 'EXPORT_MAX_ROWS', None)
+
+        if 'SELECT *' in sql_query.upper():
+            raise PermissionError("Запрос заблокирован: `SELECT *` не разрешен.")
+        sql_query = sql_query.strip().rstrip(';')
+        if max_rows:
+            sql_query = f"SELECT * FROM ({sql_query}) AS export_q LIMIT {int(max_rows)}"
+
+        export_timeout_ms = getattr(settings, 'EXPORT_TIMEOUT_MS', self.limits.timeout_ms)
+        logger.info(f"Потоковая выгрузка SQL: {sql_query[:200]}...")
+        with concurrency_slot(self.datasource_id, self.limits.max_concurrent, export_timeout_ms), \
+                self._connect() as connection, \
+                override_timeout(connection, export_timeout_ms), \
+                query_cancel.register(connection, cancel_key, self.datasource_id, self.current_endpoint):
+            # stream_results: psycopg2 - именованный (серверный) курсор, MySQL - SSCursor
+            result = connection.execution_options(stream_results=True, max_row_buffer=chunk_size) \
+                .execute(text(sql_query))
+            yield list(result.keys())
+
+            rows_sent = 0
+            for partition in result.partitions(chunk_size):
+                rows_sent += len(partition)
+                yield [tuple(row) for row in partition]
+            logger.info(f"Потоковая выгрузка завершена: {rows_sent} строк.")
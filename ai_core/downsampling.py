@@ -0,0 +1,73 @@
+# Прореживание временных рядов для линейных графиков (Largest-Triangle-Three-Buckets).
+# Сохраняет форму ряда (пики и провалы), но в Plotly JSON уходит не больше n_out точек.
+import numpy as np
+import pandas as pd
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Индексы точек, выбранных LTTB. x - возрастающий числовой массив.
+    Первая и последняя точка сохраняются всегда. Внутри корзины площади треугольников
+    считаются векторно (NumPy); цикл только по корзинам, т.к. каждая зависит от предыдущей.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = x.astype(np.float64)
+    y = np.nan_to_num(y.astype(np.float64))
+
+    # Границы n_out - 2 корзин для точек 1..n-2
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+
+    # Среднее следующей корзины - третья вершина треугольника (для последней - последняя точка)
+    sums_x = np.add.reduceat(x[1:n - 1], starts - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], starts - 1)
+    counts = np.maximum(ends - starts, 1)
+    avg_x = np.append((sums_x / counts)[1:], x[-1])
+    avg_y = np.append((sums_y / counts)[1:], y[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    prev = 0
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        bx, by = x[start:end], y[start:end]
+        area = np.abs((x[prev] - avg_x[i]) * (by - y[prev]) - (x[prev] - bx) * (avg_y[i] - y[prev]))
+        prev = start + int(np.argmax(area))
+        selected[i + 1] = prev
+    return selected
+
+
+def _numeric_axis(values: pd.Series) -> np.ndarray | None:
+    """Ось X в числа: даты -> наносекунды, числа как есть. Иначе None (прореживать нельзя)."""
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        return values.to_numpy(dtype=np.float64, na_value=np.nan)
+    try:
+        converted = pd.to_datetime(values, utc=True, errors='raise')
+    except (ValueError, TypeError, OverflowError):
+        return None
+    if converted.isna().any():
+        return None  # NaT в int64 - минимальное int64, такая точка "уехала" бы в начало оси
+    return converted.to_numpy(dtype='datetime64[ns]', na_value=np.datetime64('NaT')).astype(np.int64)
+
+
+def downsample_line(df: pd.DataFrame, x_col: str, y_col: str, n_out: int) -> pd.DataFrame:
+    """
+    Возвращает df, прореженный по LTTB до n_out строк (сортировка по X).
+    Если X не приводится к числам/датам, прореживает по порядку строк.
+    """
+    if len(df) <= n_out:
+        return df
+
+    x = _numeric_axis(df[x_col])
+    if x is None or np.isnan(x.astype(np.float64)).any():
+        ordered = df.reset_index(drop=True)
+        x = np.arange(len(ordered))
+    else:
+        order = np.argsort(x, kind='stable')
+        ordered = df.iloc[order].reset_index(drop=True)
+        x = x[order]
+
+    y = ordered[y_col].to_numpy(dtype=np.float64, na_value=np.nan)
+    return ordered.iloc[lttb_indices(x, y, n_out)]
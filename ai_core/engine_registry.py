@@ -0,0 +1,104 @@
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+
+from . import query_limits
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_engines = {}  # key -> {'fingerprint', 'engine', 'last_used'}
+
+
+def datasource_fingerprint(ds) -> str:
+    """
+    Отпечаток параметров подключения. Пароль не расшифровываем: его смена
+    меняет updated_at (auto_now), и этого достаточно для пересоздания engine.
+    """
+    source = "|".join(str(v) for v in (
+        ds.engine, ds.host, ds.port, ds.db_name, ds.db_user, ds.updated_at,
+    ))
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def _pool_options(url) -> dict:
+    options = {
+        'pool_pre_ping': getattr(settings, 'DB_POOL_PRE_PING', True),
+        'pool_recycle': getattr(settings, 'DB_POOL_RECYCLE', 1800),
+    }
+    # SQLite использует свой пул без pool_size/max_overflow
+    if make_url(url).get_backend_name() != 'sqlite':
+        options['pool_size'] = getattr(settings, 'DB_POOL_SIZE', 5)
+        options['max_overflow'] = getattr(settings, 'DB_POOL_MAX_OVERFLOW', 5)
+    return options
+
+
+def get_engine(key: str, fingerprint: str, url_factory, timeout_ms: int = None, **engine_kwargs):
+    """
+    Один SQLAlchemy Engine (и пул соединений) на источник на процесс.
+    Если отпечаток изменился (DataSource отредактирован), старый engine закрывается.
+    url_factory вызывается только при создании engine.
+    timeout_ms - таймаут запроса, задается при подключении средствами СУБД (query_limits).
+    """
+    with _lock:
+        _dispose_idle()
+
+        entry = _engines.get(key)
+        if entry and entry['fingerprint'] == fingerprint:
+            entry['last_used'] = time.monotonic()
+            return entry['engine']
+
+        if entry:
+            logger.info(f"Engine '{key}': параметры подключения изменились, пересоздаю пул.")
+            entry['engine'].dispose()
+
+        url = url_factory()
+        backend_name = make_url(url).get_backend_name()
+        engine = create_engine(
+            url, **_pool_options(url), **query_limits.native_timeout_options(backend_name, timeout_ms),
+            **engine_kwargs
+        )
+        if backend_name == 'sqlite' and timeout_ms:
+            query_limits.install_sqlite_timeout(engine, timeout_ms)
+        _engines[key] = {'fingerprint': fingerprint, 'engine': engine, 'last_used': time.monotonic()}
+        logger.info(f"Engine '{key}': создан пул соединений.")
+        return engine
+
+
+def dispose(key: str):
+    with _lock:
+        entry = _engines.pop(key, None)
+    if entry:
+        entry['engine'].dispose()
+        logger.info(f"Engine '{key}': пул соединений закрыт.")
+
+
+def _dispose_idle():
+    """Закрывает пулы, которыми давно не пользовались (напр. выключенные источники)."""
+    idle_timeout = getattr(settings, 'DB_POOL_IDLE_TIMEOUT', 60 * 60)
+    now = time.monotonic()
+    for key in [k for k, e in _engines.items() if now - e['last_used'] > idle_timeout]:
+        _engines.pop(key)['engine'].dispose()
+        logger.info(f"Engine '{key}': закрыт по простою.")
+
+
+def datasource_key(datasource_id, endpoint_id=None) -> str:
+    """Ключ пула: основной узел - ds:{id}, отдельный узел (реплика) - ds:{id}:ep:{endpoint_id}."""
+    key = f"ds:{datasource_id}"
+    return key if endpoint_id is None else f"{key}:ep:{endpoint_id}"
+
+
+def dispose_datasource(datasource_id):
+    """Закрывает все пулы источника: основной узел и все реплики."""
+    key = datasource_key(datasource_id)
+    with _lock:
+        keys = [k for k in _engines if k == key or k.startswith(f"{key}:")]
+        entries = [(k, _engines.pop(k)) for k in keys]
+    for k, entry in entries:
+        entry['engine'].dispose()
+        logger.info(f"Engine '{k}': пул соединений закрыт.")
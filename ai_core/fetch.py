@@ -0,0 +1,105 @@
+# Чтение результата SQL в DataFrame.
+# legacy - один pd.read_sql_query: все строки сразу, текст в object-колонках.
+# arrow  - пачки по chunk_size через серверный курсор, колонки на pyarrow (общий тип по всем пачкам),
+#          чтение прекращается, как только превышен бюджет по байтам.
+import logging
+
+import pandas as pd
+import pyarrow as pa
+
+from .query_limits import ResultTooLargeError
+
+logger = logging.getLogger(__name__)
+
+_DECIMAL_TYPE_IDS = {pa.decimal128(1, 0).id, pa.decimal256(1, 0).id}
+
+
+def read_frame_legacy(connection, stmt) -> pd.DataFrame:
+    return pd.read_sql_query(stmt, con=connection)
+
+
+def _compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """NUMERIC/DECIMAL -> double: меньше памяти, и ChartGenerator/plotly считают колонку числом."""
+    for i, dtype in enumerate(df.dtypes):
+        if isinstance(dtype, pd.ArrowDtype) and dtype.pyarrow_dtype.id in _DECIMAL_TYPE_IDS:
+            df.isetitem(i, df.iloc[:, i].astype('double[pyarrow]'))
+    return df
+
+
+def read_frame_arrow(connection, stmt, chunk_size: int, max_bytes: int | None = None) -> pd.DataFrame:
+    """
+    Читает результат пачками. Пачки конвертируются в Arrow сразу, поэтому в памяти
+    не копится список Python-объектов на весь результат. При превышении max_bytes
+    курсор закрывается, не дочитывая строки (ResultTooLargeError).
+    """
+    chunks = pd.read_sql_query(
+        stmt,
+        con=connection.execution_options(stream_results=True, max_row_buffer=chunk_size),
+        chunksize=chunk_size,
+        dtype_backend='pyarrow',
+    )
+
+    columns, chunk_arrays = None, []
+    rows, used_bytes = 0, 0
+    try:
+        for chunk in chunks:
+            if columns is None:
+                columns = list(chunk.columns)
+            # По позиции, а не по имени: в результате JOIN имена колонок могут повторяться
+            chunk_arrays.append([_to_arrow(chunk.iloc[:, i]) for i in range(len(columns))])
+            rows += len(chunk)
+            used_bytes += int(chunk.memory_usage(deep=True).sum())
+            if max_bytes and used_bytes > max_bytes:
+                raise ResultTooLargeError(
+                    f"Результат слишком большой (более {max_bytes / 1024 / 1024:.1f} МБ, "
+                    f"прочитано {rows} строк). Уточните вопрос или используйте выгрузку."
+                )
+    finally:
+        chunks.close()
+
+    if columns is None:
+        return pd.DataFrame()
+
+    data = {}
+    for i in range(len(columns)):
+        arrays = [chunk[i] for chunk in chunk_arrays]
+        target = _common_type(arrays)
+        data[i] = pd.Series(pd.arrays.ArrowExtensionArray(
+            # safe=False: int64 -> double для больших целых без ошибки потери точности
+            pa.chunked_array([a.cast(target, safe=False) for a in arrays], type=target)
+        ))
+    df = pd.DataFrame(data)
+    df.columns = columns
+    return _compact_dtypes(df)
+
+
+def _to_arrow(series: pd.Series) -> pa.Array:
+    arr = pa.array(series, from_pandas=True)
+    # Колонка pd.ArrowDtype отдает ChunkedArray
+    return arr.combine_chunks() if isinstance(arr, pa.ChunkedArray) else arr
+
+
+def _common_type(arrays) -> pa.DataType:
+    """
+    Общий тип колонки по всем пачкам. Arrow выводит тип по каждой пачке отдельно:
+    пачка из одних NULL получает случайный тип (string/null), а целые и дробные
+    значения одной колонки - int64 и double. Учитываются только пачки со значениями;
+    числа разных типов -> double, несовместимые типы -> строка.
+    """
+    typed = list(dict.fromkeys(a.type for a in arrays if a.null_count < len(a)))
+    if not typed:
+        return arrays[0].type
+    if len(typed) == 1:
+        return typed[0]
+    if all(pa.types.is_integer(t) or pa.types.is_floating(t) or pa.types.is_decimal(t) for t in typed):
+        return pa.float64()
+    try:
+        return pa.unify_schemas([pa.schema([('c', t)]) for t in typed], promote_options='permissive').field(0).type
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return pa.string()
+
+
+def read_frame(connection, stmt, mode: str, chunk_size: int, max_bytes: int | None = None) -> pd.DataFrame:
+    if mode == 'arrow':
+        return read_frame_arrow(connection, stmt, chunk_size, max_bytes)
+    return read_frame_legacy(connection, stmt)
@@ -0,0 +1,171 @@
+# Отслеживание изменений источников по метаданным каталога (без чтения самих таблиц).
+# schema - хэш колонок таблицы из pg_catalog / information_schema / sqlite_master;
+# data   - счетчики pg_stat_user_tables (ins/upd/del) или UPDATE_TIME в MySQL.
+# Токены пишутся в SchemaTable (schema_version - версия, по которой отражены колонки,
+# data_version - последняя увиденная версия данных) и в кэш для ключей QueryResultCache.
+import hashlib
+import logging
+
+import sqlparse
+from django.core.cache import cache
+from sqlalchemy import inspect, text
+from sqlparse import tokens as T
+
+from .models import SchemaTable
+
+logger = logging.getLogger(__name__)
+
+DATA_TOKENS_KEY = 'freshness:data:{}'
+
+_PG_SCHEMA_SQL = """
+SELECT c.relname,
+       md5(string_agg(a.attname || ':' || format_type(a.atttypid, a.atttypmod) || ':' || a.attnotnull::text,
+                      ',' ORDER BY a.attnum))
+FROM pg_catalog.pg_class c
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_catalog.pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p')  -- как Inspector.get_table_names()
+GROUP BY c.relname
+"""
+
+_PG_DATA_SQL = """
+SELECT relname, n_tup_ins, n_tup_upd, n_tup_del
+FROM pg_catalog.pg_stat_user_tables
+WHERE schemaname = current_schema()
+"""
+
+_MYSQL_SCHEMA_SQL = """
+SELECT TABLE_NAME,
+       MD5(GROUP_CONCAT(CONCAT(COLUMN_NAME, ':', COLUMN_TYPE, ':', IS_NULLABLE)
+                        ORDER BY ORDINAL_POSITION SEPARATOR ','))
+FROM information_schema.COLUMNS
+WHERE TABLE_SCHEMA = DATABASE()
+  AND TABLE_NAME IN (SELECT TABLE_NAME FROM information_schema.TABLES
+                     WHERE TABLE_SCHEMA = DATABASE() AND TABLE_TYPE = 'BASE TABLE')
+GROUP BY TABLE_NAME
+"""
+
+_MYSQL_DATA_SQL = """
+SELECT TABLE_NAME, UPDATE_TIME
+FROM information_schema.TABLES
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_TYPE = 'BASE TABLE'
+"""
+
+
+def schema_hashes(connection) -> dict | None:
+    """
+    {table_name: хэш колонок} одним запросом к каталогу. None - диалект не поддерживается.
+    Только базовые таблицы - те же, что отдает list_source_tables (get_table_names).
+    """
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        rows = connection.execute(text(_PG_SCHEMA_SQL))
+    elif dialect == 'mysql':
+        # По умолчанию GROUP_CONCAT обрезается до 1024 байт - для широких таблиц хэш не увидел бы изменений
+        connection.execute(text("SET SESSION group_concat_max_len = 1048576"))
+        rows = connection.execute(text(_MYSQL_SCHEMA_SQL))
+    elif dialect == 'sqlite':
+        rows = connection.execute(text("SELECT name, sql FROM sqlite_master WHERE type = 'table'"))
+        return {name: hashlib.md5((sql or '').encode('utf-8')).hexdigest() for name, sql in rows}
+    else:
+        return None
+    return {name: digest for name, digest in rows}
+
+
+def data_tokens(connection) -> dict | None:
+    """
+    {table_name: токен версии данных}. None - счетчиков нет (SQLite).
+    Счетчики pg_stat_user_tables локальны для узла: на реплике они не растут,
+    поэтому запрашивать нужно основной узел.
+    """
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        rows = connection.execute(text(_PG_DATA_SQL))
+        return {name: f"{ins}:{upd}:{dlt}" for name, ins, upd, dlt in rows}
+    if dialect == 'mysql':
+        try:
+            # MySQL 8 кэширует статистику information_schema (по умолчанию сутки)
+            connection.execute(text("SET SESSION information_schema_stats_expiry = 0"))
+        except Exception:
+            pass  # MySQL 5.7 / MariaDB: переменной нет, UPDATE_TIME и так актуален
+        rows = connection.execute(text(_MYSQL_DATA_SQL))
+        # UPDATE_TIME = NULL (нет изменений с рестарта / не поддерживается движком) - версия неизвестна
+        return {name: updated.isoformat() for name, updated in rows if updated is not None}
+    return None
+
+
+def check_datasource(datasource) -> dict:
+    """
+    Сравнивает каталог источника с сохраненными токенами.
+    Версии данных обновляются сразу (SchemaTable.data_version + кэш для QueryResultCache).
+    Версию схемы пишет только синхронизация (apply_schema_diff) - здесь лишь
+    определяется, нужна ли она: изменились колонки, появились или пропали таблицы.
+    """
+    from .db_executor import DatabaseExecutor
+    from .services import list_source_tables
+
+    engine = DatabaseExecutor(datasource=datasource).engine
+    with engine.connect() as connection:
+        schema = schema_hashes(connection)
+        data = data_tokens(connection)
+        # Новые таблицы - только те, что взяла бы синхронизация (без служебных и представлений)
+        source_tables = set(list_source_tables(inspect(connection))) if schema is not None else set()
+
+    tables = list(SchemaTable.objects.filter(data_source=datasource)
+                  .only('id', 'table_name', 'schema_version', 'data_version'))
+    known = {t.table_name for t in tables}
+
+    schema_changed = []
+    if schema is not None:
+        schema_changed = [t.table_name for t in tables if t.schema_version != schema.get(t.table_name)]
+        schema_changed += [name for name in source_tables if name not in known]
+
+    data_changed = []
+    if data is not None:
+        updated = []
+        for table in tables:
+            token = data.get(table.table_name)
+            if token == table.data_version:
+                continue
+            if table.data_version is not None:
+                data_changed.append(table.table_name)
+            table.data_version = token
+            updated.append(table)
+        SchemaTable.objects.bulk_update(updated, ['data_version'], batch_size=1000)
+        cache.set(DATA_TOKENS_KEY.format(datasource.id), {n: v for n, v in data.items() if n in known},
+                  timeout=None)
+
+    if schema_changed or data_changed:
+        logger.info(f"Свежесть {datasource.name}: схема изменилась у {len(schema_changed)} таблиц, "
+                    f"данные - у {len(data_changed)}.")
+    return {'schema_changed': schema_changed, 'data_changed': data_changed}
+
+
+def referenced_tables(sql_query: str, candidates) -> set:
+    """Имена из candidates, встречающиеся в SQL как идентификаторы (в кавычках или без)."""
+    found = set()
+    for stmt in sqlparse.parse(sql_query):
+        for token in stmt.flatten():
+            # Имя таблицы может совпасть с ключевым словом (user, date) - тоже проверяем
+            if token.ttype in T.Name or token.ttype in T.String.Symbol or token.is_keyword:
+                name = token.value.strip('"`')
+                if name in candidates:
+                    found.add(name)
+    return found
+
+
+def data_version_for_sql(datasource_id, sql_query: str) -> str:
+    """
+    Версии данных таблиц запроса для ключа кэша результатов: после изменения
+    таблицы ключ меняется, и старая запись просто вытесняется по TTL/LRU.
+    Пустая строка - версии неизвестны (проверка еще не запускалась, SQLite).
+    """
+    try:
+        tokens = cache.get(DATA_TOKENS_KEY.format(datasource_id))
+    except Exception as e:
+        logger.warning(f"Версии данных недоступны: {e}")
+        return ''
+    if not tokens:
+        return ''
+    names = referenced_tables(sql_query, tokens)
+    return ",".join(f"{name}={tokens[name]}" for name in sorted(names))
@@ -0,0 +1,81 @@
+import gc
+import os
+import statistics
+import tempfile
+import time
+
+import pyarrow as pa
+from django.core.management.base import BaseCommand
+from sqlalchemy import create_engine, text
+
+from ai_core.db_executor import DatabaseExecutor
+from ai_core.fetch import read_frame_legacy, read_frame_arrow
+from ai_core.models import DataSource
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает чтение результата SQL: legacy (pd.read_sql_query) и arrow '
+            '(пачки + pyarrow). Без --sql - синтетическая широкая таблица в SQLite.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sql', help='Запрос к активному DataSource (иначе синтетика).')
+        parser.add_argument('--rows', type=int, default=200_000, help='Строк в синтетической таблице.')
+        parser.add_argument('--repeat', type=int, default=3, help='Повторов каждого режима.')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if options['sql']:
+            datasource = DataSource.objects.filter(is_active=True).first()
+            engine = DatabaseExecutor(datasource=datasource).engine
+            sql = options['sql']
+            self.stdout.write(f"Источник: {datasource or 'default'}")
+        else:
+            path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+            engine = create_engine(f"sqlite:///{path}")
+            sql = self._build_synthetic(engine, options['rows'])
+            self.stdout.write(f"Синтетика: {options['rows']} строк, {path}")
+
+        modes = {
+            'legacy': lambda conn: read_frame_legacy(conn, text(sql)),
+            'arrow': lambda conn: read_frame_arrow(conn, text(sql), chunk_size=options['chunk_size']),
+        }
+        for name, read in modes.items():
+            timings, frame_bytes, rows = [], 0, 0
+            for _ in range(options['repeat']):
+                gc.collect()
+                started = time.perf_counter()
+                with engine.connect() as connection:
+                    df = read(connection)
+                timings.append(time.perf_counter() - started)
+                frame_bytes, rows = int(df.memory_usage(deep=True).sum()), len(df)
+                del df
+
+            self.stdout.write(
+                f"{name:>6}: {rows} строк, медиана {statistics.median(timings) * 1000:.0f} мс, "
+                f"DataFrame {frame_bytes / 1024 / 1024:.1f} МБ"
+                + (f", пул Arrow {pa.total_allocated_bytes() / 1024 / 1024:.1f} МБ" if name == 'arrow' else "")
+            )
+
+        engine.dispose()
+        self.stdout.write(self.style.SUCCESS("Готово."))
+
+    def _build_synthetic(self, engine, rows: int) -> str:
+        """Типичный ответ DWH: дата, пара повторяющихся измерений, длинный текст и метрики."""
+        cities = ['Астана', 'Алматы', 'Шымкент', 'Караганда', 'Актобе']
+        channels = ['ТВ', 'Радио', 'OOH', 'Digital']
+        with engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE facts (day TEXT, city TEXT, channel TEXT, campaign TEXT, spend REAL, impressions INTEGER)"
+            ))
+            conn.execute(
+                text("INSERT INTO facts VALUES (:day, :city, :channel, :campaign, :spend, :impressions)"),
+                [{
+                    'day': f"2025-{i % 12 + 1:02d}-{i % 28 + 1:02d}",
+                    'city': cities[i % len(cities)],
+                    'channel': channels[i % len(channels)],
+                    'campaign': f"Кампания {i % 500} - весенняя акция бренда, флайт {i % 7}",
+                    'spend': i * 1.37,
+                    'impressions': i * 11,
+                } for i in range(rows)]
+            )
+        return "SELECT day, city, channel, campaign, spend, impressions FROM facts"
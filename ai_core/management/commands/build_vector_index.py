@@ -4,7 +4,11 @@ from ai_core.services import run_vector_indexing
 class Command(BaseCommand):
     help = 'Запускает индексацию (обертка над сервисом).'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Переиндексировать всё, даже если текст не менялся.')
+
     def handle(self, *args, **options):
         self.stdout.write("Запуск через сервис...")
-        result = run_vector_indexing()
-        self.stdout.write(self.style.SUCCESS(result))
\ No newline at end of file
+        result = run_vector_indexing(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(result))
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.7 on 2025-12-02 11:20
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+import pgvector.django.indexes
+import pgvector.django.vector
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_core', '0004_auto_20251126_1429'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SQLCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question', models.TextField(verbose_name='Вопрос')),
+                ('embedding', pgvector.django.vector.VectorField(dimensions=768)),
+                ('schema_version', models.CharField(max_length=64, verbose_name='Версия схемы')),
+                ('tables', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), default=list, help_text='Таблицы из промпта', size=None)),
+                ('sql_query', models.TextField(verbose_name='Проверенный SQL')),
+                ('hit_count', models.PositiveIntegerField(default=0, verbose_name='Попаданий')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('data_source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sql_cache', to='ai_core.datasource')),
+            ],
+            options={
+                'verbose_name': '4. Кэш SQL',
+                'verbose_name_plural': '4. Кэш SQL',
+                'indexes': [pgvector.django.indexes.HnswIndex(ef_construction=64, fields=['embedding'], m=16, name='sql_cache_question_index', opclasses=['vector_cosine_ops'])],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2025-12-04 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_core', '0005_sqlcacheentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='schematable',
+            name='embedding_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='schemacolumn',
+            name='embedding_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.7 on 2025-12-05 12:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_core', '0006_embedding_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasource',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='Изменен'),
+            preserve_default=False,
+        ),
+    ]
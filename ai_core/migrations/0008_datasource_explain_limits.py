@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_core', '0007_datasource_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasource',
+            name='explain_max_cost',
+            field=models.FloatField(blank=True, help_text='Оценка планировщика (Total Cost / query_cost)', null=True, verbose_name='Макс. стоимость плана'),
+        ),
+        migrations.AddField(
+            model_name='datasource',
+            name='explain_max_rows',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='Макс. строк по плану'),
+        ),
+        migrations.AddField(
+            model_name='datasource',
+            name='explain_action',
+            field=models.CharField(choices=[('reject', 'Отклонять запрос'), ('limit', 'Переписывать с LIMIT (по строкам)')], default='reject', max_length=10, verbose_name='При превышении строк'),
+        ),
+    ]
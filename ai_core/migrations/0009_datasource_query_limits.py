@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_core', '0008_datasource_explain_limits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasource',
+            name='query_timeout_ms',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Таймаут запроса, мс'),
+        ),
+        migrations.AddField(
+            model_name='datasource',
+            name='max_rows',
+            field=models.PositiveIntegerField(blank=True, help_text='LIMIT, который добавляется к запросу без LIMIT', null=True, verbose_name='Макс. строк в ответе'),
+        ),
+        migrations.AddField(
+            model_name='datasource',
+            name='max_result_bytes',
+            field=models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Макс. объем результата, байт'),
+        ),
+        migrations.AddField(
+            model_name='datasource',
+            name='max_concurrent_queries',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Макс. параллельных запросов'),
+        ),
+    ]
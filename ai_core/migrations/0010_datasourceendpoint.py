@@ -0,0 +1,30 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_core', '0009_datasource_query_limits'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataSourceEndpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('replica', 'Реплика (запросы чата)'), ('introspection', 'Интроспекция схемы')], default='replica', max_length=20, verbose_name='Назначение')),
+                ('host', models.CharField(max_length=255)),
+                ('port', models.PositiveIntegerField(default=5432)),
+                ('is_enabled', models.BooleanField(default=True, verbose_name='Включен')),
+                ('is_healthy', models.BooleanField(default=True, editable=False, verbose_name='Доступен')),
+                ('last_latency_ms', models.FloatField(blank=True, editable=False, null=True, verbose_name='Задержка, мс')),
+                ('last_checked', models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Проверен')),
+                ('data_source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='endpoints', to='ai_core.datasource')),
+            ],
+            options={
+                'verbose_name': 'Узел источника',
+                'verbose_name_plural': 'Узлы источника',
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_core', '0010_datasourceendpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchemaSyncJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка')], default='pending', max_length=20)),
+                ('task_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('table_names', models.JSONField(blank=True, default=list)),
+                ('tables_done', models.PositiveIntegerField(default=0)),
+                ('stats', models.JSONField(blank=True, default=dict)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('data_source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_jobs', to='ai_core.datasource')),
+            ],
+            options={
+                'verbose_name': 'Синхронизация схемы',
+                'verbose_name_plural': 'Синхронизации схемы',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_core', '0011_schemasyncjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='schematable',
+            name='schema_version',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='schematable',
+            name='data_version',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_core', '0012_schematable_versions'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.CreateModel(
+            name='ColumnValue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.CharField(max_length=255)),
+                ('frequency', models.PositiveIntegerField(default=0, verbose_name='Частота в выборке')),
+                ('column', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sample_values', to='ai_core.schemacolumn')),
+            ],
+            options={
+                'verbose_name': 'Значение измерения',
+                'verbose_name_plural': 'Значения измерений',
+                'unique_together': {('column', 'value')},
+                'indexes': [django.contrib.postgres.indexes.GinIndex(fields=['value'], name='column_value_trgm_index', opclasses=['gin_trgm_ops'])],
+            },
+        ),
+    ]
@@ -1,6 +1,8 @@
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 from encrypted_fields.fields import EncryptedTextField
-from pgvector.django import VectorField
+from pgvector.django import VectorField, HnswIndex
 
 
 class DataSource(models.Model):
@@ -23,6 +25,26 @@ class DataSource(models.Model):
 
     is_active = models.BooleanField(default=True, help_text="Используется ли этот источник?")
     last_inspected = models.DateTimeField("Последняя инспекция", blank=True, null=True, editable=False)
+    # Меняется при любом сохранении из админки -> пересоздание пула соединений (engine_registry)
+    updated_at = models.DateTimeField("Изменен", auto_now=True)
+
+    # Пороги EXPLAIN перед выполнением (ai_core.query_guard). Пусто - значения из settings
+    EXPLAIN_ACTIONS = [
+        ('reject', 'Отклонять запрос'),
+        ('limit', 'Переписывать с LIMIT (по строкам)'),
+    ]
+    explain_max_cost = models.FloatField("Макс. стоимость плана", blank=True, null=True,
+                                         help_text="Оценка планировщика (Total Cost / query_cost)")
+    explain_max_rows = models.BigIntegerField("Макс. строк по плану", blank=True, null=True)
+    explain_action = models.CharField("При превышении строк", max_length=10, choices=EXPLAIN_ACTIONS,
+                                      default='reject')
+
+    # Лимиты выполнения (ai_core.query_limits). Пусто - значения из settings
+    query_timeout_ms = models.PositiveIntegerField("Таймаут запроса, мс", blank=True, null=True)
+    max_rows = models.PositiveIntegerField("Макс. строк в ответе", blank=True, null=True,
+                                           help_text="LIMIT, который добавляется к запросу без LIMIT")
+    max_result_bytes = models.PositiveBigIntegerField("Макс. объем результата, байт", blank=True, null=True)
+    max_concurrent_queries = models.PositiveSmallIntegerField("Макс. параллельных запросов", blank=True, null=True)
 
     def __str__(self):
         return f"{self.name} ({self.db_user}@{self.host})"
@@ -32,6 +54,79 @@ class DataSource(models.Model):
         verbose_name_plural = "1. Источники данных"
 
 
+class DataSourceEndpoint(models.Model):
+    """
+    Дополнительный узел источника (реплика для чтения или узел для интроспекции).
+    Основной host/port DataSource - резерв, если все реплики недоступны.
+    """
+    ROLES = [
+        ('replica', 'Реплика (запросы чата)'),
+        ('introspection', 'Интроспекция схемы'),
+    ]
+
+    data_source = models.ForeignKey(DataSource, on_delete=models.CASCADE, related_name="endpoints")
+    role = models.CharField("Назначение", max_length=20, choices=ROLES, default='replica')
+    host = models.CharField(max_length=255)
+    port = models.PositiveIntegerField(default=5432)
+    is_enabled = models.BooleanField("Включен", default=True)
+
+    # Заполняет периодическая проверка (ai_core.tasks.task_check_endpoints)
+    is_healthy = models.BooleanField("Доступен", default=True, editable=False)
+    last_latency_ms = models.FloatField("Задержка, мс", blank=True, null=True, editable=False)
+    last_checked = models.DateTimeField("Проверен", blank=True, null=True, editable=False)
+
+    def __str__(self):
+        return f"{self.get_role_display()}: {self.host}:{self.port}"
+
+    class Meta:
+        verbose_name = "Узел источника"
+        verbose_name_plural = "Узлы источника"
+
+
+class SchemaSyncJob(models.Model):
+    """
+    Фоновая синхронизация схемы одного источника (ai_core.tasks.task_sync_schema).
+    Список таблиц фиксируется при первом запуске, дальше таблицы идут пачками:
+    tables_done пишется в одной транзакции с пачкой, поэтому после сбоя
+    повторный запуск продолжает с первой необработанной таблицы.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Готово'),
+        ('failed', 'Ошибка'),
+    )
+
+    data_source = models.ForeignKey(DataSource, on_delete=models.CASCADE, related_name="sync_jobs")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    task_id = models.CharField(max_length=255, null=True, blank=True)
+    table_names = models.JSONField(default=list, blank=True)
+    tables_done = models.PositiveIntegerField(default=0)
+    stats = models.JSONField(default=dict, blank=True)  # счетчики apply_schema_diff по всем пачкам
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Синхронизация {self.data_source.name} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in ('done', 'failed')
+
+    @property
+    def progress_percent(self) -> int:
+        if not self.table_names:
+            return 0
+        return int(self.tables_done * 100 / len(self.table_names))
+
+    class Meta:
+        verbose_name = "Синхронизация схемы"
+        verbose_name_plural = "Синхронизации схемы"
+        ordering = ['-created_at']
+
+
 class SchemaTable(models.Model):
     data_source = models.ForeignKey(DataSource, on_delete=models.CASCADE, related_name="tables")
     table_name = models.CharField(max_length=255)
@@ -44,6 +139,13 @@ class SchemaTable(models.Model):
     # (НОВОЕ ПОЛЕ) Векторное представление описания
     # nomic-embed-text выдает векторы размером 768
     embedding = VectorField(dimensions=768, null=True, blank=True)
+    # Хэш текста (+ модели), из которого построен embedding: неизменные строки не переиндексируем
+    embedding_hash = models.CharField(max_length=64, blank=True, null=True, editable=False)
+
+    # Токены свежести (ai_core.freshness): хэш каталога, по которому отражены колонки,
+    # и последняя увиденная версия данных (счетчики изменений / UPDATE_TIME)
+    schema_version = models.CharField(max_length=64, blank=True, null=True, editable=False)
+    data_version = models.CharField(max_length=64, blank=True, null=True, editable=False)
 
     is_enabled = models.BooleanField(default=False, help_text="Включить эту таблицу для ИИ?")
 
@@ -71,6 +173,7 @@ class SchemaColumn(models.Model):
 
     # (НОВОЕ ПОЛЕ)
     embedding = VectorField(dimensions=768, null=True, blank=True)
+    embedding_hash = models.CharField(max_length=64, blank=True, null=True, editable=False)
 
     is_enabled = models.BooleanField(default=True, help_text="Включить эту колонку для ИИ?")
 
@@ -80,4 +183,64 @@ class SchemaColumn(models.Model):
     class Meta:
         verbose_name = "3. Курируемый Столбец"
         verbose_name_plural = "3. Курируемые Столбцы"
-        unique_together = ('schema_table', 'column_name')
\ No newline at end of file
+        unique_together = ('schema_table', 'column_name')
+
+class ColumnValue(models.Model):
+    """
+    Значение низкокардинального измерения (SchemaColumn.is_dimension) из выборки источника
+    (ai_core.value_index). По триграммному индексу литерал из вопроса ("Алматы")
+    находит колонку и точное написание значения.
+    """
+    column = models.ForeignKey(SchemaColumn, on_delete=models.CASCADE, related_name="sample_values")
+    value = models.CharField(max_length=255)
+    frequency = models.PositiveIntegerField("Частота в выборке", default=0)
+
+    def __str__(self):
+        return f"{self.column}: {self.value}"
+
+    class Meta:
+        verbose_name = "Значение измерения"
+        verbose_name_plural = "Значения измерений"
+        unique_together = ('column', 'value')
+        indexes = [
+            GinIndex(
+                name='column_value_trgm_index',
+                fields=['value'],
+                opclasses=['gin_trgm_ops']
+            ),
+        ]
+
+class SQLCacheEntry(models.Model):
+    """
+    Семантический кэш "вопрос -> SQL".
+    Похожий вопрос (по косинусной близости эмбеддинга) переиспользует
+    уже проверенный SQL и не вызывает LLM повторно.
+    """
+    data_source = models.ForeignKey(DataSource, on_delete=models.CASCADE, related_name="sql_cache")
+    question = models.TextField("Вопрос")
+    embedding = VectorField(dimensions=768)
+
+    # Отпечаток DDL таблиц, по которым был сгенерирован SQL
+    schema_version = models.CharField("Версия схемы", max_length=64)
+    tables = ArrayField(models.CharField(max_length=255), default=list, help_text="Таблицы из промпта")
+    sql_query = models.TextField("Проверенный SQL")
+
+    hit_count = models.PositiveIntegerField("Попаданий", default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return self.question[:80]
+
+    class Meta:
+        verbose_name = "4. Кэш SQL"
+        verbose_name_plural = "4. Кэш SQL"
+        indexes = [
+            HnswIndex(
+                name='sql_cache_question_index',
+                fields=['embedding'],
+                m=16,
+                ef_construction=64,
+                opclasses=['vector_cosine_ops']
+            ),
+        ]
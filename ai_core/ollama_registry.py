@@ -0,0 +1,78 @@
+import logging
+import threading
+import time
+
+import ollama
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL_BASE = 'nomic-embed-text'
+
+_lock = threading.Lock()
+_clients = {}  # host -> ollama.Client
+_models = {}  # host -> (monotonic timestamp, [имена моделей])
+
+
+def _default_host() -> str:
+    return getattr(settings, 'OLLAMA_HOST', 'http://localhost:11434')
+
+
+def get_client(host: str = None) -> ollama.Client:
+    """
+    Один ollama.Client (и его пул HTTP-соединений httpx) на хост на процесс.
+    Клиент переиспользуется всеми задачами Celery и действиями админки.
+    """
+    host = host or _default_host()
+    client = _clients.get(host)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(host)
+        if client is None:
+            logger.info(f"Ollama: создаю общий клиент для {host}")
+            client = ollama.Client(host=host)
+            _clients[host] = client
+        return client
+
+
+def _list_models(host: str) -> list:
+    refresh = getattr(settings, 'OLLAMA_MODELS_REFRESH_SECONDS', 300)
+    cached = _models.get(host)
+    if cached and time.monotonic() - cached[0] < refresh:
+        return cached[1]
+
+    try:
+        response = get_client(host).list()
+        names = [m['model'] for m in response['models']]
+    except Exception as e:
+        if cached:
+            logger.warning(f"Ollama: не удалось обновить список моделей ({e}), использую кэш.")
+            return cached[1]
+        raise ConnectionError(f"Ollama недоступна по адресу {host}: {e}")
+
+    with _lock:
+        _models[host] = (time.monotonic(), names)
+    return names
+
+
+def resolve_model(base_name: str, host: str = None) -> str:
+    """
+    Находит полное имя модели (с тегом) по базовому имени, напр.
+    'nomic-embed-text' -> 'nomic-embed-text:latest'.
+    Список моделей кэшируется на OLLAMA_MODELS_REFRESH_SECONDS.
+    Бросает ConnectionError, если Ollama недоступна и кэша еще нет.
+    """
+    host = host or _default_host()
+    for name in _list_models(host):
+        if base_name in name:
+            return name
+    return base_name
+
+
+def reset():
+    """Сбрасывает клиентов и кэш моделей (напр. после смены OLLAMA_HOST)."""
+    with _lock:
+        _clients.clear()
+        _models.clear()
@@ -0,0 +1,104 @@
+# Кооперативная отмена запросов к DataSource.
+# Воркер регистрирует ID серверного процесса (backend PID / CONNECTION_ID) своего запроса,
+# веб-процесс по нему просит саму БД прервать запрос - воркер получает ошибку
+# и завершается штатно, без revoke(terminate=True).
+import logging
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'running_query'
+REGISTRY_TTL = 60 * 60  # сек, страховка на случай падения воркера
+
+
+def _key(cancel_key) -> str:
+    return f"{KEY_PREFIX}:{cancel_key}"
+
+
+def branch_key(task_id, datasource_id) -> str:
+    """Ключ отмены подзапроса задачи к одному источнику (ответ может идти в несколько)."""
+    return f"{task_id}:{datasource_id}"
+
+
+def _backend_id(connection):
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        return connection.execute(text("SELECT pg_backend_pid()")).scalar()
+    if dialect == 'mysql':
+        return connection.execute(text("SELECT CONNECTION_ID()")).scalar()
+    # SQLite работает внутри процесса воркера - прерывается через progress handler
+    return None
+
+
+@contextmanager
+def register(connection, cancel_key, datasource_id, endpoint=None):
+    """
+    Пока выполняется блок, запрос на этом соединении можно отменить по cancel_key.
+    endpoint (replica_router.Endpoint) - узел, где выполняется запрос: отмена идет туда же.
+    """
+    if not cancel_key:
+        yield
+        return
+
+    backend_id = None
+    try:
+        backend_id = _backend_id(connection)
+        if backend_id is not None:
+            cache.set(_key(cancel_key), {
+                'datasource_id': datasource_id,
+                'backend_id': int(backend_id),
+                'dialect': connection.dialect.name,
+                'endpoint': endpoint.as_dict() if endpoint else None,
+            }, timeout=REGISTRY_TTL)
+    except Exception as e:
+        logger.warning(f"Не удалось зарегистрировать запрос для отмены ({cancel_key}): {e}")
+
+    try:
+        yield
+    finally:
+        if backend_id is not None:
+            cache.delete(_key(cancel_key))
+
+
+def cancel(cancel_key) -> bool:
+    """
+    Прерывает запрос, зарегистрированный под cancel_key: pg_cancel_backend / KILL QUERY.
+    Соединение остается живым и возвращается в пул. True - если команда отправлена.
+    """
+    entry = cache.get(_key(cancel_key))
+    if not entry:
+        return False
+
+    # Импорт здесь: db_executor импортирует этот модуль
+    from .db_executor import DatabaseExecutor
+    from .models import DataSource
+    from .replica_router import Endpoint
+
+    datasource = None
+    if entry['datasource_id'] is not None:
+        datasource = DataSource.objects.filter(id=entry['datasource_id']).defer('db_password').first()
+        if datasource is None:
+            return False
+
+    try:
+        executor = DatabaseExecutor(datasource=datasource)
+        engine = executor.engine
+        if datasource is not None and entry.get('endpoint'):
+            engine = executor.engine_for(Endpoint(**entry['endpoint']))
+        with engine.connect() as connection:
+            if entry['dialect'] == 'postgresql':
+                connection.execute(text("SELECT pg_cancel_backend(:pid)"), {'pid': entry['backend_id']})
+            elif entry['dialect'] == 'mysql':
+                connection.execute(text(f"KILL QUERY {int(entry['backend_id'])}"))
+            else:
+                return False
+        logger.info(f"Запрос {cancel_key} прерван на стороне БД (backend {entry['backend_id']}).")
+        return True
+    except Exception as e:
+        logger.warning(f"Не удалось прервать запрос {cancel_key}: {e}")
+        return False
+    finally:
+        cache.delete(_key(cancel_key))
@@ -0,0 +1,117 @@
+# Проверка плана (EXPLAIN) перед выполнением сгенерированного SQL.
+# Декартово произведение или полный скан факт-таблицы отсекаются за миллисекунды,
+# а не после QUERY_TIMEOUT_MS нагрузки на DWH.
+import json
+import logging
+from dataclasses import dataclass, asdict
+
+from django.conf import settings
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+
+class QueryTooExpensiveError(PermissionError):
+    """План запроса превышает пороги источника. PermissionError - чтобы задача чата не ретраила."""
+    pass
+
+
+@dataclass
+class PlanEstimate:
+    cost: float | None
+    rows: int | None
+    rewritten: bool = False
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def _collect_mysql_rows(node, found):
+    if isinstance(node, dict):
+        if 'rows_produced_per_join' in node:
+            found.append(int(node['rows_produced_per_join']))
+        for value in node.values():
+            _collect_mysql_rows(value, found)
+    elif isinstance(node, list):
+        for value in node:
+            _collect_mysql_rows(value, found)
+
+
+def explain(connection, sql_query: str, limit_added: bool = False) -> PlanEstimate | None:
+    """
+    Оценка планировщика: (стоимость, строки на выходе). Для SQLite оценки стоимости нет -> None.
+    limit_added - LIMIT дописан телохранителем: строки берутся у узла под Limit,
+    иначе оценка никогда не превысит max_rows источника.
+    """
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        # Ошибка в транзакции PG делает ее aborted - откатываемся к точке сохранения
+        with connection.begin_nested():
+            raw = connection.execute(text(f"EXPLAIN (FORMAT JSON) {sql_query}")).scalar()
+        plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]['Plan']
+        rows = plan['Plan Rows']
+        if limit_added and plan.get('Node Type') == 'Limit' and plan.get('Plans'):
+            rows = plan['Plans'][0]['Plan Rows']
+        return PlanEstimate(cost=float(plan['Total Cost']), rows=int(rows))
+
+    if dialect == 'mysql':
+        # rows_produced_per_join не учитывает LIMIT - оценка и так без него
+        raw = connection.execute(text(f"EXPLAIN FORMAT=JSON {sql_query}")).scalar()
+        query_block = json.loads(raw)['query_block']
+        rows = []
+        _collect_mysql_rows(query_block, rows)
+        cost = query_block.get('cost_info', {}).get('query_cost')
+        return PlanEstimate(cost=float(cost) if cost is not None else None, rows=max(rows) if rows else None)
+
+    return None
+
+
+class QueryPlanGuard:
+    """
+    Пороги берутся из DataSource (explain_max_cost / explain_max_rows),
+    если там пусто - из settings (QUERY_EXPLAIN_MAX_COST / QUERY_EXPLAIN_MAX_ROWS).
+    Превышение по стоимости - отказ. Превышение по строкам - отказ или
+    (explain_action='limit') переписывание запроса с LIMIT explain_max_rows.
+    """
+
+    def __init__(self, datasource=None):
+        self.enabled = getattr(settings, 'QUERY_EXPLAIN_ENABLED', True)
+        self.max_cost = getattr(datasource, 'explain_max_cost', None) or getattr(settings, 'QUERY_EXPLAIN_MAX_COST', None)
+        self.max_rows = getattr(datasource, 'explain_max_rows', None) or getattr(settings, 'QUERY_EXPLAIN_MAX_ROWS', None)
+        self.action = getattr(datasource, 'explain_action', None) or 'reject'
+
+    def check(self, connection, sql_query: str, limit_added: bool = False) -> tuple[str, PlanEstimate | None]:
+        """
+        Возвращает (SQL к выполнению, оценка плана) или бросает QueryTooExpensiveError.
+        limit_added - LIMIT в sql_query дописан телохранителем, а не моделью.
+        """
+        if not self.enabled or (self.max_cost is None and self.max_rows is None):
+            return sql_query, None
+
+        try:
+            estimate = explain(connection, sql_query, limit_added=limit_added)
+        except Exception as e:
+            # EXPLAIN не должен ломать рабочий запрос: ошибку SQL покажет само выполнение
+            logger.warning(f"EXPLAIN не выполнен, пропускаю проверку плана: {e}")
+            return sql_query, None
+        if estimate is None:
+            return sql_query, None
+
+        if self.max_rows is not None and estimate.rows is not None and estimate.rows > self.max_rows:
+            if self.action != 'limit':
+                raise QueryTooExpensiveError(
+                    f"Запрос вернет слишком много строк (оценка {estimate.rows:,}, лимит {self.max_rows:,}). "
+                    f"Уточните вопрос: добавьте период, фильтр или группировку."
+                )
+            sql_query = f"SELECT * FROM ({sql_query.strip().rstrip(';')}) AS limited_q LIMIT {int(self.max_rows)}"
+            logger.info(f"План: {estimate.rows} строк > {self.max_rows}, запрос переписан с LIMIT.")
+            rewritten = explain(connection, sql_query) or estimate
+            estimate = PlanEstimate(cost=rewritten.cost, rows=rewritten.rows, rewritten=True)
+
+        if self.max_cost is not None and estimate.cost is not None and estimate.cost > self.max_cost:
+            raise QueryTooExpensiveError(
+                f"Запрос слишком тяжелый для источника (оценка стоимости {estimate.cost:,.0f}, "
+                f"лимит {self.max_cost:,.0f}). Возможно, не хватает условия JOIN или фильтра по дате."
+            )
+
+        return sql_query, estimate
@@ -0,0 +1,201 @@
+# Лимиты выполнения по источнику: таймаут, строки, объем результата, параллельность.
+# Таймаут задается средствами самой СУБД, а не отдельным SET на каждый запрос:
+#   PostgreSQL - options='-c statement_timeout=...' при подключении,
+#   MySQL      - init_command='SET SESSION MAX_EXECUTION_TIME=...',
+#   SQLite     - progress handler, прерывающий запрос по дедлайну.
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from sqlalchemy import event, text
+
+logger = logging.getLogger(__name__)
+
+SLOTS_PREFIX = 'query_slots'
+SLOT_GRACE_SEC = 60  # запас к таймауту запроса, после которого слот считается брошенным
+SQLITE_PROGRESS_STEPS = 10_000  # инструкций VM между проверками дедлайна
+
+
+class ResultTooLargeError(ValueError):
+    """Результат больше max_result_bytes источника. ValueError - задача чата не ретраит."""
+    pass
+
+
+@dataclass
+class QueryLimits:
+    timeout_ms: int
+    max_rows: int
+    max_result_bytes: int | None
+    max_concurrent: int | None
+
+    @classmethod
+    def for_datasource(cls, datasource=None):
+        """Значения DataSource, пустые - из settings."""
+        def pick(field, setting, default=None):
+            value = getattr(datasource, field, None)
+            return value if value is not None else getattr(settings, setting, default)
+
+        return cls(
+            timeout_ms=pick('query_timeout_ms', 'QUERY_TIMEOUT_MS', 30000),
+            max_rows=pick('max_rows', 'QUERY_ROW_LIMIT', 1000),
+            max_result_bytes=pick('max_result_bytes', 'QUERY_MAX_RESULT_BYTES'),
+            max_concurrent=pick('max_concurrent_queries', 'QUERY_MAX_CONCURRENT'),
+        )
+
+
+# --- Таймаут ---
+
+def native_timeout_options(backend_name: str, timeout_ms: int) -> dict:
+    """connect_args для create_engine: таймаут ставится один раз на соединение пула."""
+    if not timeout_ms:
+        return {}
+    if backend_name == 'postgresql':
+        return {'connect_args': {'options': f'-c statement_timeout={int(timeout_ms)}'}}
+    if backend_name == 'mysql':
+        return {'connect_args': {'init_command': f'SET SESSION MAX_EXECUTION_TIME={int(timeout_ms)}'}}
+    return {}
+
+
+def install_sqlite_timeout(engine, timeout_ms: int):
+    """
+    В SQLite нет серверного таймаута: progress handler вызывается каждые
+    SQLITE_PROGRESS_STEPS инструкций и прерывает запрос (sqlite3.OperationalError: interrupted),
+    если дедлайн, выставленный перед execute, прошел.
+    """
+
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        state = {'deadline': None}
+        connection_record.info['query_deadline'] = state
+        dbapi_connection.set_progress_handler(
+            lambda: 1 if state['deadline'] and time.monotonic() > state['deadline'] else 0,
+            SQLITE_PROGRESS_STEPS,
+        )
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _on_execute(conn, cursor, statement, parameters, context, executemany):
+        state = conn.info.get('query_deadline')
+        ms = conn.info.get('query_timeout_ms', timeout_ms)
+        if state is not None and ms:
+            state['deadline'] = time.monotonic() + ms / 1000
+
+    @event.listens_for(engine, 'checkin')
+    def _on_checkin(dbapi_connection, connection_record):
+        state = connection_record.info.get('query_deadline')
+        if state is not None:
+            state['deadline'] = None
+
+
+@contextmanager
+def override_timeout(connection, timeout_ms: int):
+    """
+    Другой таймаут для запросов внутри блока (напр. длинные выгрузки), не трогая пул.
+    После блока возвращается прежнее значение соединения (таймаут источника из пула).
+    """
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        # is_local=true: значение действует до конца транзакции, но восстанавливаем его и раньше
+        previous = connection.execute(text("SELECT current_setting('statement_timeout')")).scalar()
+        connection.execute(text("SELECT set_config('statement_timeout', :value, true)"),
+                           {'value': str(int(timeout_ms))})
+        try:
+            yield
+        finally:
+            _restore_setting(connection, text("SELECT set_config('statement_timeout', :value, true)"),
+                             {'value': previous})
+    elif dialect == 'mysql':
+        previous = connection.execute(text("SELECT @@SESSION.max_execution_time")).scalar()
+        connection.execute(text(f"SET SESSION MAX_EXECUTION_TIME = {int(timeout_ms)}"))
+        try:
+            yield
+        finally:
+            _restore_setting(connection, text(f"SET SESSION MAX_EXECUTION_TIME = {int(previous or 0)}"))
+    else:
+        connection.info['query_timeout_ms'] = timeout_ms
+        try:
+            yield
+        finally:
+            connection.info.pop('query_timeout_ms', None)
+
+
+def _restore_setting(connection, statement, params=None):
+    """Если вернуть значение не удалось, соединение не должно вернуться в пул с чужим таймаутом."""
+    try:
+        connection.execute(statement, params or {})
+    except Exception as e:
+        logger.warning(f"Не удалось восстановить таймаут соединения: {e}")
+        connection.invalidate()
+
+
+# --- Параллельность ---
+
+def slot_deadline(now: float, timeout_ms: int) -> float:
+    """Момент, после которого слот считается брошенным: таймаут запроса + запас."""
+    return now + timeout_ms / 1000 + SLOT_GRACE_SEC
+
+
+def try_acquire_slot(r, key: str, token: str, deadline: float, now: float, max_concurrent: int) -> bool:
+    """
+    Одна попытка занять слот. Score слота - его собственный дедлайн, поэтому брошенные
+    слоты удаляются по своему таймауту, а не по таймауту того, кто сейчас ждет
+    (короткий запрос чата не вытесняет идущую выгрузку).
+    """
+    pipe = r.pipeline()
+    pipe.zremrangebyscore(key, '-inf', now)
+    pipe.zadd(key, {token: deadline})
+    pipe.zcard(key)
+    _, _, taken = pipe.execute()
+    if taken <= max_concurrent:
+        return True
+    r.zrem(key, token)
+    return False
+
+
+@contextmanager
+def concurrency_slot(datasource_id, max_concurrent: int | None, timeout_ms: int):
+    """
+    Семафор на источник в Redis (общий для всех процессов Celery и gunicorn):
+    не больше max_concurrent одновременных запросов. Ждем свободный слот
+    QUERY_SLOT_WAIT сек, затем TimeoutError. Слоты с истекшим дедлайном
+    считаются освободившимися (воркер мог упасть, не отдав слот).
+    """
+    if not max_concurrent:
+        yield
+        return
+
+    r = get_redis_connection('default')
+    key = f"{SLOTS_PREFIX}:{datasource_id or 'default'}"
+    token = uuid.uuid4().hex
+    wait_until = time.monotonic() + getattr(settings, 'QUERY_SLOT_WAIT', 10)
+
+    while True:
+        now = time.time()
+        if try_acquire_slot(r, key, token, slot_deadline(now, timeout_ms), now, max_concurrent):
+            break
+        if time.monotonic() > wait_until:
+            raise TimeoutError(
+                f"Источник данных занят ({max_concurrent} запросов уже выполняются). Повторите позже."
+            )
+        time.sleep(0.2)
+
+    try:
+        yield
+    finally:
+        r.zrem(key, token)
+
+
+# --- Объем результата ---
+
+def check_result_size(df, max_result_bytes: int | None):
+    if not max_result_bytes:
+        return
+    size = int(df.memory_usage(deep=True).sum())
+    if size > max_result_bytes:
+        raise ResultTooLargeError(
+            f"Результат слишком большой ({size / 1024 / 1024:.1f} МБ при лимите "
+            f"{max_result_bytes / 1024 / 1024:.1f} МБ). Уточните вопрос или используйте выгрузку."
+        )
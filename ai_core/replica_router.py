@@ -0,0 +1,92 @@
+# Выбор узла DataSource для запроса: реплики (по задержке или по кругу) -> основной host.
+# Состояние здоровья хранится в памяти процесса: упавший узел пропускается
+# REPLICA_FAILOVER_COOLDOWN сек, потом снова пробуется. Периодическая проверка
+# (tasks.task_check_endpoints) дополнительно снимает с ротации недоступные узлы для всех процессов.
+import itertools
+import logging
+import threading
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+EWMA_ALPHA = 0.3
+
+_lock = threading.Lock()
+_states = {}  # (datasource_id, endpoint_id) -> {'latency_ms', 'failed_until'}
+_round_robin = {}  # datasource_id -> itertools.count
+
+
+@dataclass(frozen=True)
+class Endpoint:
+    endpoint_id: int | None  # None - основной host/port DataSource
+    host: str
+    port: int
+
+    def as_dict(self) -> dict:
+        return {'endpoint_id': self.endpoint_id, 'host': self.host, 'port': self.port}
+
+    def __str__(self):
+        return f"{self.host}:{self.port}"
+
+
+def primary_endpoint(datasource) -> Endpoint:
+    return Endpoint(None, datasource.host, datasource.port)
+
+
+def read_endpoints(datasource) -> list[Endpoint]:
+    """Кандидаты для запросов чата в порядке попыток; основной узел - последний резерв."""
+    replicas = [
+        Endpoint(e.id, e.host, e.port)
+        for e in datasource.endpoints.filter(role='replica', is_enabled=True, is_healthy=True)
+    ]
+    return _order(datasource.id, replicas) + [primary_endpoint(datasource)]
+
+
+def introspection_endpoint(datasource) -> Endpoint:
+    """Отдельный узел для синхронизации схемы (если задан), чтобы не мешать запросам чата."""
+    endpoint = datasource.endpoints.filter(role='introspection', is_enabled=True).order_by('id').first()
+    if endpoint:
+        return Endpoint(endpoint.id, endpoint.host, endpoint.port)
+    return primary_endpoint(datasource)
+
+
+def _order(datasource_id, endpoints: list[Endpoint]) -> list[Endpoint]:
+    if not endpoints:
+        return []
+    now = time.monotonic()
+    with _lock:
+        states = {e: _states.get((datasource_id, e.endpoint_id), {}) for e in endpoints}
+        healthy = [e for e in endpoints if states[e].get('failed_until', 0) <= now]
+        # Недавно упавшие - в конец: вдруг уже поднялись, а остальные лежат
+        cooling = [e for e in endpoints if e not in healthy]
+
+        if getattr(settings, 'REPLICA_SELECTION', 'latency') == 'round_robin':
+            counter = _round_robin.setdefault(datasource_id, itertools.count())
+            if healthy:
+                shift = next(counter) % len(healthy)
+                healthy = healthy[shift:] + healthy[:shift]
+        else:
+            # Без замеров задержка 0 - новый узел сразу получает трафик и замер
+            healthy.sort(key=lambda e: states[e].get('latency_ms', 0))
+
+    return healthy + cooling
+
+
+def report_success(datasource_id, endpoint: Endpoint, latency_ms: float):
+    with _lock:
+        state = _states.setdefault((datasource_id, endpoint.endpoint_id), {})
+        previous = state.get('latency_ms')
+        state['latency_ms'] = latency_ms if previous is None else \
+            EWMA_ALPHA * latency_ms + (1 - EWMA_ALPHA) * previous
+        state['failed_until'] = 0
+
+
+def report_failure(datasource_id, endpoint: Endpoint):
+    cooldown = getattr(settings, 'REPLICA_FAILOVER_COOLDOWN', 30)
+    with _lock:
+        state = _states.setdefault((datasource_id, endpoint.endpoint_id), {})
+        state['failed_until'] = time.monotonic() + cooldown
+    logger.warning(f"Узел {endpoint} источника {datasource_id} недоступен, исключен на {cooldown} сек.")
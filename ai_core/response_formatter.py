@@ -1,7 +1,8 @@
 import pandas as pd
-import ollama
 import logging
+import time
 from django.conf import settings
+from .ollama_registry import get_client
 
 logger = logging.getLogger(__name__)
 
@@ -15,8 +16,9 @@ class ResponseFormatter:
         self.model_name = model_name
         self.host = host
         self.temperature = temperature
+        self.last_timings = {}
         try:
-            self.client = ollama.Client(host=self.host)
+            self.client = get_client(self.host)
         except Exception as e:
             logger.error(f"Не удалось подключиться к Ollama по адресу {host}: {e}")
             raise ConnectionError(f"Не удалось подключиться к Ollama. Убедитесь, что Ollama запущена по адресу {host}.")
@@ -28,13 +30,7 @@ class ResponseFormatter:
 НЕ включай сами данные (JSON) в свой ответ, просто опиши их.
 """
 
-    def get_summary_response(self, user_prompt: str, df: pd.DataFrame) -> str:
-        """
-        Главный метод. Делает "Звонок 2" (Сводка).
-        (п. 10 - пока синхронно)
-        """
-        logger.info(f"Звонок 2 (ResponseFormatter): Генерация Сводки...")
-
+    def _build_summary_messages(self, user_prompt: str, df: pd.DataFrame) -> list:
         # (п. 11) Берем только 'head', чтобы не перегружать ИИ
         data_json = df.head(15).to_json(orient='records')
 
@@ -45,17 +41,28 @@ class ResponseFormatter:
 
         Твой краткий текстовый ответ:
         """
+        return [
+            {'role': 'system', 'content': self.system_prompt},
+            {'role': 'user', 'content': summary_user_prompt}
+        ]
+
+    def get_summary_response(self, user_prompt: str, df: pd.DataFrame) -> str:
+        """
+        Главный метод. Делает "Звонок 2" (Сводка).
+        (п. 10 - пока синхронно)
+        """
+        logger.info(f"Звонок 2 (ResponseFormatter): Генерация Сводки...")
+        started = time.monotonic()
 
         try:
             response_raw = self.client.chat(
                 model=self.model_name,
-                messages=[
-                    {'role': 'system', 'content': self.system_prompt},
-                    {'role': 'user', 'content': summary_user_prompt}
-                ],
+                messages=self._build_summary_messages(user_prompt, df),
                 options={'temperature': self.temperature}
             )
             text_response = response_raw['message']['content'].strip()
+            total_ms = int((time.monotonic() - started) * 1000)
+            self.last_timings = {'summary_ttft_ms': total_ms, 'summary_total_ms': total_ms}
             logger.info(f"Сводка получена.")
             return text_response
 
@@ -63,6 +70,48 @@ class ResponseFormatter:
             logger.error(f"Ошибка при обращении к Ollama (Сводка): {e}", exc_info=True)
             raise ConnectionError(f"Ошибка подключения к Ollama: {e}")
 
+    def stream_summary_response(self, user_prompt: str, df: pd.DataFrame, on_chunk=None, should_stop=None) -> str:
+        """
+        Потоковый вариант "Звонка 2": on_chunk(delta) вызывается для каждого
+        фрагмента текста по мере генерации. Возвращает полный текст.
+        should_stop() - проверка отмены между фрагментами (генерация обрывается).
+        Время до первого токена (TTFT) и общее время пишутся в self.last_timings.
+        """
+        logger.info(f"Звонок 2 (ResponseFormatter): Потоковая генерация Сводки...")
+        started = time.monotonic()
+        ttft_ms = None
+        parts = []
+
+        try:
+            stream = self.client.chat(
+                model=self.model_name,
+                messages=self._build_summary_messages(user_prompt, df),
+                options={'temperature': self.temperature},
+                stream=True
+            )
+            for chunk in stream:
+                if should_stop and should_stop():
+                    logger.info("Генерация сводки остановлена (отмена).")
+                    stream.close()
+                    break
+                delta = chunk['message']['content']
+                if not delta:
+                    continue
+                if ttft_ms is None:
+                    ttft_ms = int((time.monotonic() - started) * 1000)
+                parts.append(delta)
+                if on_chunk:
+                    on_chunk(delta)
+
+        except Exception as e:
+            logger.error(f"Ошибка при обращении к Ollama (Сводка, stream): {e}", exc_info=True)
+            raise ConnectionError(f"Ошибка подключения к Ollama: {e}")
+
+        total_ms = int((time.monotonic() - started) * 1000)
+        self.last_timings = {'summary_ttft_ms': ttft_ms, 'summary_total_ms': total_ms}
+        logger.info(f"Сводка получена (TTFT: {ttft_ms} мс, всего: {total_ms} мс).")
+        return "".join(parts).strip()
+
     def format_final_message(self, text_response: str, chart_json: str | None, df: pd.DataFrame) -> str:
         """
         (п. 5 - Тестируемо)
@@ -0,0 +1,171 @@
+import hashlib
+import logging
+import time
+
+import pandas as pd
+import pyarrow as pa
+import sqlparse
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from .freshness import data_version_for_sql
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'result_cache'
+INDEX_KEY = f'{PREFIX}:index'  # ZSET: ключ -> время записи (для вытеснения старых)
+SIZES_KEY = f'{PREFIX}:sizes'  # HASH: ключ -> размер в байтах
+HITS_KEY = f'{PREFIX}:hits'
+MISSES_KEY = f'{PREFIX}:misses'
+# Метка в схеме Arrow: колонки были pd.ArrowDtype (режим чтения arrow) - восстановить их же
+_ARROW_DTYPES_META = b'dasm_arrow_dtypes'
+
+
+def serialize_frame(df: pd.DataFrame) -> bytes:
+    """
+    DataFrame -> Arrow IPC (zstd). Данные из общего Redis не исполняются при чтении,
+    в отличие от pickle. Колонки, которые Arrow не может типизировать, - ошибка (не кэшируем).
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if any(isinstance(dtype, pd.ArrowDtype) for dtype in df.dtypes):
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), _ARROW_DTYPES_META: b'1'})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression='zstd')) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def deserialize_frame(blob: bytes) -> pd.DataFrame:
+    table = pa.ipc.open_stream(blob).read_all()
+    if (table.schema.metadata or {}).get(_ARROW_DTYPES_META):
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
+    return table.to_pandas()
+
+
+def normalize_sql(sql_query: str) -> str:
+    """
+    Убирает комментарии, лишние пробелы и ';' в конце, не трогая строковые литералы,
+    чтобы одинаковые по смыслу запросы давали один ключ.
+    """
+    formatted = sqlparse.format(sql_query, strip_comments=True)
+    parts = []
+    for stmt in sqlparse.parse(formatted):
+        for token in stmt.flatten():
+            if not token.is_whitespace:
+                parts.append(token.value)
+            elif parts and parts[-1] != ' ':
+                parts.append(' ')
+    return "".join(parts).strip().rstrip(';').strip()
+
+
+class QueryResultCache:
+    """
+    Кэш результатов SQL (DataFrame) в Redis, общий для задачи чата и выгрузки Excel.
+    Ключ: (DataSource, версии данных таблиц запроса, нормализованный SQL). Значение: Arrow IPC.
+    Вытеснение: TTL + общий бюджет памяти RESULT_CACHE_MAX_BYTES (сначала самые старые).
+    """
+
+    def __init__(self, namespace):
+        self.namespace = str(namespace)
+        self.enabled = getattr(settings, 'RESULT_CACHE_ENABLED', True)
+        self.ttl = getattr(settings, 'RESULT_CACHE_TTL', 10 * 60)
+        self.max_bytes = getattr(settings, 'RESULT_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+        self.max_entry_bytes = getattr(settings, 'RESULT_CACHE_MAX_ENTRY_BYTES', 32 * 1024 * 1024)
+
+    def _redis(self):
+        return get_redis_connection('default')
+
+    def make_key(self, sql_query: str) -> str:
+        normalized = normalize_sql(sql_query)
+        # Версии данных таблиц запроса (ai_core.freshness): изменились данные - другой ключ
+        version = data_version_for_sql(self.namespace, normalized)
+        digest = hashlib.sha256(f"{self.namespace}|{version}|{normalized}".encode('utf-8')).hexdigest()
+        # "arrow:" - записи прежнего формата (pickle) не читаются и уходят по TTL
+        return f"{PREFIX}:arrow:{digest}"
+
+    def get(self, sql_query: str) -> pd.DataFrame | None:
+        if not self.enabled:
+            return None
+        try:
+            r = self._redis()
+            blob = r.get(self.make_key(sql_query))
+            r.incr(HITS_KEY if blob is not None else MISSES_KEY)
+        except Exception as e:
+            logger.warning(f"Кэш результатов недоступен: {e}")
+            return None
+
+        if blob is None:
+            return None
+        logger.info("Кэш результатов: попадание.")
+        try:
+            return deserialize_frame(blob)
+        except Exception as e:
+            logger.warning(f"Кэш результатов: запись не читается, пропускаю: {e}")
+            return None
+
+    def set(self, sql_query: str, df: pd.DataFrame):
+        if not self.enabled:
+            return
+        try:
+            blob = serialize_frame(df)
+        except Exception as e:
+            logger.info(f"Кэш результатов: результат не сериализуется в Arrow ({e}), не кэшируем.")
+            return
+        if len(blob) > self.max_entry_bytes:
+            logger.info(f"Кэш результатов: результат слишком большой ({len(blob)} байт), не кэшируем.")
+            return
+
+        key = self.make_key(sql_query)
+        try:
+            r = self._redis()
+            pipe = r.pipeline()
+            pipe.set(key, blob, ex=self.ttl)
+            pipe.zadd(INDEX_KEY, {key: time.time()})
+            pipe.hset(SIZES_KEY, key, len(blob))
+            pipe.execute()
+            self._evict(r)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить результат в кэш: {e}")
+
+    def _evict(self, r):
+        """Убирает из индекса истекшие по TTL ключи и самые старые - пока не влезем в бюджет."""
+        cutoff = time.time() - self.ttl
+        expired = [k.decode() for k in r.zrangebyscore(INDEX_KEY, '-inf', cutoff)]
+        if expired:
+            self._drop(r, expired)
+
+        used = sum(int(v) for v in r.hvals(SIZES_KEY))
+        while used > self.max_bytes:
+            oldest = [k.decode() for k in r.zrange(INDEX_KEY, 0, 9)]
+            if not oldest:
+                break
+            # Только сколько нужно, чтобы влезть в бюджет (свежая запись не вытесняется вместе со старыми)
+            victims = []
+            for key, size in zip(oldest, r.hmget(SIZES_KEY, oldest)):
+                if used <= self.max_bytes:
+                    break
+                victims.append(key)
+                used -= int(size or 0)
+            self._drop(r, victims)
+            logger.info(f"Кэш результатов: вытеснено {len(victims)} записей по размеру.")
+
+    def _drop(self, r, keys):
+        pipe = r.pipeline()
+        pipe.delete(*keys)
+        pipe.zrem(INDEX_KEY, *keys)
+        pipe.hdel(SIZES_KEY, *keys)
+        pipe.execute()
+
+    @staticmethod
+    def stats() -> dict:
+        r = get_redis_connection('default')
+        hits = int(r.get(HITS_KEY) or 0)
+        misses = int(r.get(MISSES_KEY) or 0)
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / total, 3) if total else 0.0,
+            'entries': r.zcard(INDEX_KEY),
+            'memory_bytes': sum(int(v) for v in r.hvals(SIZES_KEY)),
+        }
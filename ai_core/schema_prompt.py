@@ -0,0 +1,91 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+
+from .models import SchemaTable, SchemaColumn
+
+logger = logging.getLogger(__name__)
+
+# Меняем версию при изменении формата DDL, чтобы не читать старые фрагменты
+KEY_PREFIX = 'schema_prompt:v1'
+
+
+def _key(table_id) -> str:
+    return f"{KEY_PREFIX}:{table_id}"
+
+
+def render_table_ddl(table, columns) -> str:
+    """DDL одной таблицы для промпта (имена в кавычках + бизнес-описания)."""
+    desc = f" ({table.description_ru})" if table.description_ru else ""
+
+    # (ИЗМЕНЕНО) Оборачиваем имя таблицы в кавычки прямо в промпте
+    table_name_quoted = f'"{table.table_name}"'
+
+    lines = [
+        f"-- Таблица: {table_name_quoted}{desc}",
+        f"CREATE TABLE {table_name_quoted} (",
+    ]
+
+    col_defs = []
+    for col in columns:
+        c_desc = f" -- {col.description_ru}" if col.description_ru else ""
+
+        # (ИЗМЕНЕНО) Оборачиваем имя колонки в кавычки
+        col_name_quoted = f'"{col.column_name}"'
+
+        col_defs.append(f"  {col_name_quoted} {col.data_type}{c_desc}")
+
+    lines.append(",\n".join(col_defs))
+    lines.append(");\n")
+    return "\n".join(lines)
+
+
+def _compile(table_ids) -> dict:
+    """Рендерит фрагменты одним запросом на таблицы и одним на колонки (без N+1)."""
+    enabled_columns = SchemaColumn.objects.filter(is_enabled=True).order_by('id')
+    tables = SchemaTable.objects.filter(id__in=table_ids).prefetch_related(
+        Prefetch('columns', queryset=enabled_columns, to_attr='enabled_columns')
+    )
+    return {t.id: render_table_ddl(t, t.enabled_columns) for t in tables}
+
+
+def get_fragments(table_ids) -> dict:
+    """
+    Возвращает {table_id: DDL-фрагмент}. Готовые фрагменты берутся из кэша (Redis),
+    недостающие компилируются пачкой и кладутся обратно.
+    """
+    table_ids = list(dict.fromkeys(table_ids))
+    if not table_ids:
+        return {}
+
+    keys = {_key(tid): tid for tid in table_ids}
+    try:
+        cached = cache.get_many(list(keys))
+    except Exception as e:
+        logger.warning(f"Кэш промпта недоступен, компилирую напрямую: {e}")
+        return _compile(table_ids)
+
+    fragments = {keys[k]: v for k, v in cached.items()}
+    missing = [tid for tid in table_ids if tid not in fragments]
+    if missing:
+        compiled = _compile(missing)
+        fragments.update(compiled)
+        try:
+            cache.set_many({_key(tid): frag for tid, frag in compiled.items()},
+                           timeout=getattr(settings, 'CACHE_TTL', None))
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить фрагменты промпта в кэш: {e}")
+
+    return fragments
+
+
+def invalidate(table_ids):
+    table_ids = list(table_ids)
+    if not table_ids:
+        return
+    try:
+        cache.delete_many([_key(tid) for tid in table_ids])
+    except Exception as e:
+        logger.warning(f"Не удалось инвалидировать фрагменты промпта {table_ids!r}: {e}")
@@ -1,12 +1,22 @@
-from django.db.utils import OperationalError
+import hashlib
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
+from django.db import transaction
+from django.db.models import BooleanField, ExpressionWrapper, Q
+
 from dasm import settings
-from .models import DataSource, SchemaTable, SchemaColumn
+from . import schema_prompt
+from .models import DataSource, SchemaTable, SchemaColumn, SchemaSyncJob
+from .signals import bulk_schema_sync
+from .sql_cache import invalidate_tables
 from sqlalchemy import create_engine, inspect
 from sqlalchemy.engine import URL
-import ollama
+from .ollama_registry import get_client, resolve_model, EMBEDDING_MODEL_BASE
+from .freshness import schema_hashes
+from .replica_router import introspection_endpoint
 
 logger = logging.getLogger(__name__)
 
@@ -15,18 +25,43 @@ def _has_non_ascii(s: str) -> bool:
     return any(ord(ch) > 127 for ch in s)
 
 
-def sync_database_schema(datasource: DataSource):
-    """
-    Подключается к DataSource (используя SQLAlchemy)
-    и "наполняет" наши модели SchemaTable/SchemaColumn.
-    """
-    logger.info(f"Запуск интроспекции для: {datasource.name}")
+# Служебные таблицы, которые не попадают в курируемую схему
+IGNORED_PREFIXES = [
+    # Стандартные Django
+    'django_',
+    'auth_',
+
+    # Наши приложения
+    'users_',
+    'chat_',
+    'ai_core_',
+
+    # Служебные таблицы Postgres
+    'pg_',
+    'sql_',
 
+    # Сторонние библиотеки
+    'social_',  # если есть social-auth
+    'account_',  # если есть allauth
+    'easy_',  # если есть easy-thumbnails
+    'thumbnail_',
+    'celery_',
+    'django_celery_',
+
+    # Специфично для SQLite (иногда создает sqlite_sequence)
+    'sqlite_',
+]
+
+
+def _schema_engine(datasource: DataSource):
+    """SQLAlchemy engine для интроспекции (отдельный узел, если задан)."""
     db_user = str(datasource.db_user or "")
     db_password = str(datasource.db_password or "")
-    db_host = str(datasource.host or "")
+    # Отдельный узел для интроспекции (если задан), чтобы не конкурировать с запросами чата
+    endpoint = introspection_endpoint(datasource)
+    db_host = str(endpoint.host or "")
     db_name = str(datasource.db_name or "")
-    db_port = datasource.port
+    db_port = endpoint.port
 
     logger.info(
         "Параметры подключения: engine=%r user=%r host=%r port=%r db=%r",
@@ -51,192 +86,420 @@ def sync_database_schema(datasource: DataSource):
                 value,
             )
 
+    # Формируем URL для SQLAlchemy
+    engine_url = URL.create(
+        drivername=datasource.engine.replace("django.db.backends.", ""),
+        username=db_user,
+        password=db_password,
+        host=db_host,
+        port=db_port,
+        database=db_name,
+    )
+
+    # Минимальные параметры подключения
+    connect_args = {
+        "connect_timeout": 5,
+    }
+
+    logger.info(f"Создаем SQLAlchemy engine: {engine_url!r}")
+    return create_engine(engine_url, connect_args=connect_args)
+
+
+def list_source_tables(inspector) -> list:
+    """Имена таблиц источника без служебных (IGNORED_PREFIXES)."""
+    table_list = inspector.get_table_names()
+    tables = [name for name in table_list if not name.startswith(tuple(IGNORED_PREFIXES))]
+    logger.info(f"Найдено {len(table_list)} таблиц, к синхронизации {len(tables)}.")
+    return tables
+
+
+def _column_type(table_name: str, col: dict) -> str:
     try:
-        # Формируем URL для SQLAlchemy
-        engine_url = URL.create(
-            drivername=datasource.engine.replace("django.db.backends.", ""),
-            username=db_user,
-            password=db_password,
-            host=db_host,
-            port=db_port,
-            database=db_name,
+        return str(col.get("type"))
+    except UnicodeDecodeError:
+        logger.warning(
+            f"Невозможно декодировать тип колонки {table_name}.{col.get('name')}, "
+            f"использую repr(...)"
         )
+        return repr(col.get("type"))
 
-        # Минимальные параметры подключения
-        connect_args = {
-            "connect_timeout": 5,
-        }
 
-        logger.info(f"Создаем SQLAlchemy engine: {engine_url!r}")
-        engine = create_engine(engine_url, connect_args=connect_args)
+def reflect_columns(inspector, table_names) -> dict:
+    """
+    {table_name: [(column_name, data_type), ...]} одним обходом каталога
+    (get_multi_columns, SQLAlchemy 2) вместо запроса get_columns на каждую таблицу.
+    """
+    table_names = list(table_names)
+    reflected = {name: [] for name in table_names}
+    if not table_names:
+        return reflected
 
-        # ВАЖНО: у тебя падало уже тут, на inspect(engine)
-        inspector = inspect(engine)
+    multi = inspector.get_multi_columns(filter_names=table_names)
+    for (_schema, table_name), columns in multi.items():
+        if table_name in reflected:
+            reflected[table_name] = [(str(col.get("name")), _column_type(table_name, col)) for col in columns]
+    return reflected
 
-        logger.info("Пробуем получить список таблиц...")
-        table_list = inspector.get_table_names()
-        logger.info(f"Найдено {len(table_list)} таблиц: {table_list!r}")
-
-        found_tables = set()
-        IGNORED_PREFIXES = [
-            # Стандартные Django
-            'django_',
-            'auth_',
-
-            # Наши приложения
-            'users_',
-            'chat_',
-            'ai_core_',
-
-            # Служебные таблицы Postgres
-            'pg_',
-            'sql_',
-
-            # Сторонние библиотеки
-            'social_',  # если есть social-auth
-            'account_',  # если есть allauth
-            'easy_',  # если есть easy-thumbnails
-            'thumbnail_',
-            'celery_',
-            'django_celery_',
-        ]
 
-        for table_name in table_list:
-            # --- (НОВАЯ ПРОВЕРКА) ---
-            # Если имя таблицы начинается с ЛЮБОГО из запрещенных префиксов -> пропускаем
-            if any(table_name.startswith(prefix) for prefix in IGNORED_PREFIXES):
-                continue
+def _invalidate_schema_caches(datasource_id, tables: dict):
+    """tables - {table_id: table_name} измененных/удаленных таблиц."""
+    if not tables:
+        return
+    schema_prompt.invalidate(list(tables))
+    invalidate_tables(datasource_id, list(tables.values()))
 
-            # Специфично для SQLite (иногда создает sqlite_sequence)
-            if table_name.startswith('sqlite_'):
-                continue
-            # ------------------------
 
-            found_tables.add(table_name)
+def apply_schema_diff(datasource: DataSource, reflected: dict, source_tables=None, schema_versions=None) -> dict:
+    """
+    Сравнивает отраженную схему с SchemaTable/SchemaColumn в памяти и пишет только
+    разницу: bulk_create новых, bulk_update сменивших тип, удаление пропавших -
+    в одной транзакции. Курирование (описания, флаги, is_enabled) у существующих строк не трогается.
+
+    source_tables - полный список таблиц источника: таблицы вне его удаляются.
+    None - без удаления таблиц (пачка при фоновой синхронизации).
+    schema_versions - хэши каталога (ai_core.freshness), записываются в schema_version
+    отраженных таблиц: в следующий раз неизменные таблицы не отражаются заново.
+    Возвращает счетчики изменений.
+    """
+    batch_size = getattr(settings, 'SCHEMA_SYNC_WRITE_BATCH', 1000)
+    schema_versions = schema_versions or {}
+    stats = dict.fromkeys(
+        ['tables_created', 'tables_deleted', 'columns_created', 'columns_updated', 'columns_deleted'], 0
+    )
+    changed = {}  # table_id -> table_name для инвалидации кэшей
 
-            # 4. Сохраняем Таблицу (дальше код без изменений)
-            table_obj, created = SchemaTable.objects.update_or_create(
-                data_source=datasource,
-                table_name=table_name,
-                defaults={'is_enabled': True}
-            )
+    with transaction.atomic(), bulk_schema_sync():
+        tables = {
+            t.table_name: t
+            for t in SchemaTable.objects.filter(data_source=datasource).only('id', 'table_name', 'schema_version')
+        }
 
-            if created:
-                logger.info(f"Найдена новая таблица: {table_name}")
+        new_tables = [
+            SchemaTable(data_source=datasource, table_name=name, is_enabled=True,
+                        schema_version=schema_versions.get(name))
+            for name in reflected if name not in tables
+        ]
+        SchemaTable.objects.bulk_create(new_tables, batch_size=batch_size)
+        for table in new_tables:
+            logger.info(f"Найдена новая таблица: {table.table_name}")
+            tables[table.table_name] = table
+            changed[table.id] = table.table_name
+        stats['tables_created'] = len(new_tables)
+
+        versioned = []
+        for name in reflected:
+            table = tables[name]
+            if table.id not in changed and table.schema_version != schema_versions.get(name):
+                table.schema_version = schema_versions.get(name)
+                versioned.append(table)
+        SchemaTable.objects.bulk_update(versioned, ['schema_version'], batch_size=batch_size)
+
+        names_by_id = {tables[name].id: name for name in reflected}
+        existing = {
+            (c.schema_table_id, c.column_name): c
+            for c in SchemaColumn.objects.filter(schema_table_id__in=names_by_id)
+            .only('id', 'schema_table_id', 'column_name', 'data_type')
+        }
 
-            found_columns = set()
+        to_create, to_update, seen = [], [], set()
+        for name, columns in reflected.items():
+            table_id = tables[name].id
+            for column_name, data_type in columns:
+                key = (table_id, column_name)
+                seen.add(key)
+                column = existing.get(key)
+                if column is None:
+                    to_create.append(SchemaColumn(schema_table_id=table_id, column_name=column_name,
+                                                  data_type=data_type, is_enabled=True))
+                elif column.data_type != data_type:
+                    column.data_type = data_type
+                    to_update.append(column)
+                else:
+                    continue
+                changed[table_id] = name
+
+        stale_columns = [c for key, c in existing.items() if key not in seen]
+        for column in stale_columns:
+            changed[column.schema_table_id] = names_by_id[column.schema_table_id]
+
+        SchemaColumn.objects.bulk_create(to_create, batch_size=batch_size)
+        SchemaColumn.objects.bulk_update(to_update, ['data_type'], batch_size=batch_size)
+        if stale_columns:
+            SchemaColumn.objects.filter(id__in=[c.id for c in stale_columns]).delete()
+        stats['columns_created'] = len(to_create)
+        stats['columns_updated'] = len(to_update)
+        stats['columns_deleted'] = len(stale_columns)
+
+        if source_tables is not None:
+            source_tables = set(source_tables)
+            stale_tables = {t.id: name for name, t in tables.items() if name not in source_tables}
+            if stale_tables:
+                # Колонки удалятся каскадом
+                SchemaTable.objects.filter(id__in=stale_tables).delete()
+                changed.update(stale_tables)
+            stats['tables_deleted'] = len(stale_tables)
+
+        # bulk-операции сигналов не шлют: сбрасываем кэши сами, после коммита
+        transaction.on_commit(lambda: _invalidate_schema_caches(datasource.id, changed))
+
+    stats['tables_changed'] = len(changed)
+    return stats
+
+
+def _catalog_hashes(datasource: DataSource, engine) -> dict | None:
+    """Хэши колонок по каталогу (ai_core.freshness); None - недоступны, отражаем все таблицы."""
+    try:
+        with engine.connect() as connection:
+            return schema_hashes(connection)
+    except Exception as e:
+        logger.warning(f"Хэши схемы {datasource.name} недоступны, отражаю все таблицы: {e}")
+        return None
 
-            logger.info(f"Читаем колонки таблицы {table_name}...")
-            columns_info = inspector.get_columns(table_name)
 
-            for col in columns_info:
-                col_name = str(col.get("name"))
-                found_columns.add(col_name)
+def _tables_to_reflect(datasource: DataSource, table_names, hashes) -> list:
+    """Новые таблицы и таблицы, чей хэш в каталоге отличается от schema_version."""
+    if hashes is None:
+        return list(table_names)
+    stored = dict(SchemaTable.objects.filter(data_source=datasource).values_list('table_name', 'schema_version'))
+    return [name for name in table_names if not stored.get(name) or stored[name] != hashes.get(name)]
 
-                try:
-                    field_type = str(col.get("type"))
-                except UnicodeDecodeError:
-                    logger.warning(
-                        f"Невозможно декодировать тип колонки {table_name}.{col_name}, "
-                        f"использую repr(...)"
-                    )
-                    field_type = repr(col.get("type"))
 
-                SchemaColumn.objects.update_or_create(
-                    schema_table=table_obj,
-                    column_name=col_name,
-                    defaults={
-                        "data_type": field_type,
-                        "is_enabled": True,
-                    },
-                )
+SYNC_COUNTERS = ('tables_created', 'tables_deleted', 'columns_created', 'columns_updated',
+                 'columns_deleted', 'tables_changed', 'reflect_sec', 'write_sec')
 
-            SchemaColumn.objects.filter(schema_table=table_obj).exclude(
-                column_name__in=found_columns
-            ).delete()
 
-        SchemaTable.objects.filter(data_source=datasource).exclude(
-            table_name__in=found_tables
-        ).delete()
+def run_schema_sync_job(job: SchemaSyncJob, on_batch=None) -> dict:
+    """
+    Синхронизация схемы пачками по SCHEMA_SYNC_BATCH_TABLES таблиц для фоновой задачи.
+    Пачка и продвижение job.tables_done коммитятся вместе, поэтому при сбое
+    повторный вызов с тем же job продолжает с места остановки.
+    on_batch(job) вызывается после каждой пачки (прогресс, продление блокировки).
+    Ошибки не перехватываются - повтор решает задача.
+    """
+    datasource = job.data_source
+    batch_size = getattr(settings, 'SCHEMA_SYNC_BATCH_TABLES', 200)
+    engine = _schema_engine(datasource)
+    try:
+        inspector = inspect(engine)
+        # Хэши берутся до отражения каждый запуск: если таблица изменится между ними,
+        # сохраненная версия окажется старой и следующая проверка отразит ее еще раз
+        hashes = _catalog_hashes(datasource, engine)
+
+        if not job.stats:
+            # Первый запуск: пропавшие таблицы удаляем сразу, список к отражению фиксируем
+            source_tables = list_source_tables(inspector)
+            stale = _tables_to_reflect(datasource, source_tables, hashes)
+            pruned = apply_schema_diff(datasource, {}, source_tables=source_tables)
+            job.table_names = stale
+            job.tables_done = 0
+            job.stats = {**dict.fromkeys(SYNC_COUNTERS, 0), 'tables_total': len(source_tables),
+                         'tables_skipped': len(source_tables) - len(stale),
+                         'tables_deleted': pruned['tables_deleted'], 'tables_changed': pruned['tables_changed']}
+            job.save(update_fields=['table_names', 'tables_done', 'stats'])
+
+        while job.tables_done < len(job.table_names):
+            batch = job.table_names[job.tables_done:job.tables_done + batch_size]
+            started = time.monotonic()
+            reflected = reflect_columns(inspector, batch)
+            reflected_at = time.monotonic()
+
+            with transaction.atomic():
+                batch_stats = apply_schema_diff(datasource, reflected, schema_versions=hashes)
+                batch_stats['reflect_sec'] = reflected_at - started
+                batch_stats['write_sec'] = time.monotonic() - reflected_at
+                for key in SYNC_COUNTERS:
+                    job.stats[key] = round(job.stats.get(key, 0) + batch_stats[key], 2)
+                job.tables_done += len(batch)
+                job.save(update_fields=['tables_done', 'stats'])
+
+            logger.info(f"Синхронизация {datasource.name}: {job.tables_done}/{len(job.table_names)} таблиц.")
+            if on_batch:
+                on_batch(job)
 
         datasource.last_inspected = datetime.now()
         datasource.save(update_fields=["last_inspected"])
+        return job.stats
+    finally:
+        engine.dispose()
+
+
+def format_sync_stats(stats: dict) -> str:
+    """Короткая сводка для админки."""
+    return (
+        f"таблиц {stats['tables_total']} (+{stats['tables_created']}/-{stats['tables_deleted']}, "
+        f"без изменений {stats.get('tables_skipped', 0)}), "
+        f"колонок +{stats['columns_created']}/~{stats['columns_updated']}/-{stats['columns_deleted']}, "
+        f"чтение {stats['reflect_sec']} сек, запись {stats['write_sec']} сек"
+    )
 
-        logger.info(f"Интроспекция для {datasource.name} успешно завершена.")
-        return (True, None)
 
-    except OperationalError as e:
-        logger.error(f"Ошибка подключения к {datasource.name}: {e}", exc_info=True)
-        return (False, f"Ошибка подключения: {e}")
-    except UnicodeDecodeError as e:
-        logger.error(
-            f"Ошибка декодирования при подключении к {datasource.name}: {e}",
-            exc_info=True,
-        )
-        return (
-            False,
-            "Ошибка кодировки при подключении. "
-            "Скорее всего в имени БД/пользователя/хоста есть символы не в UTF-8. "
-            "Попробуй использовать только латиницу и цифры.",
-        )
-    except Exception as e:
-        logger.error(
-            f"Неизвестная ошибка при интроспекции {datasource.name}: {e}",
-            exc_info=True,
+def _table_embedding_text(table) -> str:
+    return table.description_ru
+
+
+def _column_embedding_text(col) -> str:
+    return f"Таблица {col.schema_table.table_name}, колонка {col.column_name}: {col.description_ru}"
+
+
+def _table_embedding_hash(table, model_name: str) -> str:
+    # Имя таблицы не входит в текст эмбеддинга, но переименование тоже должно переиндексировать
+    source = f"{model_name}\n{table.table_name}\n{_table_embedding_text(table)}"
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def _column_embedding_hash(col, model_name: str) -> str:
+    source = f"{model_name}\n{_column_embedding_text(col)}"
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def _needs_embedding(queryset, hash_fn, model_name: str, full: bool) -> list:
+    """
+    Оставляет только строки без вектора или с изменившимся текстом/моделью.
+    Сами векторы не читаются: наличие проверяется в SQL (has_embedding).
+    """
+    queryset = queryset.defer('embedding').annotate(
+        has_embedding=ExpressionWrapper(Q(embedding__isnull=False), output_field=BooleanField())
+    )
+    stale = []
+    for obj in queryset:
+        new_hash = hash_fn(obj, model_name)
+        if full or not obj.has_embedding or obj.embedding_hash != new_hash:
+            obj.embedding_hash = new_hash
+            stale.append(obj)
+    return stale
+
+
+class IndexingProgress:
+    """
+    Счетчики прогресса векторизации + скорость (объектов/сек).
+    Снимок прогресса передается в callback (Celery update_state, кэш для админки).
+    """
+
+    def __init__(self, total: int, callback=None, label: str = 'Векторизация'):
+        self.total = total
+        self.label = label
+        self.done = 0
+        self.failed = 0
+        self.callback = callback
+        self.started = time.monotonic()
+
+    def advance(self, done: int = 0, failed: int = 0):
+        self.done += done
+        self.failed += failed
+        snapshot = self.snapshot()
+        logger.info(
+            f"{self.label}: {snapshot['done']}/{snapshot['total']} "
+            f"(ошибок: {snapshot['failed']}, {snapshot['per_second']} объектов/сек)"
         )
-        return (False, f"Неизвестная ошибка: {e}")
+        if self.callback:
+            self.callback(snapshot)
+
+    def snapshot(self) -> dict:
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        return {
+            'total': self.total,
+            'done': self.done,
+            'failed': self.failed,
+            'elapsed_sec': round(elapsed, 1),
+            'per_second': round(self.done / elapsed, 1),
+        }
 
 
-def run_vector_indexing():
+def _embed_and_save(client, model_name, objects, text_fn, progress: IndexingProgress) -> int:
+    """
+    Векторизует объекты пачками (один запрос /api/embed на пачку) с ограниченным
+    параллелизмом и пишет результат через bulk_update кусками.
+    """
+    batch_size = getattr(settings, 'VECTOR_INDEX_BATCH_SIZE', 64)
+    concurrency = getattr(settings, 'VECTOR_INDEX_CONCURRENCY', 4)
+    write_chunk = getattr(settings, 'VECTOR_INDEX_WRITE_CHUNK', 500)
+
+    if not objects:
+        return 0
+
+    model = type(objects[0])
+    batches = [objects[i:i + batch_size] for i in range(0, len(objects), batch_size)]
+
+    def embed_batch(batch):
+        response = client.embed(model=model_name, input=[text_fn(obj) for obj in batch])
+        return response['embeddings']
+
+    indexed = 0
+    pending = []
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='embed') as pool:
+        futures = {pool.submit(embed_batch, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                embeddings = future.result()
+            except Exception as e:
+                logger.error(f"Ошибка векторизации пачки ({model.__name__}, {len(batch)} шт.): {e}")
+                progress.advance(failed=len(batch))
+                continue
+
+            for obj, vector in zip(batch, embeddings):
+                obj.embedding = vector
+            pending.extend(batch)
+            indexed += len(batch)
+
+            if len(pending) >= write_chunk:
+                model.objects.bulk_update(pending, ['embedding', 'embedding_hash'], batch_size=write_chunk)
+                pending = []
+            progress.advance(done=len(batch))
+
+    if pending:
+        model.objects.bulk_update(pending, ['embedding', 'embedding_hash'], batch_size=write_chunk)
+    return indexed
+
+
+def run_vector_indexing(progress_callback=None, table_ids=None, column_ids=None, full=False):
     """
     Основная логика индексации (вынесена из management command).
+    Инкрементально: векторизуются только строки без вектора или с изменившимся
+    хэшем текста (описание + имя + модель). full=True - переиндексировать всё.
+    table_ids/column_ids - точечная переиндексация (напр. после правки описания).
+    progress_callback(snapshot) получает прогресс и скорость по ходу работы.
     """
     logger.info("Запуск фоновой векторизации...")
 
     OLLAMA_HOST = getattr(settings, 'OLLAMA_HOST', 'http://localhost:11434')
-    client = ollama.Client(host=OLLAMA_HOST)
+    client = get_client(OLLAMA_HOST)
 
-    # 1. Поиск модели (как мы делали раньше)
-    target_model_base = 'nomic-embed-text'
-    actual_model_name = 'nomic-embed-text'
+    # 1. Поиск модели (список моделей кэшируется на уровне процесса)
     try:
-        models_response = client.list()
-        available_models = [m['model'] for m in models_response['models']]
-        for m in available_models:
-            if target_model_base in m:
-                actual_model_name = m
-                break
-    except Exception as e:
+        actual_model_name = resolve_model(EMBEDDING_MODEL_BASE, OLLAMA_HOST)
+    except ConnectionError as e:
         logger.error(f"Векторизация прервана: Не удалось подключиться к Ollama. {e}")
         return f"Ошибка подключения: {e}"
 
-    # 2. Индексация ТАБЛИЦ
-    tables = SchemaTable.objects.filter(is_enabled=True).exclude(description_ru__isnull=True).exclude(
+    tables_qs = SchemaTable.objects.filter(is_enabled=True).exclude(description_ru__isnull=True).exclude(
         description_ru__exact='')
-    tables_count = 0
-    for table in tables:
-        try:
-            response = client.embeddings(model=actual_model_name, prompt=table.description_ru)
-            table.embedding = response['embedding']
-            table.save(update_fields=['embedding'])
-            tables_count += 1
-        except Exception as e:
-            logger.error(f"Ошибка таблицы {table.table_name}: {e}")
+    # select_related: имя таблицы нужно для текста колонки (без запроса на каждую колонку)
+    columns_qs = SchemaColumn.objects.filter(is_enabled=True).exclude(description_ru__isnull=True).exclude(
+        description_ru__exact='').select_related('schema_table').defer('schema_table__embedding')
+
+    targeted = table_ids is not None or column_ids is not None
+    if targeted:
+        tables_qs = tables_qs.filter(id__in=table_ids or [])
+        columns_qs = columns_qs.filter(id__in=column_ids or [])
+
+    tables = _needs_embedding(tables_qs, _table_embedding_hash, actual_model_name, full)
+    columns = _needs_embedding(columns_qs, _column_embedding_hash, actual_model_name, full)
+    logger.info(f"К векторизации: {len(tables)} таблиц, {len(columns)} колонок (остальные не изменились).")
+
+    progress = IndexingProgress(total=len(tables) + len(columns), callback=progress_callback)
+    progress.advance()  # Стартовый снимок (0/N)
+
+    # 2. Индексация ТАБЛИЦ
+    tables_count = _embed_and_save(client, actual_model_name, tables, _table_embedding_text, progress)
 
     # 3. Индексация КОЛОНОК
-    columns = SchemaColumn.objects.filter(is_enabled=True).exclude(description_ru__isnull=True).exclude(
-        description_ru__exact='')
-    cols_count = 0
-    for col in columns:
-        try:
-            text_to_embed = f"Таблица {col.schema_table.table_name}, колонка {col.column_name}: {col.description_ru}"
-            response = client.embeddings(model=actual_model_name, prompt=text_to_embed)
-            col.embedding = response['embedding']
-            col.save(update_fields=['embedding'])
-            cols_count += 1
-        except Exception as e:
-            logger.error(f"Ошибка колонки {col.column_name}: {e}")
-
-    result_msg = f"Успешно индексировано: {tables_count} таблиц, {cols_count} колонок. (Модель: {actual_model_name})"
+    cols_count = _embed_and_save(client, actual_model_name, columns, _column_embedding_text, progress)
+
+    stats = progress.snapshot()
+    result_msg = (
+        f"Успешно индексировано: {tables_count} таблиц, {cols_count} колонок. (Модель: {actual_model_name}) "
+        f"За {stats['elapsed_sec']} сек, {stats['per_second']} объектов/сек, ошибок: {stats['failed']}."
+    )
     logger.info(result_msg)
-    return result_msg
\ No newline at end of file
+    return result_msg
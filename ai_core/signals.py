@@ -0,0 +1,76 @@
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import engine_registry, schema_prompt
+from .models import DataSource, DataSourceEndpoint, SchemaTable, SchemaColumn
+from .sql_cache import invalidate_tables
+
+logger = logging.getLogger(__name__)
+
+# Сохранение только этих полей не меняет схему для LLM (напр. векторизация)
+NON_SCHEMA_FIELDS = {'embedding', 'embedding_hash', 'schema_version', 'data_version'}
+
+
+_local = threading.local()
+
+
+@contextmanager
+def bulk_schema_sync():
+    """
+    Отключает поштучную инвалидацию на время массовой синхронизации схемы:
+    bulk_create/bulk_update сигналы не шлют вовсе, а delete() слал бы их на каждую строку.
+    Кэши сбрасывает сама синхронизация - одним вызовом по списку измененных таблиц.
+    """
+    _local.bulk_sync = True
+    try:
+        yield
+    finally:
+        _local.bulk_sync = False
+
+
+def _is_schema_change(update_fields) -> bool:
+    if getattr(_local, 'bulk_sync', False):
+        return False
+    return update_fields is None or not set(update_fields) <= NON_SCHEMA_FIELDS
+
+
+@receiver(post_save, sender=SchemaTable)
+@receiver(post_delete, sender=SchemaTable)
+def on_schema_table_changed(sender, instance, update_fields=None, **kwargs):
+    if _is_schema_change(update_fields):
+        schema_prompt.invalidate([instance.pk])
+        invalidate_tables(instance.data_source_id, [instance.table_name])
+
+
+@receiver(post_save, sender=SchemaColumn)
+@receiver(post_delete, sender=SchemaColumn)
+def on_schema_column_changed(sender, instance, update_fields=None, **kwargs):
+    if not _is_schema_change(update_fields):
+        return
+    schema_prompt.invalidate([instance.schema_table_id])
+    try:
+        table = instance.schema_table
+    except SchemaTable.DoesNotExist:
+        # Таблица уже удалена каскадом - ее сигнал инвалидирует кэш сам
+        return
+    invalidate_tables(table.data_source_id, [table.table_name])
+
+
+@receiver(post_save, sender=DataSource)
+@receiver(post_delete, sender=DataSource)
+def on_datasource_changed(sender, instance, update_fields=None, **kwargs):
+    # Другие процессы увидят новый updated_at в отпечатке и пересоздадут пул сами
+    if update_fields is None or 'updated_at' in update_fields or 'is_active' in update_fields:
+        engine_registry.dispose_datasource(instance.pk)
+
+
+@receiver(post_save, sender=DataSourceEndpoint)
+@receiver(post_delete, sender=DataSourceEndpoint)
+def on_endpoint_changed(sender, instance, update_fields=None, **kwargs):
+    # Проверка здоровья (task_check_endpoints) сохраняет только статус - пул не трогаем
+    if update_fields is None or not set(update_fields) <= {'is_healthy', 'last_latency_ms', 'last_checked'}:
+        engine_registry.dispose(engine_registry.datasource_key(instance.data_source_id, instance.pk))
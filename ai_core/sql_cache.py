@@ -0,0 +1,132 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+from pgvector.django import CosineDistance
+
+from .models import SQLCacheEntry
+
+logger = logging.getLogger(__name__)
+
+STATS_KEY_HITS = 'sql_cache:hits'
+STATS_KEY_MISSES = 'sql_cache:misses'
+
+
+class SemanticSQLCache:
+    """
+    Семантический кэш "вопрос -> SQL" поверх pgvector.
+    Ищет ранее проверенный SQL по близости эмбеддинга вопроса
+    в пределах одного DataSource.
+    """
+
+    def __init__(self):
+        self.enabled = getattr(settings, 'SQL_CACHE_ENABLED', True)
+        self.similarity = getattr(settings, 'SQL_CACHE_SIMILARITY', 0.95)
+        self.ttl = getattr(settings, 'SQL_CACHE_TTL', 60 * 60 * 24 * 7)
+        self.max_entries = getattr(settings, 'SQL_CACHE_MAX_ENTRIES', 5000)
+
+    def lookup(self, datasource, query_vector, is_valid=None) -> SQLCacheEntry | None:
+        """
+        Возвращает ближайшую запись выше порога близости или None.
+        is_valid - проверка актуальности (версии схемы); устаревшая запись удаляется.
+        """
+        if not self.enabled or datasource is None:
+            return None
+
+        max_distance = 1.0 - self.similarity
+        entry = SQLCacheEntry.objects.filter(
+            data_source=datasource,
+            created_at__gte=timezone.now() - timedelta(seconds=self.ttl),
+        ).annotate(
+            distance=CosineDistance('embedding', query_vector)
+        ).filter(
+            distance__lte=max_distance
+        ).order_by('distance').first()
+
+        if entry is not None and is_valid is not None and not is_valid(entry):
+            logger.info(f"Кэш SQL: версия схемы изменилась, удаляю запись {entry.pk}")
+            entry.delete()
+            entry = None
+
+        if entry is None:
+            self._incr(STATS_KEY_MISSES)
+            return None
+
+        SQLCacheEntry.objects.filter(pk=entry.pk).update(
+            hit_count=F('hit_count') + 1,
+            last_used_at=timezone.now(),
+        )
+        self._incr(STATS_KEY_HITS)
+        logger.info(f"Кэш SQL: попадание (distance={entry.distance:.4f}) для '{entry.question[:50]}'")
+        return entry
+
+    def store(self, datasource, question: str, query_vector, schema_version: str,
+              tables: list, sql_query: str) -> SQLCacheEntry | None:
+        if not self.enabled or datasource is None:
+            return None
+
+        entry = SQLCacheEntry.objects.create(
+            data_source=datasource,
+            question=question,
+            embedding=query_vector,
+            schema_version=schema_version,
+            tables=list(tables),
+            sql_query=sql_query,
+        )
+        self.evict()
+        return entry
+
+    def evict(self) -> int:
+        """
+        TTL: удаляет устаревшие записи.
+        LRU: оставляет не более SQL_CACHE_MAX_ENTRIES самых свежих по last_used_at.
+        """
+        expired = timezone.now() - timedelta(seconds=self.ttl)
+        deleted, _ = SQLCacheEntry.objects.filter(created_at__lt=expired).delete()
+
+        overflow_ids = list(
+            SQLCacheEntry.objects.order_by('-last_used_at')
+            .values_list('id', flat=True)[self.max_entries:]
+        )
+        if overflow_ids:
+            deleted += SQLCacheEntry.objects.filter(id__in=overflow_ids).delete()[0]
+
+        if deleted:
+            logger.info(f"Кэш SQL: вытеснено {deleted} записей.")
+        return deleted
+
+    def stats(self) -> dict:
+        hits = cache.get(STATS_KEY_HITS, 0)
+        misses = cache.get(STATS_KEY_MISSES, 0)
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / total, 3) if total else 0.0,
+            'entries': SQLCacheEntry.objects.count(),
+        }
+
+    def _incr(self, key: str):
+        # Счетчики не должны ломать ответ, если Redis недоступен
+        try:
+            cache.add(key, 0, timeout=None)
+            cache.incr(key)
+        except Exception as e:
+            logger.warning(f"Кэш SQL: не удалось обновить счетчик {key}: {e}")
+
+
+def invalidate_tables(datasource_id, table_names) -> int:
+    """Удаляет записи кэша, сгенерированные по любой из указанных таблиц."""
+    table_names = list(table_names)
+    if not table_names:
+        return 0
+    deleted, _ = SQLCacheEntry.objects.filter(
+        data_source_id=datasource_id,
+        tables__overlap=table_names,
+    ).delete()
+    if deleted:
+        logger.info(f"Кэш SQL: инвалидировано {deleted} записей по таблицам {table_names!r}")
+    return deleted
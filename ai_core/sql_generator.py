@@ -1,8 +1,12 @@
-import ollama
+import hashlib
 import logging
 import re
+from collections import Counter
 from django.conf import settings
 from ai_core.models import SchemaTable, SchemaColumn
+from ai_core import schema_prompt, value_index
+from ai_core.ollama_registry import get_client, resolve_model, EMBEDDING_MODEL_BASE
+from ai_core.sql_cache import SemanticSQLCache
 from pgvector.django import CosineDistance
 
 logger = logging.getLogger(__name__)
@@ -18,26 +22,25 @@ class SQLGenerator:
         self.model_name = model_name
         self.host = host
         self.temperature = temperature
-        self.embedding_model = 'nomic-embed-text'  # Дефолтное значение
+        self.embedding_model = EMBEDDING_MODEL_BASE  # Дефолтное значение
+        self.sql_cache = SemanticSQLCache()
+        self.cache_hit = False
+        self._cache_candidate = None
+        self.last_table_hits = Counter()
+        self.last_query_vector = None
 
         try:
-            self.client = ollama.Client(host=self.host)
-
-            # Пытаемся найти правильное имя модели в списке
-            try:
-                models_list = self.client.list()
-                available_models = [m['model'] for m in models_list['models']]
-                for m in available_models:
-                    if 'nomic-embed-text' in m:
-                        self.embedding_model = m
-                        break
-            except:
-                pass  # Используем дефолт
-
+            self.client = get_client(self.host)
         except Exception as e:
             logger.error(f"Не удалось подключиться к Ollama: {e}")
             raise ConnectionError(f"Ollama недоступна по адресу {host}")
 
+        # Имя модели (с тегом) кэшируется на уровне процесса
+        try:
+            self.embedding_model = resolve_model(EMBEDDING_MODEL_BASE, self.host)
+        except ConnectionError:
+            pass  # Используем дефолт
+
     def _get_query_embedding(self, text: str):
         try:
             response = self.client.embeddings(model=self.embedding_model, prompt=text)
@@ -46,9 +49,10 @@ class SQLGenerator:
             logger.error(f"Ошибка генерации вектора: {e}")
             raise ValueError("Не удалось векторизовать запрос.")
 
-    def _find_relevant_tables(self, user_prompt: str, limit: int = 5):
+    def _find_relevant_tables(self, user_prompt: str, limit: int = 5, query_vector=None):
         logger.info(f"Маршрутизатор: Ищу таблицы для '{user_prompt}'...")
-        query_vector = self._get_query_embedding(user_prompt)
+        if query_vector is None:
+            query_vector = self._get_query_embedding(user_prompt)
 
         relevant_columns_qs = SchemaColumn.objects.filter(
             is_enabled=True,
@@ -58,16 +62,22 @@ class SQLGenerator:
         ).order_by('distance')[:15]
 
         table_ids_list = list(relevant_columns_qs.values_list('schema_table_id', flat=True))
-        unique_table_ids = list(set(table_ids_list))
+        # Литералы вопроса ("Алматы") -> колонки-измерения с таким значением
+        value_hints = self._match_values(user_prompt)
+        unique_table_ids = list(set(table_ids_list) | set(value_hints))
+        # Сколько из ближайших колонок (и найденных значений) попало в каждую таблицу (вес при выборе источника)
+        self.last_table_hits = Counter(table_ids_list) + Counter({t_id: len(h) for t_id, h in value_hints.items()})
 
-        relevant_tables = SchemaTable.objects.filter(
+        relevant_tables = list(SchemaTable.objects.filter(
             id__in=unique_table_ids,
             is_enabled=True,
             data_source__is_active=True
-        )
+        ).select_related('data_source').defer('data_source__db_password'))
+        for table in relevant_tables:
+            table.matched_values = value_hints.get(table.id, [])
 
         # (ВАЖНО) Если ничего не нашли по колонкам, ищем по именам таблиц (резерв)
-        if not relevant_tables.exists():
+        if not relevant_tables:
             # Простой поиск по вхождению слов (без векторов, как план Б)
             prompt_words = user_prompt.lower().split()
             potential_ids = []
@@ -81,18 +91,71 @@ class SQLGenerator:
                     potential_ids.extend(matches)
 
             if potential_ids:
-                relevant_tables = SchemaTable.objects.filter(id__in=potential_ids)
+                relevant_tables = SchemaTable.objects.filter(id__in=potential_ids).select_related('data_source').defer('data_source__db_password')
                 logger.info(f"Маршрутизатор (Fallback): Найдено по имени: {[t.table_name for t in relevant_tables]}")
             else:
                 logger.warning("Маршрутизатор: Ничего не найдено. Использую дефолтные таблицы.")
-                return SchemaTable.objects.filter(is_enabled=True)[:3]
+                return SchemaTable.objects.filter(
+                    is_enabled=True, data_source__is_active=True
+                ).select_related('data_source').defer('data_source__db_password')[:3]
 
         return relevant_tables
 
-    def _build_system_prompt(self, user_prompt: str) -> str:
-        target_tables = self._find_relevant_tables(user_prompt)
-
-        generated_ddl = []
+    def _match_values(self, user_prompt: str) -> dict:
+        """{table_id: [(колонка, значение), ...]} по индексу значений (ai_core.value_index)."""
+        try:
+            matches = value_index.match_values(user_prompt)
+        except Exception as e:
+            logger.warning(f"Индекс значений недоступен: {e}")
+            return {}
+
+        hints = {}
+        for match in matches:
+            pair = (match.column.column_name, match.value)
+            table_hints = hints.setdefault(match.column.schema_table_id, [])
+            if pair not in table_hints:
+                table_hints.append(pair)
+        if hints:
+            logger.info(f"Маршрутизатор: значения из вопроса {[(m.column_id, m.value) for m in matches]}")
+        return hints
+
+    def route_sources(self, user_prompt: str) -> list:
+        """
+        Выбирает источник(и) по найденным таблицам, а не первый активный DataSource.
+        Возвращает [(DataSource, [SchemaTable, ...]), ...] по убыванию веса:
+        источник попадает в список, если набрал не меньше ROUTER_MIN_SOURCE_SHARE
+        от веса лучшего (вопрос "на стыке" источников), но не больше ROUTER_MAX_SOURCES.
+        """
+        self.last_table_hits = Counter()
+        self.last_query_vector = self._get_query_embedding(user_prompt)
+        tables = list(self._find_relevant_tables(user_prompt, query_vector=self.last_query_vector))
+
+        groups = {}
+        for table in tables:
+            groups.setdefault(table.data_source_id, (table.data_source, []))[1].append(table)
+        if not groups:
+            return []
+
+        # Таблицы из резервного поиска (без попаданий по колонкам) весят 1
+        scores = {ds_id: sum(self.last_table_hits.get(t.id, 0) or 1 for t in group[1])
+                  for ds_id, group in groups.items()}
+        ranked = sorted(groups, key=lambda ds_id: scores[ds_id], reverse=True)
+        best = scores[ranked[0]]
+        share = getattr(settings, 'ROUTER_MIN_SOURCE_SHARE', 0.3)
+        selected = [ds_id for ds_id in ranked if scores[ds_id] >= best * share]
+        selected = selected[:getattr(settings, 'ROUTER_MAX_SOURCES', 3)]
+
+        logger.info(f"Маршрутизатор: источники {[(groups[i][0].name, scores[i]) for i in selected]}")
+        return [groups[ds_id] for ds_id in selected]
+
+    def _schema_fingerprint(self, tables) -> str:
+        """Версия схемы: хэш DDL таблиц (порядок не важен)."""
+        tables = sorted(tables, key=lambda t: t.table_name)
+        fragments = schema_prompt.get_fragments([t.id for t in tables])
+        ddl = [fragments.get(t.id, '') for t in tables]
+        return hashlib.sha1("\n".join(ddl).encode('utf-8')).hexdigest()
+
+    def _build_system_prompt(self, target_tables) -> str:
         instructions = [
             "Ты - SQL-генератор для PostgreSQL.",
             "Твоя задача: сгенерировать ОДИН SQL-запрос.",
@@ -106,30 +169,38 @@ class SQLGenerator:
             "\nСХЕМА БД:",
         ]
 
-        for table in target_tables:
-            desc = f" ({table.description_ru})" if table.description_ru else ""
-
-            # (ИЗМЕНЕНО) Оборачиваем имя таблицы в кавычки прямо в промпте
-            table_name_quoted = f'"{table.table_name}"'
-
-            generated_ddl.append(f"-- Таблица: {table_name_quoted}{desc}")
-            generated_ddl.append(f"CREATE TABLE {table_name_quoted} (")
-
-            enabled_columns = table.columns.filter(is_enabled=True)
-            col_defs = []
-            for col in enabled_columns:
-                c_desc = f" -- {col.description_ru}" if col.description_ru else ""
-
-                # (ИЗМЕНЕНО) Оборачиваем имя колонки в кавычки
-                col_name_quoted = f'"{col.column_name}"'
-
-                col_defs.append(f"  {col_name_quoted} {col.data_type}{c_desc}")
-
-            generated_ddl.append(",\n".join(col_defs))
-            generated_ddl.append(");\n")
+        # DDL таблиц заранее скомпилирован и лежит в кэше (см. schema_prompt)
+        fragments = schema_prompt.get_fragments([t.id for t in target_tables])
+        generated_ddl = [fragments[t.id] for t in target_tables if t.id in fragments]
+
+        # Значения измерений, найденные по литералам вопроса (см. _match_values)
+        value_lines = []
+        for t in target_tables:
+            matched = getattr(t, 'matched_values', [])
+            if not matched:
+                continue
+            # В MySQL "..." - строка: идентификаторы в `...`, обратный слэш в строке экранирует
+            is_mysql = 'mysql' in (t.data_source.engine or '')
+            quote = '`' if is_mysql else '"'
+            for column, value in matched:
+                literal = value.replace("\\", "\\\\") if is_mysql else value
+                literal = literal.replace("'", "''")
+                value_lines.append(f"  {quote}{t.table_name}{quote}.{quote}{column}{quote} = '{literal}'")
+        if value_lines:
+            generated_ddl.append("ЗНАЧЕНИЯ ИЗ ВОПРОСА (используй точное написание и '=' вместо ILIKE):")
+            generated_ddl.extend(value_lines)
 
         return "\n".join(instructions) + "\n" + "\n".join(generated_ddl)
 
+    def _cached_tables_fingerprint(self, entry) -> str:
+        tables = SchemaTable.objects.filter(
+            data_source_id=entry.data_source_id,
+            table_name__in=entry.tables,
+            is_enabled=True,
+            data_source__is_active=True
+        )
+        return self._schema_fingerprint(tables)
+
     def _parse_sql_from_response(self, response_text: str) -> str:
         response_text = response_text.strip()
         match = re.search(r"```sql\s*(.*?)\s*```", response_text, re.DOTALL | re.IGNORECASE)
@@ -144,8 +215,33 @@ class SQLGenerator:
         logger.error(f"Ollama не вернула SQL. Ответ: {response_text}")
         raise ValueError("AI не смог сгенерировать SQL. Ответ не содержит кода.")
 
-    def generate_sql(self, user_prompt: str, history: list = None) -> str:
-        dynamic_system_prompt = self._build_system_prompt(user_prompt)
+    def generate_sql(self, user_prompt: str, history: list = None, datasource=None,
+                     target_tables=None, query_vector=None) -> str:
+        """
+        Если передан datasource и вопрос самостоятельный (без предыдущих ответов в истории),
+        сначала ищем похожий вопрос в семантическом кэше и пропускаем LLM при попадании.
+        target_tables/query_vector - уже найденные route_sources (чтобы не искать повторно).
+        """
+        self.cache_hit = False
+        self._cache_candidate = None
+
+        if query_vector is None:
+            query_vector = self._get_query_embedding(user_prompt)
+        use_cache = datasource is not None and not any(m.get('role') == 'assistant' for m in (history or []))
+
+        if use_cache:
+            entry = self.sql_cache.lookup(
+                datasource, query_vector,
+                is_valid=lambda e: e.schema_version == self._cached_tables_fingerprint(e)
+            )
+            if entry:
+                self.cache_hit = True
+                logger.info(f"SQL взят из кэша: {entry.sql_query}")
+                return entry.sql_query
+
+        if target_tables is None:
+            target_tables = list(self._find_relevant_tables(user_prompt, query_vector=query_vector))
+        dynamic_system_prompt = self._build_system_prompt(target_tables)
 
         messages_payload = [{'role': 'system', 'content': dynamic_system_prompt}]
 
@@ -168,8 +264,33 @@ class SQLGenerator:
             sql_query = re.sub(r'[\);\s]+$', '', sql_query) + ';'
 
             logger.info(f"SQL получен: {sql_query}")
-            return sql_query
 
         except Exception as e:
             logger.error(f"Ошибка LLM: {e}", exc_info=True)
-            raise ConnectionError(f"Ошибка генерации: {e}")
\ No newline at end of file
+            raise ConnectionError(f"Ошибка генерации: {e}")
+
+        if use_cache:
+            self._cache_candidate = {
+                'datasource': datasource,
+                'question': user_prompt,
+                'query_vector': query_vector,
+                'schema_version': self._schema_fingerprint(target_tables),
+                'tables': [t.table_name for t in target_tables],
+                'sql_query': sql_query,
+            }
+        return sql_query
+
+    def remember_sql(self, sql_query: str):
+        """
+        Сохраняет SQL в кэш. Вызывается только после того, как запрос
+        прошел проверку безопасности и успешно выполнился.
+        """
+        candidate = self._cache_candidate
+        self._cache_candidate = None
+        if not candidate or candidate['sql_query'] != sql_query:
+            return
+
+        try:
+            self.sql_cache.store(**candidate)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить SQL в кэш: {e}")
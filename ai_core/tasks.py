@@ -1,14 +1,282 @@
+import time
+
 from celery import shared_task
-from .services import run_vector_indexing
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from sqlalchemy import text
+from .services import run_vector_indexing, run_schema_sync_job
 import logging
 
 logger = logging.getLogger(__name__)
 
-@shared_task
-def task_reindex_vectors():
+VECTOR_INDEX_PROGRESS_KEY = 'vector_index:progress'
+SCHEMA_SYNC_LOCK_KEY = 'schema_sync:lock:{}'
+CURATION_PROGRESS_KEY = 'curation:progress'
+
+
+@shared_task(bind=True)
+def task_reindex_vectors(self, table_ids=None, column_ids=None, full=False):
     """
     Фоновая задача для запуска индексации через Celery.
+    Без table_ids/column_ids - проход по всей схеме (только изменившиеся строки).
+    Прогресс полного прохода доступен через состояние задачи (PROGRESS) и в кэше для админки.
+    """
+    targeted = table_ids is not None or column_ids is not None
+    logger.info(f"Celery: Начало переиндексации векторов (точечно: {targeted}, полностью: {full})...")
+
+    def report(snapshot):
+        self.update_state(state='PROGRESS', meta=snapshot)
+        if not targeted:
+            cache.set(VECTOR_INDEX_PROGRESS_KEY, {**snapshot, 'task_id': self.request.id, 'finished': False},
+                      timeout=None)
+
+    result = run_vector_indexing(progress_callback=report, table_ids=table_ids, column_ids=column_ids, full=full)
+
+    if not targeted:
+        progress = cache.get(VECTOR_INDEX_PROGRESS_KEY) or {}
+        cache.set(VECTOR_INDEX_PROGRESS_KEY, {**progress, 'finished': True, 'result': result}, timeout=None)
+    return result
+
+@shared_task
+def task_evict_sql_cache():
+    """
+    Периодическая очистка семантического кэша SQL (TTL + LRU).
+    """
+    from .sql_cache import SemanticSQLCache
+    deleted = SemanticSQLCache().evict()
+    return f"Вытеснено записей кэша SQL: {deleted}"
+
+
+@shared_task
+def task_check_endpoints():
+    """
+    Периодическая проверка узлов источников (SELECT 1): задержка и доступность
+    пишутся в DataSourceEndpoint. Недоступные реплики не получают запросы чата,
+    пока проверка не увидит их снова.
+    """
+    from .db_executor import DatabaseExecutor
+    from .models import DataSourceEndpoint
+    from .replica_router import Endpoint
+
+    checked, unhealthy = 0, 0
+    endpoints = DataSourceEndpoint.objects.filter(is_enabled=True, data_source__is_active=True) \
+        .select_related('data_source')
+    for ep in endpoints:
+        started = time.monotonic()
+        try:
+            engine = DatabaseExecutor(datasource=ep.data_source).engine_for(Endpoint(ep.id, ep.host, ep.port))
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            ep.is_healthy = True
+            ep.last_latency_ms = round((time.monotonic() - started) * 1000, 1)
+        except Exception as e:
+            logger.warning(f"Узел {ep} недоступен: {e}")
+            ep.is_healthy = False
+            ep.last_latency_ms = None
+            unhealthy += 1
+        ep.last_checked = timezone.now()
+        ep.save(update_fields=['is_healthy', 'last_latency_ms', 'last_checked'])
+        checked += 1
+
+    return f"Проверено узлов: {checked}, недоступны: {unhealthy}"
+
+
+def sync_job_is_stale(job) -> bool:
+    """
+    Задача в статусе running, но блокировки источника нет: воркер умер, не завершив ее
+    (живая задача продлевает блокировку после каждой пачки). Такую задачу можно продолжить.
+    """
+    return job.status == 'running' and cache.get(SCHEMA_SYNC_LOCK_KEY.format(job.data_source_id)) is None
+
+
+def resume_sync_job(job):
+    """Возвращает незавершенную задачу в очередь; продолжится с job.tables_done."""
+    job.status = 'pending'
+    job.finished_at = None
+    job.save(update_fields=['status', 'finished_at'])
+
+
+@shared_task(
+    bind=True,
+    max_retries=getattr(settings, 'SCHEMA_SYNC_MAX_RETRIES', 3),
+    time_limit=getattr(settings, 'SCHEMA_SYNC_TIME_LIMIT', 60 * 60),
+    soft_time_limit=getattr(settings, 'SCHEMA_SYNC_TIME_LIMIT', 60 * 60) - 30,
+)
+def task_sync_schema(self, job_id):
+    """
+    Синхронизация схемы одного источника (SchemaSyncJob) пачками таблиц.
+    Задачи разных источников идут параллельно на воркерах; одновременная синхронизация
+    одного источника исключена блокировкой в кэше (продлевается после каждой пачки).
+    При ошибке задача повторяется с места остановки (SCHEMA_SYNC_RETRY_DELAY).
+    """
+    from .models import SchemaSyncJob
+
+    try:
+        job = SchemaSyncJob.objects.select_related('data_source').get(id=job_id)
+    except SchemaSyncJob.DoesNotExist:
+        return
+    if job.is_finished:
+        return
+
+    lock_key = SCHEMA_SYNC_LOCK_KEY.format(job.data_source_id)
+    lock_ttl = getattr(settings, 'SCHEMA_SYNC_LOCK_TTL', 10 * 60)
+    if not cache.add(lock_key, self.request.id, timeout=lock_ttl):
+        job.status = 'failed'
+        job.error = "Синхронизация этого источника уже выполняется."
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at'])
+        return job.status
+
+    job.status = 'running'
+    job.task_id = self.request.id
+    job.attempts += 1
+    job.error = ''
+    job.save(update_fields=['status', 'task_id', 'attempts', 'error'])
+
+    def on_batch(job):
+        cache.touch(lock_key, lock_ttl)
+        self.update_state(state='PROGRESS', meta={'done': job.tables_done, 'total': len(job.table_names)})
+
+    try:
+        run_schema_sync_job(job, on_batch=on_batch)
+        job.status = 'done'
+    except Exception as e:
+        logger.error(f"Ошибка синхронизации схемы {job.data_source.name} "
+                     f"({job.tables_done}/{len(job.table_names)} таблиц): {e}", exc_info=True)
+        job.error = str(e)
+        if self.request.retries < self.max_retries:
+            job.status = 'pending'
+            job.save(update_fields=['status', 'error'])
+            raise self.retry(exc=e, countdown=getattr(settings, 'SCHEMA_SYNC_RETRY_DELAY', 60))
+        job.status = 'failed'
+    finally:
+        # Блокировка могла истечь и достаться другому воркеру - удаляем только свою
+        if cache.get(lock_key) == self.request.id:
+            cache.delete(lock_key)
+
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at'])
+    if job.status == 'done':
+        # Следующий этап интроспекции - выборка значений измерений
+        task_index_column_values.delay(job.data_source_id)
+    return job.status
+
+
+@shared_task
+def task_index_column_values(datasource_id):
+    """Пересобирает индекс значений измерений источника (ai_core.value_index)."""
+    from .models import DataSource
+    from .value_index import index_datasource_values
+
+    try:
+        datasource = DataSource.objects.get(id=datasource_id, is_active=True)
+    except DataSource.DoesNotExist:
+        return
+    stats = index_datasource_values(datasource)
+    return (f"{datasource.name}: колонок {stats['columns']}, значений {stats['values']}, "
+            f"высококардинальных {stats['high_cardinality']}, ошибок {stats['failed']}")
+
+
+@shared_task
+def task_check_freshness():
+    """
+    Периодическая проверка свежести активных источников (ai_core.freshness).
+    Изменились данные - обновляются токены (ключи кэша результатов меняются сами).
+    Изменилась схема - запускается фоновая синхронизация, она отразит только
+    измененные таблицы и сбросит их кэши промптов и SQL.
     """
-    logger.info("Celery: Начало переиндексации векторов...")
-    result = run_vector_indexing()
-    return result
\ No newline at end of file
+    from .freshness import check_datasource
+    from .models import DataSource, SchemaSyncJob
+
+    auto_sync = getattr(settings, 'FRESHNESS_AUTO_SYNC', True)
+    checked, data_changed, syncs = 0, 0, 0
+    for datasource in DataSource.objects.filter(is_active=True):
+        try:
+            result = check_datasource(datasource)
+        except Exception as e:
+            logger.warning(f"Проверка свежести {datasource.name} не удалась: {e}")
+            continue
+        checked += 1
+        data_changed += len(result['data_changed'])
+
+        if not (auto_sync and result['schema_changed']):
+            continue
+        active = SchemaSyncJob.objects.filter(data_source=datasource, status__in=['pending', 'running']).first()
+        if active is not None and not sync_job_is_stale(active):
+            continue
+        if active is not None:
+            logger.warning(f"Синхронизация {datasource.name} (задача {active.id}) зависла без воркера, продолжаю.")
+            resume_sync_job(active)
+            job = active
+        else:
+            job = SchemaSyncJob.objects.create(data_source=datasource)
+        task_sync_schema.delay(job.id)
+        syncs += 1
+
+    return f"Проверено источников: {checked}, таблиц с новыми данными: {data_changed}, запущено синхронизаций: {syncs}"
+
+
+def _curation_reporter(task, kind: str):
+    """Прогресс AI-курирования: состояние задачи (PROGRESS) + кэш для админки."""
+    def report(snapshot):
+        task.update_state(state='PROGRESS', meta=snapshot)
+        cache.set(CURATION_PROGRESS_KEY, {**snapshot, 'kind': kind, 'task_id': task.request.id, 'finished': False},
+                  timeout=None)
+    return report
+
+
+def _finish_curation(result: dict | None, error: str = ''):
+    """Итог в кэш прогресса - и при ошибке, иначе админка вечно показывает «выполняется»."""
+    progress = cache.get(CURATION_PROGRESS_KEY) or {}
+    cache.set(CURATION_PROGRESS_KEY, {**progress, **(result or {}), 'finished': True, 'error': error},
+              timeout=None)
+
+
+def _curation_error(e: Exception) -> str:
+    if isinstance(e, SoftTimeLimitExceeded):
+        return f"Превышен лимит времени ({getattr(settings, 'CURATION_TIME_LIMIT', 60 * 60)} сек)."
+    return str(e) or e.__class__.__name__
+
+
+@shared_task(
+    bind=True,
+    time_limit=getattr(settings, 'CURATION_TIME_LIMIT', 60 * 60),
+    soft_time_limit=getattr(settings, 'CURATION_TIME_LIMIT', 60 * 60) - 30,
+)
+def task_curate_tables(self, table_ids):
+    """Полная AI-авто-настройка таблиц (ai_core.curation.curate_tables) в фоне."""
+    from .curation import curate_tables
+
+    result, error = None, ''
+    try:
+        result = curate_tables(table_ids, progress_callback=_curation_reporter(self, 'tables'))
+    except Exception as e:
+        error = _curation_error(e)
+        raise
+    finally:
+        _finish_curation(result, error)
+    return (f"Таблиц: {result['tables']}, включено колонок {result['columns_enabled']} из {result['columns_total']}, "
+            f"описаний: {result['done']}, ошибок LLM: {result['failed']}, за {result['elapsed_sec']} сек.")
+
+
+@shared_task(
+    bind=True,
+    time_limit=getattr(settings, 'CURATION_TIME_LIMIT', 60 * 60),
+    soft_time_limit=getattr(settings, 'CURATION_TIME_LIMIT', 60 * 60) - 30,
+)
+def task_describe_columns(self, column_ids):
+    """AI-описания выбранных колонок (ai_core.curation.describe_columns) в фоне."""
+    from .curation import describe_columns
+
+    result, error = None, ''
+    try:
+        result = describe_columns(column_ids, progress_callback=_curation_reporter(self, 'columns'))
+    except Exception as e:
+        error = _curation_error(e)
+        raise
+    finally:
+        _finish_curation(result, error)
+    return (f"Описано колонок: {result['described']} из {result['total']}, "
+            f"ошибок LLM: {result['failed']}, за {result['elapsed_sec']} сек.")
@@ -0,0 +1,644 @@
+import json
+import time
+from contextlib import nullcontext
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from sqlalchemy import create_engine, text
+
+from . import engine_registry, replica_router
+from .downsampling import _numeric_axis, downsample_line, lttb_indices
+from .fetch import read_frame_arrow
+from .freshness import DATA_TOKENS_KEY, referenced_tables
+from .models import DataSource, SchemaColumn, SchemaTable
+from .query_guard import QueryPlanGuard, QueryTooExpensiveError
+from .query_limits import (
+    ResultTooLargeError, check_result_size, concurrency_slot, override_timeout, slot_deadline, try_acquire_slot,
+)
+from .replica_router import Endpoint
+from .result_cache import QueryResultCache, deserialize_frame, normalize_sql, serialize_frame
+from .services import apply_schema_diff
+from .value_index import MAX_LITERALS, extract_literals
+
+
+class FakeSortedSet:
+    """Минимальный ZSET в памяти: только команды, которые использует concurrency_slot."""
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def zremrangebyscore(self, key, low, high):
+        zset = self.data.setdefault(key, {})
+        stale = [m for m, score in zset.items() if score <= high]
+        for member in stale:
+            del zset[member]
+        return len(stale)
+
+    def zadd(self, key, mapping):
+        self.data.setdefault(key, {}).update(mapping)
+
+    def zcard(self, key):
+        return len(self.data.get(key, {}))
+
+    def zrem(self, key, member):
+        self.data.get(key, {}).pop(member, None)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+        return queue
+
+    def execute(self):
+        return [getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+class ConcurrencySlotTests(SimpleTestCase):
+    key = 'query_slots:1'
+
+    def setUp(self):
+        self.redis = FakeSortedSet()
+
+    def test_slot_deadline_uses_own_timeout(self):
+        self.assertEqual(slot_deadline(1000, 30_000), 1000 + 30 + 60)
+
+    def test_acquires_until_limit(self):
+        self.assertTrue(try_acquire_slot(self.redis, self.key, 'a', 2000, 1000, 2))
+        self.assertTrue(try_acquire_slot(self.redis, self.key, 'b', 2000, 1000, 2))
+        self.assertFalse(try_acquire_slot(self.redis, self.key, 'c', 2000, 1000, 2))
+        self.assertNotIn('c', self.redis.data[self.key])
+
+    def test_short_query_does_not_prune_long_export(self):
+        # Выгрузка с часовым таймаутом заняла слот 10 минут назад
+        export_deadline = slot_deadline(1000, 3_600_000)
+        self.assertTrue(try_acquire_slot(self.redis, self.key, 'export', export_deadline, 1000, 1))
+
+        now = 1000 + 600
+        self.assertFalse(try_acquire_slot(self.redis, self.key, 'chat', slot_deadline(now, 30_000), now, 1))
+        self.assertIn('export', self.redis.data[self.key])
+
+    def test_expired_slot_is_released(self):
+        self.assertTrue(try_acquire_slot(self.redis, self.key, 'dead', slot_deadline(1000, 30_000), 1000, 1))
+
+        now = 1000 + 30 + 61
+        self.assertTrue(try_acquire_slot(self.redis, self.key, 'next', slot_deadline(now, 30_000), now, 1))
+        self.assertNotIn('dead', self.redis.data[self.key])
+
+
+class ReplicaOrderTests(SimpleTestCase):
+    ds_id = 1
+
+    def setUp(self):
+        replica_router._states.clear()
+        replica_router._round_robin.clear()
+        self.a = Endpoint(1, 'replica-a', 5432)
+        self.b = Endpoint(2, 'replica-b', 5432)
+        self.c = Endpoint(3, 'replica-c', 5432)
+
+    def test_empty(self):
+        self.assertEqual(replica_router._order(self.ds_id, []), [])
+
+    @override_settings(REPLICA_SELECTION='latency')
+    def test_sorted_by_latency_unmeasured_first(self):
+        replica_router.report_success(self.ds_id, self.a, 50)
+        replica_router.report_success(self.ds_id, self.b, 10)
+        self.assertEqual(replica_router._order(self.ds_id, [self.a, self.b, self.c]), [self.c, self.b, self.a])
+
+    @override_settings(REPLICA_SELECTION='latency', REPLICA_FAILOVER_COOLDOWN=30)
+    def test_failed_endpoint_goes_last_until_cooldown(self):
+        replica_router.report_success(self.ds_id, self.a, 1)
+        replica_router.report_success(self.ds_id, self.b, 100)
+        replica_router.report_failure(self.ds_id, self.a)
+        self.assertEqual(replica_router._order(self.ds_id, [self.a, self.b]), [self.b, self.a])
+
+        replica_router._states[(self.ds_id, self.a.endpoint_id)]['failed_until'] = time.monotonic() - 1
+        self.assertEqual(replica_router._order(self.ds_id, [self.a, self.b]), [self.a, self.b])
+
+    @override_settings(REPLICA_SELECTION='round_robin')
+    def test_round_robin_rotates(self):
+        endpoints = [self.a, self.b, self.c]
+        firsts = [replica_router._order(self.ds_id, endpoints)[0] for _ in range(3)]
+        self.assertEqual(firsts, [self.a, self.b, self.c])
+
+    def test_state_is_per_datasource(self):
+        replica_router.report_failure(2, self.a)
+        self.assertEqual(replica_router._order(self.ds_id, [self.a, self.b])[0], self.a)
+
+
+class LttbTests(SimpleTestCase):
+
+    def test_short_series_untouched(self):
+        x = np.arange(5)
+        np.testing.assert_array_equal(lttb_indices(x, x, 10), x)
+
+    def test_keeps_endpoints_and_size(self):
+        x = np.arange(1000)
+        y = np.sin(x / 50)
+        idx = lttb_indices(x, y, 100)
+        self.assertEqual(len(idx), 100)
+        self.assertEqual((idx[0], idx[-1]), (0, 999))
+        self.assertTrue((np.diff(idx) > 0).all())
+
+    def test_keeps_spike(self):
+        x = np.arange(1000)
+        y = np.zeros(1000)
+        y[437] = 100
+        self.assertIn(437, lttb_indices(x, y, 50))
+
+    def test_nat_axis_is_not_numeric(self):
+        values = pd.Series(['2024-01-01', None, '2024-01-03'])
+        self.assertIsNone(_numeric_axis(values))
+
+    def test_downsample_sorts_by_date(self):
+        dates = pd.date_range('2024-01-01', periods=500, freq='h')
+        df = pd.DataFrame({'d': dates[::-1], 'v': np.arange(500)})
+        result = downsample_line(df, 'd', 'v', 50)
+        self.assertEqual(len(result), 50)
+        self.assertTrue(result['d'].is_monotonic_increasing)
+
+
+class ApplySchemaDiffTests(TestCase):
+
+    def setUp(self):
+        self.ds = DataSource.objects.create(name='dwh', db_name='dwh', db_user='reader', db_password='secret')
+
+    def columns(self, table_name):
+        return dict(SchemaColumn.objects.filter(schema_table__data_source=self.ds, schema_table__table_name=table_name)
+                    .values_list('column_name', 'data_type'))
+
+    def test_creates_tables_and_columns(self):
+        stats = apply_schema_diff(self.ds, {'sales': [('id', 'INTEGER'), ('amount', 'NUMERIC')]},
+                                  schema_versions={'sales': 'v1'})
+        self.assertEqual((stats['tables_created'], stats['columns_created']), (1, 2))
+        table = SchemaTable.objects.get(data_source=self.ds, table_name='sales')
+        self.assertEqual(table.schema_version, 'v1')
+        self.assertEqual(self.columns('sales'), {'id': 'INTEGER', 'amount': 'NUMERIC'})
+
+    def test_writes_only_the_difference_and_keeps_curation(self):
+        apply_schema_diff(self.ds, {'sales': [('id', 'INTEGER'), ('amount', 'NUMERIC'), ('old', 'TEXT')]})
+        SchemaColumn.objects.filter(column_name='amount').update(description_ru='Сумма', is_metric=True)
+
+        stats = apply_schema_diff(self.ds, {'sales': [('id', 'INTEGER'), ('amount', 'DOUBLE'), ('city', 'TEXT')]})
+        self.assertEqual(stats['tables_created'], 0)
+        self.assertEqual((stats['columns_created'], stats['columns_updated'], stats['columns_deleted']), (1, 1, 1))
+        self.assertEqual(stats['tables_changed'], 1)
+        self.assertEqual(self.columns('sales'), {'id': 'INTEGER', 'amount': 'DOUBLE', 'city': 'TEXT'})
+        amount = SchemaColumn.objects.get(column_name='amount')
+        self.assertEqual((amount.description_ru, amount.is_metric), ('Сумма', True))
+
+    def test_unchanged_schema_is_noop(self):
+        reflected = {'sales': [('id', 'INTEGER')]}
+        apply_schema_diff(self.ds, reflected)
+        stats = apply_schema_diff(self.ds, reflected)
+        self.assertEqual(stats['tables_changed'], 0)
+
+    def test_prunes_tables_only_with_source_list(self):
+        apply_schema_diff(self.ds, {'sales': [('id', 'INTEGER')], 'legacy': [('id', 'INTEGER')]})
+
+        apply_schema_diff(self.ds, {'sales': [('id', 'INTEGER')]})
+        self.assertTrue(SchemaTable.objects.filter(data_source=self.ds, table_name='legacy').exists())
+
+        stats = apply_schema_diff(self.ds, {}, source_tables=['sales'])
+        self.assertEqual(stats['tables_deleted'], 1)
+        self.assertFalse(SchemaTable.objects.filter(data_source=self.ds, table_name='legacy').exists())
+        self.assertFalse(SchemaColumn.objects.filter(schema_table__table_name='legacy').exists())
+
+
+class ReferencedTablesTests(SimpleTestCase):
+    candidates = {'sales', 'Orders', 'user', 'regions'}
+
+    def test_plain_and_quoted_names(self):
+        sql = 'SELECT s.amount FROM sales s JOIN "Orders" o ON o.id = s.order_id'
+        self.assertEqual(referenced_tables(sql, self.candidates), {'sales', 'Orders'})
+
+    def test_backtick_names(self):
+        self.assertEqual(referenced_tables('SELECT id FROM `sales`', self.candidates), {'sales'})
+
+    def test_keyword_table_name(self):
+        self.assertEqual(referenced_tables('SELECT id FROM user', self.candidates), {'user'})
+
+    def test_string_literal_is_not_a_table(self):
+        sql = "SELECT id FROM sales WHERE region = 'regions'"
+        self.assertEqual(referenced_tables(sql, self.candidates), {'sales'})
+
+
+class ExtractLiteralsTests(SimpleTestCase):
+
+    def test_words_and_bigrams(self):
+        literals = extract_literals("Продажи в Южный Казахстан за 2024")
+        self.assertEqual(literals[:3], ['Продажи', 'Южный', 'Казахстан'])
+        self.assertIn('Южный Казахстан', literals)
+
+    def test_skips_short_words_and_numbers(self):
+        literals = extract_literals("бюджет за 2024 по ТВ")
+        self.assertEqual(literals, ['бюджет'])
+
+    def test_hyphenated_word(self):
+        self.assertIn('Усть-Каменогорск', extract_literals("клиенты Усть-Каменогорск"))
+
+    def test_deduplicated_and_capped(self):
+        self.assertEqual(extract_literals("Алматы Алматы"), ['Алматы', 'Алматы Алматы'])
+        many = " ".join(f"слово{chr(0x430 + i)}" for i in range(30))
+        self.assertEqual(len(extract_literals(many)), MAX_LITERALS)
+
+
+class ReadFrameArrowTests(SimpleTestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        self.connection = self.engine.connect()
+        self.connection.execute(text("CREATE TABLE t (a INTEGER, b NUMERIC, c TEXT)"))
+
+    def tearDown(self):
+        self.connection.close()
+        self.engine.dispose()
+
+    def insert(self, rows):
+        self.connection.execute(text("INSERT INTO t (a, b, c) VALUES (:a, :b, :c)"),
+                                [{'a': a, 'b': b, 'c': c} for a, b, c in rows])
+
+    def read(self, sql="SELECT a, b, c FROM t ORDER BY a", chunk_size=4, max_bytes=None):
+        return read_frame_arrow(self.connection, text(sql), chunk_size=chunk_size, max_bytes=max_bytes)
+
+    def test_null_first_chunk_takes_type_from_later_chunks(self):
+        self.insert([(i, None if i < 5 else i * 10, None if i < 5 else f"v{i}") for i in range(10)])
+        df = self.read()
+        self.assertEqual(len(df), 10)
+        self.assertEqual(df['b'].dtype, pd.ArrowDtype(pa.int64()))
+        c_type = df['c'].dtype.pyarrow_dtype
+        self.assertTrue(pa.types.is_string(c_type) or pa.types.is_large_string(c_type))
+        self.assertEqual(df['b'].isna().sum(), 5)
+        self.assertEqual(df['b'].iloc[-1], 90)
+
+    def test_mixed_int_and_float_chunks_widen_to_double(self):
+        self.insert([(i, i if i < 4 else i + 0.5, 'x') for i in range(8)])
+        df = self.read()
+        self.assertEqual(df['b'].dtype, pd.ArrowDtype(pa.float64()))
+        self.assertEqual(df['b'].tolist(), [0, 1, 2, 3, 4.5, 5.5, 6.5, 7.5])
+
+    def test_duplicate_column_names(self):
+        self.insert([(i, i, 'x') for i in range(6)])
+        df = self.read("SELECT a, a FROM t ORDER BY a")
+        self.assertEqual(df.shape, (6, 2))
+
+    def test_all_null_column(self):
+        self.insert([(i, None, None) for i in range(6)])
+        df = self.read()
+        self.assertTrue(df['b'].isna().all())
+
+    def test_empty_result(self):
+        self.assertEqual(len(self.read()), 0)
+
+    def test_stops_on_byte_budget(self):
+        self.insert([(i, i, 'x' * 1000) for i in range(100)])
+        with self.assertRaises(ResultTooLargeError):
+            self.read(chunk_size=10, max_bytes=5000)
+
+
+class FakeEngine:
+    def __init__(self):
+        self.disposed = False
+
+    def dispose(self):
+        self.disposed = True
+
+
+class EngineRegistryTests(SimpleTestCase):
+
+    def setUp(self):
+        self.engines = {key: FakeEngine() for key in ('ds:1', 'ds:1:ep:2', 'ds:1:ep:3', 'ds:10', 'ds:10:ep:1')}
+        engine_registry._engines.clear()
+        engine_registry._engines.update(
+            {key: {'fingerprint': '', 'engine': e, 'last_used': time.monotonic()} for key, e in self.engines.items()}
+        )
+
+    def tearDown(self):
+        engine_registry._engines.clear()
+
+    def test_keys(self):
+        self.assertEqual(engine_registry.datasource_key(1), 'ds:1')
+        self.assertEqual(engine_registry.datasource_key(1, 2), 'ds:1:ep:2')
+
+    def test_dispose_datasource_closes_primary_and_replicas_only(self):
+        engine_registry.dispose_datasource(1)
+        self.assertEqual(set(engine_registry._engines), {'ds:10', 'ds:10:ep:1'})
+        self.assertTrue(all(self.engines[k].disposed for k in ('ds:1', 'ds:1:ep:2', 'ds:1:ep:3')))
+        self.assertFalse(self.engines['ds:10'].disposed)
+
+
+class FakeRedis(FakeSortedSet):
+    """ZSET + строки + HASH в памяти: команды кэша результатов."""
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def incr(self, key):
+        self.data[key] = self.data.get(key, 0) + 1
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def zrem(self, key, *members):
+        for member in members:
+            self.data.get(key, {}).pop(member, None)
+
+    def zrangebyscore(self, key, low, high):
+        zset = self.data.get(key, {})
+        return [m.encode() for m, score in sorted(zset.items(), key=lambda i: i[1]) if score <= high]
+
+    def zrange(self, key, start, end):
+        zset = self.data.get(key, {})
+        return [m.encode() for m, _ in sorted(zset.items(), key=lambda i: i[1])][start:end + 1]
+
+    def hset(self, key, field, value):
+        self.data.setdefault(key, {})[field] = value
+
+    def hvals(self, key):
+        return list(self.data.get(key, {}).values())
+
+    def hmget(self, key, fields):
+        return [self.data.get(key, {}).get(f) for f in fields]
+
+    def hdel(self, key, *fields):
+        for field in fields:
+            self.data.get(key, {}).pop(field, None)
+
+
+class ArrowIpcTests(SimpleTestCase):
+
+    def test_numpy_dtypes_round_trip(self):
+        df = pd.DataFrame({'id': [1, 2], 'amount': [1.5, None], 'region': ['Алматы', 'Астана']})
+        restored = deserialize_frame(serialize_frame(df))
+        pd.testing.assert_frame_equal(restored, df)
+
+    def test_arrow_dtypes_round_trip(self):
+        df = pd.DataFrame({
+            'id': pd.array([1, None], dtype=pd.ArrowDtype(pa.int64())),
+            'region': pd.array(['Алматы', None], dtype=pd.ArrowDtype(pa.string())),
+        })
+        restored = deserialize_frame(serialize_frame(df))
+        self.assertTrue(all(isinstance(dtype, pd.ArrowDtype) for dtype in restored.dtypes))
+        pd.testing.assert_frame_equal(restored, df)
+
+    def test_untyped_objects_are_rejected(self):
+        with self.assertRaises(pa.ArrowException):
+            serialize_frame(pd.DataFrame({'x': [object()]}))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ResultCacheKeyTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.cache = QueryResultCache(1)
+
+    def test_normalize_keeps_literals(self):
+        sql = "SELECT  id -- комментарий\nFROM sales\n WHERE region = 'Южный  Казахстан';"
+        self.assertEqual(normalize_sql(sql), "SELECT id FROM sales WHERE region = 'Южный  Казахстан'")
+
+    def test_equivalent_sql_same_key(self):
+        self.assertEqual(
+            self.cache.make_key("SELECT id FROM sales;"),
+            self.cache.make_key("SELECT  id\nFROM sales -- комментарий"),
+        )
+
+    def test_key_depends_on_datasource(self):
+        self.assertNotEqual(self.cache.make_key("SELECT id FROM sales"),
+                            QueryResultCache(2).make_key("SELECT id FROM sales"))
+
+    def test_data_version_changes_key(self):
+        cache.set(DATA_TOKENS_KEY.format(1), {'sales': 'a', 'regions': 'x'})
+        sales_key = self.cache.make_key("SELECT id FROM sales")
+        regions_key = self.cache.make_key("SELECT id FROM regions")
+
+        cache.set(DATA_TOKENS_KEY.format(1), {'sales': 'b', 'regions': 'x'})
+        self.assertNotEqual(self.cache.make_key("SELECT id FROM sales"), sales_key)
+        # Таблица запроса не менялась - запись остается валидной
+        self.assertEqual(self.cache.make_key("SELECT id FROM regions"), regions_key)
+
+
+@override_settings(RESULT_CACHE_TTL=60)
+class ResultCacheEvictionTests(SimpleTestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        mock.patch.object(QueryResultCache, '_redis', return_value=self.redis).start()
+        mock.patch('ai_core.result_cache.data_version_for_sql', return_value='').start()
+        self.clock = mock.patch('ai_core.result_cache.time').start()
+        self.clock.time.return_value = 1000
+        self.addCleanup(mock.patch.stopall)
+        self.df = pd.DataFrame({'id': range(50)})
+        self.entry_bytes = len(serialize_frame(self.df))
+
+    def store(self, cache, sql, now):
+        self.clock.time.return_value = now
+        cache.set(sql, self.df)
+
+    def test_hit_and_miss_counters(self):
+        cache = QueryResultCache(1)
+        self.assertIsNone(cache.get("SELECT 1"))
+        self.store(cache, "SELECT 1", 1000)
+        pd.testing.assert_frame_equal(cache.get("SELECT 1"), self.df)
+        self.assertEqual((self.redis.data['result_cache:hits'], self.redis.data['result_cache:misses']), (1, 1))
+
+    def test_oldest_entry_evicted_over_budget(self):
+        with override_settings(RESULT_CACHE_MAX_BYTES=self.entry_bytes * 2):
+            cache = QueryResultCache(1)
+        for i, now in enumerate((1000, 1001, 1002)):
+            self.store(cache, f"SELECT {i}", now)
+
+        self.assertIsNone(cache.get("SELECT 0"))
+        self.assertIsNotNone(cache.get("SELECT 1"))
+        self.assertIsNotNone(cache.get("SELECT 2"))
+        self.assertEqual(sum(self.redis.hvals('result_cache:sizes')), self.entry_bytes * 2)
+
+    def test_expired_entries_leave_index(self):
+        cache = QueryResultCache(1)
+        self.store(cache, "SELECT 0", 1000)
+        self.store(cache, "SELECT 1", 1000 + 61)
+        self.assertEqual(list(self.redis.data['result_cache:index']), [cache.make_key("SELECT 1")])
+
+    def test_oversized_entry_not_stored(self):
+        with override_settings(RESULT_CACHE_MAX_ENTRY_BYTES=self.entry_bytes - 1):
+            cache = QueryResultCache(1)
+        self.store(cache, "SELECT 0", 1000)
+        self.assertIsNone(cache.get("SELECT 0"))
+        self.assertNotIn('result_cache:index', self.redis.data)
+
+
+class FakePgConnection:
+    """Соединение PG для EXPLAIN: план выбирается по тексту запроса, выполненные SQL запоминаются."""
+
+    dialect = SimpleNamespace(name='postgresql')
+
+    def __init__(self, plans):
+        self.plans = plans
+        self.executed = []
+
+    def begin_nested(self):
+        return nullcontext()
+
+    def execute(self, statement):
+        sql = str(statement)
+        self.executed.append(sql)
+        plan = self.plans['limited' if 'limited_q' in sql else 'original']
+        if isinstance(plan, Exception):
+            raise plan
+        return SimpleNamespace(scalar=lambda: json.dumps([{'Plan': plan}]))
+
+
+def pg_plan(cost, rows, **extra):
+    return {'Node Type': 'Seq Scan', 'Total Cost': cost, 'Plan Rows': rows, **extra}
+
+
+@override_settings(QUERY_EXPLAIN_ENABLED=True, QUERY_EXPLAIN_MAX_COST=None, QUERY_EXPLAIN_MAX_ROWS=None)
+class QueryPlanGuardTests(SimpleTestCase):
+    sql = "SELECT * FROM sales;"
+
+    def guard(self, **datasource):
+        defaults = {'explain_max_cost': None, 'explain_max_rows': 1000, 'explain_action': 'reject'}
+        return QueryPlanGuard(SimpleNamespace(**{**defaults, **datasource}))
+
+    def test_within_limits_unchanged(self):
+        conn = FakePgConnection({'original': pg_plan(100.0, 10)})
+        sql, estimate = self.guard().check(conn, self.sql)
+        self.assertEqual(sql, self.sql)
+        self.assertEqual((estimate.cost, estimate.rows, estimate.rewritten), (100.0, 10, False))
+
+    def test_too_many_rows_rejected(self):
+        conn = FakePgConnection({'original': pg_plan(100.0, 50_000)})
+        with self.assertRaises(QueryTooExpensiveError):
+            self.guard().check(conn, self.sql)
+
+    def test_too_many_rows_rewritten_with_limit(self):
+        conn = FakePgConnection({'original': pg_plan(100.0, 50_000), 'limited': pg_plan(20.0, 1000)})
+        sql, estimate = self.guard(explain_action='limit').check(conn, self.sql)
+        self.assertEqual(sql, "SELECT * FROM (SELECT * FROM sales) AS limited_q LIMIT 1000")
+        self.assertEqual((estimate.cost, estimate.rows, estimate.rewritten), (20.0, 1000, True))
+        self.assertEqual(len(conn.executed), 2)
+
+    def test_cost_gate_applies_after_rewrite(self):
+        conn = FakePgConnection({'original': pg_plan(100.0, 50_000), 'limited': pg_plan(5000.0, 1000)})
+        with self.assertRaises(QueryTooExpensiveError):
+            self.guard(explain_action='limit', explain_max_cost=1000).check(conn, self.sql)
+
+    def test_rows_under_added_limit_are_checked(self):
+        # LIMIT дописан телохранителем: решает оценка узла под Limit, а не сам LIMIT
+        limit = {'Node Type': 'Limit', 'Total Cost': 10.0, 'Plan Rows': 500, 'Plans': [pg_plan(9000.0, 50_000)]}
+        conn = FakePgConnection({'original': limit})
+        self.guard().check(conn, "SELECT * FROM sales LIMIT 500")
+        with self.assertRaises(QueryTooExpensiveError):
+            self.guard().check(conn, "SELECT * FROM sales LIMIT 500", limit_added=True)
+
+    def test_explain_failure_skips_check(self):
+        conn = FakePgConnection({'original': RuntimeError('syntax error')})
+        self.assertEqual(self.guard().check(conn, self.sql), (self.sql, None))
+
+    def test_disabled_without_thresholds(self):
+        conn = FakePgConnection({'original': pg_plan(100.0, 50_000)})
+        self.assertEqual(self.guard(explain_max_rows=None).check(conn, self.sql), (self.sql, None))
+        self.assertEqual(conn.executed, [])
+
+
+@override_settings(QUERY_SLOT_WAIT=0)
+class ConcurrencySlotContextTests(SimpleTestCase):
+    key = 'query_slots:1'
+
+    def setUp(self):
+        self.redis = FakeSortedSet()
+        mock.patch('ai_core.query_limits.get_redis_connection', return_value=self.redis).start()
+        mock.patch('ai_core.query_limits.time.sleep').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_times_out_when_full(self):
+        self.redis.zadd(self.key, {'running': time.time() + 600})
+        with self.assertRaises(TimeoutError):
+            with concurrency_slot(1, 1, 30_000):
+                self.fail("слот не должен быть выдан")
+        self.assertEqual(list(self.redis.data[self.key]), ['running'])
+
+    def test_slot_released_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with concurrency_slot(1, 1, 30_000):
+                self.assertEqual(self.redis.zcard(self.key), 1)
+                raise RuntimeError
+        self.assertEqual(self.redis.zcard(self.key), 0)
+
+    def test_abandoned_slot_is_reclaimed(self):
+        self.redis.zadd(self.key, {'crashed': time.time() - 1})
+        with concurrency_slot(1, 1, 30_000):
+            self.assertNotIn('crashed', self.redis.data[self.key])
+
+
+class CheckResultSizeTests(SimpleTestCase):
+    df = pd.DataFrame({'region': ['Алматы'] * 100})
+
+    def test_within_limit_or_unlimited(self):
+        check_result_size(self.df, None)
+        check_result_size(self.df, 10 * 1024 * 1024)
+
+    def test_over_limit(self):
+        with self.assertRaises(ResultTooLargeError):
+            check_result_size(self.df, 1024)
+
+
+class FakeMySqlConnection:
+    """Соединение MySQL: запоминает выполненные SQL, SELECT возвращает текущий таймаут."""
+
+    dialect = SimpleNamespace(name='mysql')
+
+    def __init__(self, fail_on_restore=False):
+        self.executed = []
+        self.fail_on_restore = fail_on_restore
+        self.invalidated = False
+
+    def execute(self, statement, params=None):
+        sql = str(statement)
+        if self.fail_on_restore and sql.endswith('= 5000'):
+            raise RuntimeError('connection lost')
+        self.executed.append(sql)
+        return SimpleNamespace(scalar=lambda: 5000)
+
+    def invalidate(self):
+        self.invalidated = True
+
+
+class OverrideTimeoutTests(SimpleTestCase):
+
+    def test_mysql_restores_previous_value(self):
+        conn = FakeMySqlConnection()
+        with override_timeout(conn, 600_000):
+            self.assertEqual(conn.executed[-1], "SET SESSION MAX_EXECUTION_TIME = 600000")
+        self.assertEqual(conn.executed[-1], "SET SESSION MAX_EXECUTION_TIME = 5000")
+        self.assertFalse(conn.invalidated)
+
+    def test_failed_restore_invalidates_connection(self):
+        conn = FakeMySqlConnection(fail_on_restore=True)
+        with override_timeout(conn, 600_000):
+            pass
+        self.assertTrue(conn.invalidated)
+
+    def test_sqlite_deadline_restored_after_error(self):
+        with create_engine('sqlite://').connect() as conn:
+            with self.assertRaises(RuntimeError):
+                with override_timeout(conn, 100):
+                    self.assertEqual(conn.info['query_timeout_ms'], 100)
+                    raise RuntimeError
+            self.assertNotIn('query_timeout_ms', conn.info)
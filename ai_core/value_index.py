@@ -0,0 +1,139 @@
+# Индекс значений измерений: литерал из вопроса -> колонка и каноническое значение.
+# Значения колонок is_dimension собираются выборкой из источника (после синхронизации схемы),
+# поиск - один запрос по триграммному GIN-индексу ColumnValue.value (pg_trgm).
+import logging
+import re
+import time
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Greatest
+from sqlalchemy import text
+
+from .models import ColumnValue, SchemaColumn
+
+logger = logging.getLogger(__name__)
+
+# Слово начинается с буквы (числа вроде "2024" - не значения измерений), от 3 символов
+_WORD_RE = re.compile(r"[^\W\d_][\w-]{2,}")
+MAX_LITERALS = 20
+
+
+def _sample_values(connection, table_name: str, column_name: str, max_distinct: int, sample_rows: int):
+    """
+    Частоты значений колонки в первых sample_rows строках.
+    None - различных значений больше max_distinct (колонка не низкокардинальная).
+    """
+    quote = connection.dialect.identifier_preparer.quote
+    column, table = quote(column_name), quote(table_name)
+    rows = connection.execute(
+        text(
+            f"SELECT v, COUNT(*) AS n FROM ("
+            f"SELECT {column} AS v FROM {table} WHERE {column} IS NOT NULL LIMIT :sample_rows"
+            f") s GROUP BY v ORDER BY n DESC LIMIT :limit"
+        ),
+        {'sample_rows': sample_rows, 'limit': max_distinct + 1},
+    ).fetchall()
+    if len(rows) > max_distinct:
+        return None
+
+    values = {}
+    for value, count in rows:
+        # Только текстовые значения: числа и даты LLM и так пишет правильно
+        if not isinstance(value, str) or not value.strip():
+            continue
+        value = value.strip()[:255]
+        values[value] = values.get(value, 0) + count
+    return values
+
+
+def index_datasource_values(datasource) -> dict:
+    """
+    Пересобирает ColumnValue для включенных колонок-измерений источника.
+    Колонки с ошибкой выборки сохраняют прежние значения; высококардинальные - очищаются.
+    """
+    from .db_executor import DatabaseExecutor
+    from .replica_router import introspection_endpoint
+
+    max_distinct = getattr(settings, 'VALUE_INDEX_MAX_DISTINCT', 200)
+    sample_rows = getattr(settings, 'VALUE_INDEX_SAMPLE_ROWS', 100_000)
+    started = time.monotonic()
+
+    columns = list(SchemaColumn.objects.filter(
+        schema_table__data_source=datasource,
+        schema_table__is_enabled=True,
+        is_enabled=True,
+        is_dimension=True,
+    ).select_related('schema_table'))
+
+    engine = DatabaseExecutor(datasource=datasource).engine_for(introspection_endpoint(datasource))
+    new_values, failed_ids, skipped = [], [], 0
+    with engine.connect() as connection:
+        for column in columns:
+            try:
+                values = _sample_values(connection, column.schema_table.table_name, column.column_name,
+                                        max_distinct, sample_rows)
+            except Exception as e:
+                logger.warning(f"Индекс значений: не удалось прочитать {column}: {e}")
+                connection.rollback()
+                failed_ids.append(column.id)
+                continue
+            if values is None:
+                skipped += 1
+                continue
+            new_values.extend(ColumnValue(column=column, value=v, frequency=n) for v, n in values.items())
+
+    with transaction.atomic():
+        # Удаляются и значения колонок, которые больше не измерения
+        ColumnValue.objects.filter(column__schema_table__data_source=datasource) \
+            .exclude(column_id__in=failed_ids).delete()
+        ColumnValue.objects.bulk_create(new_values, batch_size=1000)
+
+    stats = {
+        'columns': len(columns),
+        'values': len(new_values),
+        'high_cardinality': skipped,
+        'failed': len(failed_ids),
+        'elapsed_sec': round(time.monotonic() - started, 1),
+    }
+    logger.info(f"Индекс значений {datasource.name}: {stats}")
+    return stats
+
+
+def extract_literals(user_prompt: str) -> list:
+    """Слова вопроса и пары соседних слов ("Южный Казахстан")."""
+    words = _WORD_RE.findall(user_prompt)
+    literals = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    return list(dict.fromkeys(literals))[:MAX_LITERALS]
+
+
+def match_values(user_prompt: str) -> list:
+    """
+    Значения измерений, похожие на литералы вопроса (с учетом падежей: "Алматы"/"Астане"),
+    по убыванию близости. Один запрос: условия `%` по каждому литералу идут через GIN-индекс.
+    """
+    literals = extract_literals(user_prompt)
+    if not literals:
+        return []
+
+    condition = Q()
+    for literal in literals:
+        condition |= Q(value__trigram_similar=literal)
+    similarities = [TrigramSimilarity('value', literal) for literal in literals]
+    similarity = Greatest(*similarities) if len(similarities) > 1 else similarities[0]
+
+    return list(
+        ColumnValue.objects.filter(
+            condition,
+            column__is_enabled=True,
+            column__is_dimension=True,
+            column__schema_table__is_enabled=True,
+            column__schema_table__data_source__is_active=True,
+        )
+        .annotate(similarity=similarity)
+        .filter(similarity__gte=getattr(settings, 'VALUE_INDEX_MIN_SIMILARITY', 0.5))
+        .select_related('column__schema_table')
+        .order_by('-similarity', '-frequency')[:getattr(settings, 'VALUE_INDEX_MAX_MATCHES', 10)]
+    )
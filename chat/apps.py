@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+    def ready(self):
+        # Публикация новых ответов ИИ в Redis (push-канал)
+        from . import signals  # noqa: F401
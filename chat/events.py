@@ -0,0 +1,68 @@
+# Push-канал для чата: Redis pub/sub -> Server-Sent Events.
+# Celery-воркер публикует событие при сохранении ответа ИИ,
+# ASGI-view (message_events) транслирует его в браузер.
+import json
+import logging
+import time
+
+import redis
+from django.conf import settings
+from django.template.loader import render_to_string
+
+logger = logging.getLogger(__name__)
+
+_client = None
+
+
+def channel_name(session_id) -> str:
+    return f"chat:session:{session_id}"
+
+
+def _get_client() -> redis.Redis:
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.CHAT_EVENTS_REDIS_URL)
+    return _client
+
+
+def publish(session_id, event: str, data: dict):
+    """Публикует событие в канал сессии. Ошибки Redis не ломают задачу - есть polling."""
+    payload = json.dumps({'event': event, **data}, ensure_ascii=False, default=str)
+    try:
+        _get_client().publish(channel_name(session_id), payload)
+    except Exception as e:
+        logger.warning(f"Не удалось опубликовать событие '{event}' для сессии {session_id}: {e}")
+
+
+def publish_message(message):
+    # stage != 'done' - ответ еще наполняется (см. chat.tasks.ProgressiveAnswer)
+    publish(message.session_id, 'message', {
+        'message_id': message.id,
+        'stage': (message.data_payload or {}).get('stage', 'done'),
+        'message_html': render_to_string('chat/components/message_block.html', {'message': message}),
+    })
+
+
+class ChunkPublisher:
+    """
+    Копит токены сводки и публикует их пачками (не чаще CHAT_EVENTS_CHUNK_INTERVAL),
+    чтобы не дергать Redis на каждый токен.
+    """
+
+    def __init__(self, session_id, event: str = 'summary_chunk'):
+        self.session_id = session_id
+        self.event = event
+        self.interval = getattr(settings, 'CHAT_EVENTS_CHUNK_INTERVAL', 0.1)
+        self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def push(self, delta: str):
+        self._buffer.append(delta)
+        if time.monotonic() - self._last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            publish(self.session_id, self.event, {'delta': "".join(self._buffer)})
+            self._buffer = []
+        self._last_flush = time.monotonic()
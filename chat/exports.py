@@ -0,0 +1,72 @@
+# Потоковая выгрузка результата SQL (CSV / XLSX) без загрузки всего результата в память.
+# Источник строк - DatabaseExecutor.stream_query (серверный курсор, пачки строк).
+import csv
+import datetime
+import decimal
+import logging
+import tempfile
+
+from openpyxl import Workbook
+
+logger = logging.getLogger(__name__)
+
+CSV_CONTENT_TYPE = 'text/csv; charset=utf-8'
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+class _Echo:
+    """Псевдо-файл для csv.writer: write() просто возвращает строку."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(columns, row_chunks):
+    """Отдает CSV построчно (для StreamingHttpResponse). BOM - чтобы Excel понял UTF-8."""
+    writer = csv.writer(_Echo())
+    yield '\ufeff' + writer.writerow(columns)
+    for chunk in row_chunks:
+        yield "".join(writer.writerow(row) for row in chunk)
+
+
+def _cell_value(value):
+    # Excel не поддерживает даты с часовым поясом и произвольные типы (UUID, JSON, ...)
+    if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+        return value.replace(tzinfo=None)
+    if value is None or isinstance(value, (str, int, float, decimal.Decimal, datetime.date, datetime.time, bool)):
+        return value
+    return str(value)
+
+
+def write_csv(path, columns, row_chunks):
+    """Пишет CSV в файл пачками (для фоновой выгрузки)."""
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for chunk in row_chunks:
+            writer.writerows(chunk)
+
+
+def save_xlsx(path, columns, row_chunks, sheet_name='Data'):
+    """
+    Пишет XLSX в режиме write_only: строки сразу уходят на диск,
+    а не в дерево ячеек, поэтому память не зависит от числа строк.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=sheet_name)
+    ws.append(columns)
+    for chunk in row_chunks:
+        for row in chunk:
+            ws.append([_cell_value(v) for v in row])
+    wb.save(path)
+
+
+def write_xlsx(columns, row_chunks, sheet_name='Data'):
+    """
+    XLSX во временном файле, открытом на начале.
+    Файл удаляется при закрытии (FileResponse закрывает его после отправки).
+    """
+    tmp = tempfile.NamedTemporaryFile(suffix='.xlsx')
+    save_xlsx(tmp.name, columns, row_chunks, sheet_name=sheet_name)
+    tmp.seek(0)
+    return tmp
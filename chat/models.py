@@ -2,6 +2,8 @@ from django.conf import settings
 from django.db import models
 import uuid
 
+from ai_core.models import DataSource
+
 class ChatSession(models.Model):
     public_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     user = models.ForeignKey(
@@ -36,5 +38,64 @@ class Message(models.Model):
     def __str__(self):
         return f"{self.role}: {self.content[:50]}"
 
+    def sql_sources(self) -> list:
+        """
+        [(DataSource, SQL), ...] ответа: по одному на источник (chat.tasks.get_ai_response).
+        Старые сообщения без sub_queries относим к первому активному источнику.
+        """
+        payload = self.data_payload or {}
+        sub_queries = payload.get('sub_queries')
+        if not sub_queries:
+            if not payload.get('sql_query'):
+                return []
+            datasource = DataSource.objects.filter(is_active=True).defer('db_password').first()
+            return [(datasource, payload['sql_query'])]
+
+        datasources = DataSource.objects.defer('db_password').in_bulk([q['datasource_id'] for q in sub_queries])
+        return [(datasources[q['datasource_id']], q['sql_query'])
+                for q in sub_queries if q['datasource_id'] in datasources]
+
+
+
 
+class ExportJob(models.Model):
+    """
+    Фоновая выгрузка результата сообщения (chat.tasks.export_message_data).
+    Файл пишется в EXPORT_ROOT пачками, удаляется задачей cleanup_export_files.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Готово'),
+        ('failed', 'Ошибка'),
+        ('cancelled', 'Отменено'),
+    )
+    FORMAT_CHOICES = (('csv', 'CSV'), ('xlsx', 'Excel'))
+
+    public_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='export_jobs'
+    )
+    message = models.ForeignKey(
+        Message,
+        on_delete=models.CASCADE,
+        related_name='export_jobs'
+    )
+    export_format = models.CharField(max_length=10, choices=FORMAT_CHOICES, default='csv')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    task_id = models.CharField(max_length=255, null=True, blank=True)
+    rows_written = models.PositiveBigIntegerField(default=0)
+    file_path = models.CharField(max_length=500, blank=True, default='')
+    file_size = models.PositiveBigIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Выгрузка {self.export_format} #{self.message_id} ({self.status})"
 
+    @property
+    def is_finished(self):
+        return self.status in ('done', 'failed', 'cancelled')
@@ -0,0 +1,14 @@
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .events import publish_message
+from .models import Message
+
+
+@receiver(post_save, sender=Message)
+def on_ai_message_saved(sender, instance, created, **kwargs):
+    # Пушим каждое сохранение ответа ИИ (в т.ч. промежуточные этапы);
+    # пользовательские сообщения клиент рисует сам
+    if instance.role == 'ai':
+        transaction.on_commit(lambda: publish_message(instance))
@@ -1,7 +1,14 @@
 from celery import shared_task
-from .models import ChatSession, Message
+from .models import ChatSession, Message, ExportJob
 import logging
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from django.conf import settings
+from django.db import connection as db_connection
+from django.utils import timezone
 
 # Импорты ai_core
 from ai_core.sql_generator import SQLGenerator
@@ -9,10 +16,16 @@ from ai_core.security import SQLValidator
 from ai_core.db_executor import DatabaseExecutor
 from ai_core.chart_generator import ChartGenerator
 from ai_core.response_formatter import ResponseFormatter
-from ai_core.models import DataSource, SchemaTable
+from ai_core.models import SchemaTable
+from ai_core import query_cancel
+from .events import ChunkPublisher
+from .exports import write_csv, save_xlsx
 
 logger = logging.getLogger(__name__)
 
+# Как часто (сек) проверять отмену, пока ждем сводку
+CANCEL_CHECK_INTERVAL = 1.0
+
 
 # Вспомогательное исключение для прерывания
 class TaskCancelledException(Exception):
@@ -35,6 +48,201 @@ def check_if_cancelled(session_id, current_task_id):
         raise TaskCancelledException()
 
 
+class ProgressiveAnswer:
+    """
+    Один Message ответа ИИ, который наполняется по мере готовности этапов:
+    SQL -> данные -> график -> сводка. Этап пишется в data_payload['stage'],
+    каждое сохранение пушится клиенту (chat.signals).
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.message = None
+
+    def update(self, stage: str, content: str = None, **payload):
+        if self.message is None:
+            self.message = Message(session=self.session, role='ai', content='', data_payload={})
+
+        self.message.data_payload.update(payload, stage=stage)
+        if content is not None:
+            self.message.content = content
+
+        if self.message.pk is None:
+            self.message.save()
+        else:
+            self.message.save(update_fields=['content', 'data_payload'])
+
+    def fail(self, error_message: str, stage: str = 'error'):
+        """Показывает ошибку в уже начатом ответе (или создает новое сообщение)."""
+        if self.message is None:
+            _save_error_message(self.session.id, error_message)
+            return
+        try:
+            self.update(stage, content=error_message)
+        except Exception:
+            pass
+
+
+def _elapsed_ms(started: float) -> int:
+    return int((time.monotonic() - started) * 1000)
+
+
+def _build_chart_and_summary(session_id, task_id, user_prompt, df, chart_gen, response_formatter,
+                             answer, timings):
+    """
+    График и сводка зависят только от df и вопроса, поэтому считаем их параллельно:
+    сводка (сетевой вызов Ollama) - в отдельном потоке, график - в текущем.
+    Ошибка одной ветки не роняет другую; отмена пользователем прерывает стрим сводки.
+    Возвращает (chart_json, text_response_raw).
+    """
+    cancel_event = threading.Event()
+
+    def summary_branch():
+        started = time.monotonic()
+        try:
+            if settings.OLLAMA_STREAM_SUMMARY:
+                # Токены сводки уходят в браузер по мере генерации (SSE)
+                chunk_publisher = ChunkPublisher(session_id)
+                text = response_formatter.stream_summary_response(
+                    user_prompt, df, on_chunk=chunk_publisher.push, should_stop=cancel_event.is_set
+                )
+                if not cancel_event.is_set():
+                    chunk_publisher.flush()
+                return text
+            return response_formatter.get_summary_response(user_prompt, df)
+        finally:
+            timings['summary_ms'] = _elapsed_ms(started)
+
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='summary')
+    try:
+        summary_future = pool.submit(summary_branch)
+
+        started = time.monotonic()
+        chart_json = chart_gen.generate_plotly_json(df, user_prompt)
+        timings['chart_ms'] = _elapsed_ms(started)
+        if chart_json:
+            # Этап 3 готов: график (сводка еще генерируется)
+            answer.update('chart', plotly_json=chart_json, chart_meta=chart_gen.last_chart_meta)
+
+        while True:
+            check_if_cancelled(session_id, task_id)
+            try:
+                text_response_raw = summary_future.result(timeout=CANCEL_CHECK_INTERVAL)
+                break
+            except Exception as e:
+                # Сводка еще генерируется (TimeoutError самой сводки - уже ее ошибка, не ожидание)
+                if isinstance(e, FutureTimeoutError) and not summary_future.done():
+                    continue
+                # Данные и график уже показаны - отдаем ответ без текстовой сводки
+                logger.warning(f"Сводка не получена, ответ без сводки: {e}")
+                timings['summary_error'] = str(e)
+                text_response_raw = ""
+                break
+
+        timings.update(response_formatter.last_timings)
+        return chart_json, text_response_raw
+
+    finally:
+        # Отмена, ошибка графика или сохранения этапа - поток сводки больше не нужен:
+        # не ждем его, он сам остановится на следующем фрагменте и не будет пушить SSE
+        cancel_event.set()
+        pool.shutdown(wait=False)
+
+
+def _new_sql_generator():
+    return SQLGenerator(
+        model_name=settings.OLLAMA_SQL_MODEL,
+        host=settings.OLLAMA_HOST,
+        temperature=settings.OLLAMA_SQL_TEMPERATURE
+    )
+
+
+class SourceBranch:
+    """
+    Подзапрос ответа к одному DataSource: свой SQLGenerator (кэш SQL по источнику),
+    свой DatabaseExecutor (пул соединений источника) и результат.
+    """
+
+    def __init__(self, datasource, tables, sql_gen):
+        self.datasource = datasource
+        self.tables = tables
+        self.sql_gen = sql_gen
+        self.sql_query = ""
+        self.executor = None
+        self.df = None
+
+    def generate(self, user_prompt, history, query_vector):
+        self.sql_query = self.sql_gen.generate_sql(
+            user_prompt, history=history, datasource=self.datasource,
+            target_tables=self.tables, query_vector=query_vector
+        )
+        allowed_tables = SchemaTable.objects.filter(is_enabled=True, data_source=self.datasource) \
+            .values_list('table_name', flat=True)
+        SQLValidator(allowed_tables=list(allowed_tables)).validate_sql_safety(self.sql_query)
+
+    def execute(self, cancel_key):
+        self.executor = DatabaseExecutor(datasource=self.datasource)
+        self.df = self.executor.execute_query(self.sql_query, cancel_key=cancel_key)
+        # SQL проверен и выполнился -> можно переиспользовать для похожих вопросов
+        self.sql_gen.remember_sql(self.sql_query)
+
+    def as_payload(self) -> dict:
+        return {
+            'datasource_id': self.datasource.id,
+            'datasource': self.datasource.name,
+            'sql_query': self.sql_query,
+            'rows_count': len(self.df) if self.df is not None else None,
+        }
+
+
+def _run_branches(branches, fn) -> list:
+    """
+    Один источник - в текущем потоке; несколько - параллельно.
+    Основная ветка (первая, с наибольшим весом) обязательна - ее ошибка пробрасывается.
+    Остальные - по возможности: ошибка пишется в лог, ветка отбрасывается.
+    Возвращает ветки, выполнившиеся успешно.
+    """
+    if len(branches) == 1:
+        fn(branches[0])
+        return branches
+
+    def run(branch):
+        try:
+            fn(branch)
+        finally:
+            db_connection.close()  # у потока пула свое соединение Django
+
+    with ThreadPoolExecutor(max_workers=len(branches), thread_name_prefix='source') as pool:
+        futures = [pool.submit(run, b) for b in branches]
+        futures[0].result()
+        succeeded = [branches[0]]
+        for branch, future in zip(branches[1:], futures[1:]):
+            try:
+                future.result()
+                succeeded.append(branch)
+            except Exception as e:
+                logger.warning(f"Дополнительный источник {branch.datasource.name} пропущен: {e}")
+    return succeeded
+
+
+def _combined_sql(branches) -> str:
+    if len(branches) == 1:
+        return branches[0].sql_query
+    return "\n\n".join(f"-- Источник: {b.datasource.name}\n{b.sql_query}" for b in branches)
+
+
+def _secondary_tables(branches) -> str:
+    """
+    Данные дополнительных источников - отдельными таблицами: колонки у источников разные,
+    поэтому в один DataFrame (график, сводка) они не склеиваются.
+    """
+    sections = []
+    for b in branches[1:]:
+        body = b.df.to_markdown(index=False) if not b.df.empty else "Данных не найдено."
+        sections.append(f"**Источник: {b.datasource.name}**\n\n{body}")
+    return "".join(f"\n\n{section}" for section in sections)
+
+
 @shared_task(
     bind=True,
     autoretry_for=(ConnectionError, TimeoutError),
@@ -52,22 +260,8 @@ def get_ai_response(self, session_id, user_prompt):
         check_if_cancelled(session_id, task_id)
 
         # --- ИНИЦИАЛИЗАЦИЯ ---
-        active_datasource = DataSource.objects.filter(is_active=True).first()
-        if not active_datasource:
-            logger.warning("Нет активного DataSource!")
-
-        allowed_tables_qs = SchemaTable.objects.filter(is_enabled=True)
-        if active_datasource:
-            allowed_tables_qs = allowed_tables_qs.filter(data_source=active_datasource)
-        dynamic_allowed_tables = list(allowed_tables_qs.values_list('table_name', flat=True))
-
-        sql_gen = SQLGenerator(
-            model_name=settings.OLLAMA_SQL_MODEL,
-            host=settings.OLLAMA_HOST,
-            temperature=settings.OLLAMA_SQL_TEMPERATURE
-        )
-        sql_validator = SQLValidator(allowed_tables=dynamic_allowed_tables)
-        db_executor = DatabaseExecutor(datasource=active_datasource)
+        # Источник(и) выбираются по найденным таблицам (ШАГ 1), а не первый активный
+        sql_gen = _new_sql_generator()
         chart_gen = ChartGenerator()
         response_formatter = ResponseFormatter(
             model_name=settings.OLLAMA_SUMMARY_MODEL,
@@ -86,6 +280,8 @@ def get_ai_response(self, session_id, user_prompt):
         return
 
     sql_query = ""
+    answer = ProgressiveAnswer(session)
+    timings = {}  # Время по этапам (мс), пишется в data_payload['timings']
     try:
         # [CHECKPOINT 2] Проверка перед генерацией SQL (Самый долгий этап 1)
         check_if_cancelled(session_id, task_id)
@@ -101,41 +297,75 @@ def get_ai_response(self, session_id, user_prompt):
                 content += f"\n(SQL: {msg.data_payload['sql_query']})"
             formatted_history.append({'role': role, 'content': content})
 
-        sql_query = sql_gen.generate_sql(user_prompt, history=formatted_history)
+        started = time.monotonic()
+        routes = sql_gen.route_sources(user_prompt)
+        if not routes:
+            raise ValueError("Нет включенных таблиц ни в одном активном источнике данных.")
+        branches = [
+            SourceBranch(datasource, tables, sql_gen if i == 0 else _new_sql_generator())
+            for i, (datasource, tables) in enumerate(routes)
+        ]
+        log_context['datasources'] = [b.datasource.id for b in branches]
+
+        # --- (ШАГ 2: БЕЗОПАСНОСТЬ) --- проверяется в каждой ветке сразу после генерации
+        branches = _run_branches(
+            branches, lambda b: b.generate(user_prompt, formatted_history, sql_gen.last_query_vector)
+        )
+        timings['sql_ms'] = _elapsed_ms(started)
+        sql_query = _combined_sql(branches)
+        sql_cache_hit = all(b.sql_gen.cache_hit for b in branches)
         log_context['sql'] = sql_query
-
-        # --- (ШАГ 2: БЕЗОПАСНОСТЬ) ---
-        sql_validator.validate_sql_safety(sql_query)
+        log_context['sql_cache_hit'] = sql_cache_hit
 
         # [CHECKPOINT 3] Проверка перед выполнением SQL
         check_if_cancelled(session_id, task_id)
 
-        # --- (ШАГ 3: ВЫПОЛНЕНИЕ SQL) ---
-        df = db_executor.execute_query(sql_query)
-        log_context['rows_found'] = len(df)
+        # Этап 1 готов: пользователь сразу видит SQL
+        answer.update('sql', content="Выполняю запрос к базе данных...",
+                      sql_query=sql_query, sql_cache_hit=sql_cache_hit,
+                      sub_queries=[b.as_payload() for b in branches])
+
+        # --- (ШАГ 3: ВЫПОЛНЕНИЕ SQL) --- по источникам параллельно, у каждого свой пул
+        started = time.monotonic()
+        try:
+            # Ключ отмены на ветку: cancel_generation прервет запросы прямо в БД
+            branches = _run_branches(
+                branches, lambda b: b.execute(query_cancel.branch_key(task_id, b.datasource.id))
+            )
+        except Exception:
+            # Ошибка из-за отмены пользователем (pg_cancel_backend / KILL QUERY) - это не сбой
+            check_if_cancelled(session_id, task_id)
+            raise
+        timings['execute_ms'] = _elapsed_ms(started)
+        sql_query = _combined_sql(branches)
+        # График и сводка - по основному источнику; остальные показываются таблицами
+        df = branches[0].df
+        extra_tables = _secondary_tables(branches)
+        log_context['rows_found'] = sum(len(b.df) for b in branches)
+
+        # Этап 2 готов: цифры (таблица) - до графика и сводки
+        data_text = (response_formatter.format_final_message("", None, df)
+                     or "По вашему запросу данных не найдено.") + extra_tables
+        answer.update('data', content=data_text, rows_count=len(df), sql_query=sql_query,
+                      sub_queries=[b.as_payload() for b in branches],
+                      query_plan=branches[0].executor.last_plan)
 
         # [CHECKPOINT 4] Проверка перед генерацией сводки (Самый долгий этап 2)
         check_if_cancelled(session_id, task_id)
 
-        # --- (ШАГ 4: ГРАФИК + СВОДКА) ---
-        chart_json = chart_gen.generate_plotly_json(df, user_prompt)
-        text_response_raw = response_formatter.get_summary_response(user_prompt, df)
+        # --- (ШАГ 4: ГРАФИК + СВОДКА, параллельно) ---
+        chart_json, text_response_raw = _build_chart_and_summary(
+            session_id, task_id, user_prompt, df, chart_gen, response_formatter, answer, timings
+        )
+        log_context.update(timings)
 
-        final_text = response_formatter.format_final_message(text_response_raw, chart_json, df)
+        final_text = response_formatter.format_final_message(text_response_raw, chart_json, df) + extra_tables
 
         # [CHECKPOINT 5] Финальная проверка перед сохранением
         check_if_cancelled(session_id, task_id)
 
         # --- (ШАГ 5: СОХРАНЕНИЕ) ---
-        Message.objects.create(
-            session=session,
-            role='ai',
-            content=final_text,
-            data_payload={
-                'plotly_json': chart_json,
-                'sql_query': sql_query
-            }
-        )
+        answer.update('done', content=final_text, plotly_json=chart_json, timings=timings)
 
         # Очищаем ID задачи в сессии, так как мы закончили
         session.current_task_id = None
@@ -146,18 +376,20 @@ def get_ai_response(self, session_id, user_prompt):
 
     except TaskCancelledException:
         logger.warning("Задача была прервана пользователем.", extra=log_context)
-        # Мы ничего не сохраняем и просто выходим
+        # Уже показанные этапы оставляем, но помечаем ответ как завершенный
+        if answer.message is not None:
+            answer.update('cancelled')
 
     except (PermissionError, ValueError, TimeoutError) as e:
         logger.warning(f"Ошибка валидации: {e}", extra=log_context)
-        _save_error_message(session_id, f"Ошибка при обработке запроса: {e}\n\n**Сгенерированный SQL:**\n`{sql_query}`")
+        answer.fail(f"Ошибка при обработке запроса: {e}\n\n**Сгенерированный SQL:**\n`{sql_query}`")
         self.request.disable_retries()
         # Очищаем ID задачи
         _clear_task_id(session_id)
 
     except Exception as e:
         logger.error(f"Неизвестная ошибка: {e}", extra=log_context)
-        _save_error_message(session_id, f"Извините, произошла ошибка. Повторяем попытку...")
+        answer.fail(f"Извините, произошла ошибка. Повторяем попытку...")
         _clear_task_id(session_id)
         raise self.retry(exc=e)
 
@@ -175,4 +407,134 @@ def _clear_task_id(session_id):
         s.current_task_id = None
         s.save(update_fields=['current_task_id'])
     except:
-        pass
\ No newline at end of file
+        pass
+
+# --- ФОНОВАЯ ВЫГРУЗКА ---
+
+class ExportCancelledException(Exception):
+    pass
+
+
+def _tracked_chunks(task, job, row_chunks):
+    """
+    Пропускает пачки строк к writer'у, по пути пишет прогресс в ExportJob
+    и проверяет отмену (status='cancelled' выставляет view cancel_export).
+    """
+    interval = getattr(settings, 'EXPORT_PROGRESS_INTERVAL', 2.0)
+    last_report = time.monotonic()
+    for chunk in row_chunks:
+        yield chunk
+        job.rows_written += len(chunk)
+
+        if time.monotonic() - last_report >= interval:
+            last_report = time.monotonic()
+            ExportJob.objects.filter(id=job.id).update(rows_written=job.rows_written)
+            task.update_state(state='PROGRESS', meta={'rows_written': job.rows_written})
+            if ExportJob.objects.filter(id=job.id, status='cancelled').exists():
+                raise ExportCancelledException()
+
+
+@shared_task(
+    bind=True,
+    time_limit=getattr(settings, 'EXPORT_JOB_TIME_LIMIT', 60 * 60),
+    soft_time_limit=getattr(settings, 'EXPORT_JOB_TIME_LIMIT', 60 * 60) - 30,
+)
+def export_message_data(self, job_id):
+    """
+    Пишет полный результат SQL из Message.data_payload в файл EXPORT_ROOT пачками
+    (серверный курсор DatabaseExecutor.stream_query), не занимая веб-воркер.
+    """
+    try:
+        job = ExportJob.objects.select_related('message').get(id=job_id)
+    except ExportJob.DoesNotExist:
+        return
+    # Условное обновление: отмена (cancel_export_job) между чтением и записью не теряется
+    started = ExportJob.objects.filter(id=job.id, status='pending').update(status='running', task_id=self.request.id)
+    if not started:
+        # Отменили, пока задача стояла в очереди
+        return
+    job.status = 'running'
+    job.task_id = self.request.id
+
+    export_root = Path(settings.EXPORT_ROOT)
+    export_root.mkdir(parents=True, exist_ok=True)
+    path = export_root / f"{job.public_id}.{job.export_format}"
+    log_context = {'task_id': self.request.id, 'export_job_id': job.id}
+
+    rows = None
+    try:
+        sources = job.message.sql_sources()
+        if len(sources) != 1:
+            raise ValueError("Выгрузка возможна для ответа из одного источника с SQL.")
+        datasource, sql_query = sources[0]
+
+        rows = DatabaseExecutor(datasource=datasource).stream_query(sql_query, cancel_key=self.request.id)
+        columns = next(rows)
+
+        writer = save_xlsx if job.export_format == 'xlsx' else write_csv
+        writer(path, columns, _tracked_chunks(self, job, rows))
+
+        job.status = 'done'
+        job.file_path = str(path)
+        job.file_size = path.stat().st_size
+        logger.info(f"Выгрузка готова: {job.rows_written} строк, {job.file_size} байт.", extra=log_context)
+
+    except ExportCancelledException:
+        logger.info("Выгрузка отменена пользователем.", extra=log_context)
+        path.unlink(missing_ok=True)
+        job.status = 'cancelled'
+    except Exception as e:
+        path.unlink(missing_ok=True)
+        if ExportJob.objects.filter(id=job.id, status='cancelled').exists():
+            # Запрос прерван в БД по отмене пользователя
+            logger.info("Выгрузка отменена пользователем (запрос прерван).", extra=log_context)
+            job.status = 'cancelled'
+        else:
+            logger.error(f"Ошибка выгрузки: {e}", extra=log_context)
+            job.status = 'failed'
+            job.error = str(e)
+    finally:
+        if rows is not None:
+            rows.close()  # закрывает курсор и возвращает соединение в пул
+
+    job.finished_at = timezone.now()
+    result = {'rows_written': job.rows_written, 'finished_at': job.finished_at}
+    if job.status != 'cancelled':
+        result.update(status=job.status, file_path=job.file_path, file_size=job.file_size, error=job.error)
+    # Итог пишется, только если задачу не отменили (статус пользователя не перезаписываем)
+    finished = ExportJob.objects.filter(id=job.id, status='running').update(**result)
+    if not finished:
+        if job.status == 'done':
+            # Отменили после последней пачки - файл не отдаем
+            logger.info("Выгрузка отменена пользователем после записи файла.", extra=log_context)
+            path.unlink(missing_ok=True)
+        job.status = 'cancelled'
+        ExportJob.objects.filter(id=job.id, status='cancelled').update(
+            rows_written=job.rows_written, finished_at=job.finished_at
+        )
+    return job.status
+
+
+@shared_task
+def cleanup_export_files():
+    """
+    Удаляет выгрузки старше EXPORT_RETENTION_HOURS (файл + запись),
+    а также файлы-сироты в EXPORT_ROOT (например, после падения воркера).
+    """
+    cutoff = timezone.now() - timedelta(hours=settings.EXPORT_RETENTION_HOURS)
+    old_jobs = ExportJob.objects.filter(created_at__lt=cutoff)
+    for file_path in old_jobs.exclude(file_path='').values_list('file_path', flat=True):
+        Path(file_path).unlink(missing_ok=True)
+    deleted, _ = old_jobs.delete()
+
+    export_root = Path(settings.EXPORT_ROOT)
+    orphans = 0
+    if export_root.exists():
+        known = set(ExportJob.objects.exclude(file_path='').values_list('file_path', flat=True))
+        cutoff_ts = cutoff.timestamp()
+        for path in export_root.iterdir():
+            if path.is_file() and str(path) not in known and path.stat().st_mtime < cutoff_ts:
+                path.unlink(missing_ok=True)
+                orphans += 1
+
+    return f"Удалено выгрузок: {deleted}, файлов-сирот: {orphans}"
@@ -1,3 +1,69 @@
-from django.test import TestCase
+import tempfile
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+from ai_core.models import DataSource
+from .models import ChatSession, ExportJob, Message
+from .tasks import export_message_data
+
+
+class FakeExecutor:
+    """DatabaseExecutor для выгрузки: колонки, затем пачки; on_exhausted - после последней пачки."""
+
+    on_exhausted = None
+
+    def __init__(self, datasource=None):
+        pass
+
+    def stream_query(self, sql_query, chunk_size=None, cancel_key=None):
+        yield ['id']
+        yield [(1,), (2,)]
+        yield [(3,)]
+        if self.on_exhausted:
+            self.on_exhausted()
+
+
+class ExportJobStatusTests(TestCase):
+
+    def setUp(self):
+        self.export_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.export_root.cleanup)
+        settings_override = override_settings(EXPORT_ROOT=self.export_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        user = get_user_model().objects.create_user(email='analyst@example.com', password='x')
+        datasource = DataSource.objects.create(name='dwh', db_name='dwh', db_user='reader', db_password='secret')
+        session = ChatSession.objects.create(user=user)
+        message = Message.objects.create(session=session, role='user', content='', data_payload={
+            'sub_queries': [{'datasource_id': datasource.id, 'sql_query': 'SELECT id FROM t'}],
+        })
+        self.job = ExportJob.objects.create(user=user, message=message, export_format='csv')
+
+    def run_export(self, on_exhausted=None):
+        FakeExecutor.on_exhausted = staticmethod(on_exhausted) if on_exhausted else None
+        with mock.patch('chat.tasks.DatabaseExecutor', FakeExecutor):
+            result = export_message_data.run(self.job.id)
+        self.job.refresh_from_db()
+        return result
+
+    def test_done(self):
+        self.assertEqual(self.run_export(), 'done')
+        self.assertEqual((self.job.status, self.job.rows_written), ('done', 3))
+        self.assertTrue(Path(self.job.file_path).exists())
+
+    def test_cancelled_while_queued_is_not_started(self):
+        ExportJob.objects.filter(id=self.job.id).update(status='cancelled')
+        self.assertIsNone(self.run_export())
+        self.assertEqual(self.job.status, 'cancelled')
+
+    def test_cancel_after_last_chunk_is_not_overwritten(self):
+        result = self.run_export(
+            on_exhausted=lambda: ExportJob.objects.filter(id=self.job.id).update(status='cancelled')
+        )
+        self.assertEqual(result, 'cancelled')
+        self.assertEqual((self.job.status, self.job.file_path), ('cancelled', ''))
+        self.assertEqual(list(Path(self.export_root.name).iterdir()), [])
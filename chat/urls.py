@@ -7,8 +7,14 @@ urlpatterns = [
     path('c/<uuid:session_id>/', views.chat_detail, name='chat_detail'),
     path('c/<uuid:session_id>/send/', views.send_message, name='send_message'),
     path('c/<uuid:session_id>/get/', views.get_new_messages, name='get_new_messages'),
+    path('c/<uuid:session_id>/events/', views.message_events, name='message_events'),
     path('c/<uuid:session_id>/rename/', views.rename_chat, name='rename_chat'),
     path('c/<uuid:session_id>/delete/', views.delete_chat, name='delete_chat'),
     path('c/<uuid:session_id>/cancel/', views.cancel_generation, name='cancel_generation'),
     path('message/<int:message_id>/download_excel/', views.download_excel, name='download_excel'),
+    path('message/<int:message_id>/export/', views.export_data, name='export_data'),
+    path('message/<int:message_id>/export/start/', views.start_export_job, name='start_export_job'),
+    path('export/<uuid:job_id>/', views.export_job_status, name='export_job_status'),
+    path('export/<uuid:job_id>/cancel/', views.cancel_export_job, name='cancel_export_job'),
+    path('export/<uuid:job_id>/download/', views.download_export_job, name='download_export_job'),
 ]
@@ -1,18 +1,26 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponse
+from django.http import JsonResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponse, \
+    StreamingHttpResponse, FileResponse, Http404
 from django.views.decorators.http import require_POST
+from django.core.handlers.asgi import ASGIRequest
 from django.template.loader import render_to_string
+from django.urls import reverse
 from django.conf import settings
 from django.contrib import messages
 from django.db import transaction
-from .models import ChatSession, Message
-from .tasks import get_ai_response
+from .models import ChatSession, Message, ExportJob
+from .tasks import get_ai_response, export_message_data
+from .events import channel_name
+from .exports import iter_csv, write_xlsx, CSV_CONTENT_TYPE, XLSX_CONTENT_TYPE
 import json
 import io
+import time
+import redis.asyncio as aioredis
 import pandas as pd
 from ai_core.models import DataSource
 from ai_core.db_executor import DatabaseExecutor
+from ai_core import query_cancel
 from dasm.celery import app as celery_app
 import logging
 from sqlalchemy import create_engine
@@ -87,16 +95,24 @@ def send_message(request, session_id):
 @login_required
 def cancel_generation(request, session_id):
     """
-    Останавливает выполнение задачи Celery.
+    Останавливает выполнение задачи Celery (кооперативно).
+    Сбрасываем current_task_id - задача увидит это на ближайшей проверке (check_if_cancelled);
+    если она сейчас ждет SQL, запрос прерывается в самой БД (pg_cancel_backend / KILL QUERY),
+    и воркер освобождается сразу, без убийства процесса.
     """
     session = get_object_or_404(ChatSession, public_id=session_id, user=request.user)
 
     if session.current_task_id:
-        celery_app.control.revoke(session.current_task_id, terminate=True)
-
+        task_id = session.current_task_id
         session.current_task_id = None
         session.save(update_fields=['current_task_id'])
 
+        # Задача еще в очереди - просто не запустится
+        celery_app.control.revoke(task_id)
+        # Подзапросы ответа регистрируются по источникам (chat.tasks.SourceBranch)
+        for datasource_id in DataSource.objects.filter(is_active=True).values_list('id', flat=True):
+            query_cancel.cancel(query_cancel.branch_key(task_id, datasource_id))
+
         return JsonResponse({'status': 'canceled'})
 
     return JsonResponse({'status': 'no_task'})
@@ -130,6 +146,53 @@ def get_new_messages(request, session_id):
     return JsonResponse({'status': 'pending'})
 
 
+@login_required
+async def message_events(request, session_id):
+    """
+    (ASGI) Server-Sent Events: пушит новые ответы ИИ из Redis pub/sub.
+    Авторизация и поиск сессии - один раз на соединение, а не на каждый опрос.
+    get_new_messages остается запасным вариантом (polling).
+    """
+    if not isinstance(request, ASGIRequest):
+        # Под WSGI поток занял бы воркер gunicorn; 204 -> браузер переходит на polling
+        return HttpResponse(status=204)
+
+    user = await request.auser()
+    session = await ChatSession.objects.filter(public_id=session_id, user=user).afirst()
+    if session is None:
+        raise Http404
+
+    response = StreamingHttpResponse(_event_stream(session.id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Nginx не должен буферизовать поток
+    return response
+
+
+async def _event_stream(session_pk):
+    client = aioredis.Redis.from_url(settings.CHAT_EVENTS_REDIS_URL)
+    pubsub = client.pubsub()
+    await pubsub.subscribe(channel_name(session_pk))
+
+    # Соединение живет ограниченное время, затем браузер переподключается сам
+    deadline = time.monotonic() + settings.CHAT_EVENTS_MAX_DURATION
+    try:
+        yield "retry: 3000\n\n"
+        while time.monotonic() < deadline:
+            msg = await pubsub.get_message(ignore_subscribe_messages=True,
+                                           timeout=settings.CHAT_EVENTS_HEARTBEAT)
+            if msg is None:
+                yield ": ping\n\n"
+                continue
+
+            data = msg['data'].decode('utf-8')
+            event = json.loads(data).get('event', 'message')
+            yield f"event: {event}\ndata: {data}\n\n"
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
+        await client.aclose()
+
+
 @require_POST
 @login_required
 def rename_chat(request, session_id):
@@ -163,6 +226,19 @@ def delete_chat(request, session_id):
         return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 
 
+def _exportable_sources(message) -> list:
+    """[(DataSource, SQL), ...] сообщения; только SELECT/WITH."""
+    return [
+        (datasource, sql_query) for datasource, sql_query in message.sql_sources()
+        if sql_query and sql_query.strip().upper().startswith(('SELECT', 'WITH'))
+    ]
+
+
+def _sheet_name(name: str) -> str:
+    # Excel: до 31 символа, без []:*?/\
+    return "".join(ch for ch in name if ch not in '[]:*?/\\')[:31] or 'Data'
+
+
 @login_required
 def download_excel(request, message_id):
     try:
@@ -171,21 +247,20 @@ def download_excel(request, message_id):
         if message.session.user != request.user and not request.user.is_staff:
             return HttpResponseForbidden("У вас нет прав на этот файл")
 
-        sql_query = message.data_payload.get('sql_query')
-        if not sql_query or not sql_query.strip().upper().startswith(('SELECT', 'WITH')):
+        sources = _exportable_sources(message)
+        if not sources:
             return HttpResponseBadRequest("В этом сообщении нет данных для выгрузки.")
 
         logger.info(f"User {request.user.email} скачивает Excel для сообщения {message_id}")
 
-        # Используем DatabaseExecutor
-        active_datasource = DataSource.objects.filter(is_active=True).first()
-        db_executor = DatabaseExecutor(datasource=active_datasource)
-
-        df = db_executor.execute_query(sql_query)
-
+        # Используем DatabaseExecutor (результат обычно уже в кэше после ответа в чате).
+        # Ответ из нескольких источников - по листу на источник
         output = io.BytesIO()
         with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Data')
+            for datasource, sql_query in sources:
+                df = DatabaseExecutor(datasource=datasource).execute_query(sql_query)
+                sheet_name = 'Data' if len(sources) == 1 else _sheet_name(datasource.name)
+                df.to_excel(writer, index=False, sheet_name=sheet_name)
 
         output.seek(0)
 
@@ -198,4 +273,128 @@ def download_excel(request, message_id):
 
     except Exception as e:
         messages.error(request, f"Ошибка при создании Excel: {e}")
-        return redirect(request.META.get('HTTP_REFERER', 'chat_list'))
\ No newline at end of file
+        return redirect(request.META.get('HTTP_REFERER', 'chat_list'))
+
+@login_required
+def export_data(request, message_id):
+    """
+    Полная выгрузка результата (без QUERY_ROW_LIMIT): ?format=csv | xlsx.
+    Строки читаются серверным курсором пачками, поэтому память воркера не зависит
+    от размера результата. CSV стримится сразу, XLSX собирается во временном файле.
+    """
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in ('csv', 'xlsx'):
+        return HttpResponseBadRequest("Неизвестный формат выгрузки.")
+
+    try:
+        message = get_object_or_404(Message, id=message_id)
+        if message.session.user != request.user and not request.user.is_staff:
+            return HttpResponseForbidden("У вас нет прав на этот файл")
+
+        sources = _exportable_sources(message)
+        if not sources:
+            return HttpResponseBadRequest("В этом сообщении нет данных для выгрузки.")
+        if len(sources) > 1:
+            return HttpResponseBadRequest("Полная выгрузка доступна только для ответа из одного источника.")
+        datasource, sql_query = sources[0]
+
+        logger.info(f"User {request.user.email} выгружает {export_format.upper()} для сообщения {message_id}")
+
+        db_executor = DatabaseExecutor(datasource=datasource)
+        rows = db_executor.stream_query(sql_query)
+        # Первый элемент - колонки: ошибки SQL/подключения всплывают здесь, до начала ответа
+        columns = next(rows)
+
+        if export_format == 'csv':
+            response = StreamingHttpResponse(iter_csv(columns, rows), content_type=CSV_CONTENT_TYPE)
+            response['Content-Disposition'] = 'attachment; filename="dasm_data.csv"'
+            return response
+
+        xlsx_file = write_xlsx(columns, rows)
+        return FileResponse(xlsx_file, as_attachment=True, filename='dasm_data.xlsx',
+                            content_type=XLSX_CONTENT_TYPE)
+
+    except Exception as e:
+        messages.error(request, f"Ошибка при выгрузке данных: {e}")
+        return redirect(request.META.get('HTTP_REFERER', 'chat_list'))
+
+
+# --- ФОНОВЫЕ ВЫГРУЗКИ (ExportJob) ---
+
+def _export_job_payload(job):
+    payload = {
+        'job_id': str(job.public_id),
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'rows_written': job.rows_written,
+        'file_size': job.file_size,
+        'error': job.error,
+        'status_url': reverse('export_job_status', args=[job.public_id]),
+        'cancel_url': reverse('cancel_export_job', args=[job.public_id]),
+    }
+    if job.status == 'done':
+        payload['download_url'] = reverse('download_export_job', args=[job.public_id])
+    return payload
+
+
+@login_required
+@require_POST
+def start_export_job(request, message_id):
+    """Ставит полную выгрузку в очередь Celery и сразу отвечает (не держит gunicorn-воркер)."""
+    message = get_object_or_404(Message, id=message_id)
+    if message.session.user != request.user and not request.user.is_staff:
+        return HttpResponseForbidden("У вас нет прав на этот файл")
+
+    sources = _exportable_sources(message)
+    if not sources:
+        return HttpResponseBadRequest("В этом сообщении нет данных для выгрузки.")
+    if len(sources) > 1:
+        return HttpResponseBadRequest("Полная выгрузка доступна только для ответа из одного источника.")
+
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in ('csv', 'xlsx'):
+        return HttpResponseBadRequest("Неизвестный формат выгрузки.")
+
+    job = ExportJob.objects.create(user=request.user, message=message, export_format=export_format)
+    task = export_message_data.delay(job.id)
+    ExportJob.objects.filter(id=job.id, task_id__isnull=True).update(task_id=task.id)
+
+    logger.info(f"User {request.user.email} поставил выгрузку {export_format.upper()} для сообщения {message_id}")
+    return JsonResponse(_export_job_payload(job))
+
+
+@login_required
+def export_job_status(request, job_id):
+    job = get_object_or_404(ExportJob, public_id=job_id, user=request.user)
+    return JsonResponse(_export_job_payload(job))
+
+
+@login_required
+@require_POST
+def cancel_export_job(request, job_id):
+    """
+    Кооперативная отмена: задача сама увидит статус на следующей пачке строк,
+    закроет курсор и удалит недописанный файл.
+    """
+    job = get_object_or_404(ExportJob, public_id=job_id, user=request.user)
+    cancelled = ExportJob.objects.filter(id=job.id, status__in=('pending', 'running')).update(status='cancelled')
+    if cancelled and job.task_id:
+        # Если задача ждет первую пачку строк (долгая сортировка и т.п.) - прерываем запрос в БД
+        query_cancel.cancel(job.task_id)
+    job.refresh_from_db()
+    return JsonResponse(_export_job_payload(job))
+
+
+@login_required
+def download_export_job(request, job_id):
+    job = get_object_or_404(ExportJob, public_id=job_id, user=request.user)
+    if job.status != 'done' or not job.file_path:
+        raise Http404("Файл выгрузки не готов.")
+    try:
+        file = open(job.file_path, 'rb')
+    except FileNotFoundError:
+        raise Http404("Файл выгрузки уже удален.")
+
+    content_type = XLSX_CONTENT_TYPE if job.export_format == 'xlsx' else CSV_CONTENT_TYPE
+    return FileResponse(file, as_attachment=True, filename=f"dasm_data.{job.export_format}",
+                        content_type=content_type)
@@ -5,6 +5,10 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Push-канал чата (SSE, chat.views.message_events) работает только через этот
+entry point: uvicorn dasm.asgi:application. Остальной трафик может
+по-прежнему обслуживать gunicorn (dasm.wsgi).
 """
 
 import os
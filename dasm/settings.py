@@ -24,6 +24,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',  # триграммный поиск значений (ai_core.value_index)
 ]
 
 MIDDLEWARE = [
@@ -230,17 +231,142 @@ LOGOUT_REDIRECT_URL = '/users/login/'
 CELERY_BROKER_URL = config('CELERY_BROKER_URL', default='redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = config('CELERY_RESULT_BACKEND', default='redis://localhost:6379/1')
 
+# Push-канал чата (Redis pub/sub -> SSE через dasm.asgi)
+CHAT_EVENTS_REDIS_URL = config('CHAT_EVENTS_REDIS_URL', default='redis://localhost:6379/3')
+CHAT_EVENTS_HEARTBEAT = 15  # сек
+CHAT_EVENTS_MAX_DURATION = 60 * 5  # сек, после этого браузер переподключается
+CHAT_EVENTS_CHUNK_INTERVAL = 0.1  # сек, как часто пушить накопленные токены сводки
+
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 300  # сек
 
+# Длинные фоновые задачи (синхронизация схемы, векторизация, курирование, выгрузки) -
+# в отдельной очереди со своим воркером (deployment_configs/celery-maintenance.service),
+# чтобы не занимать воркер ответов чата (get_ai_response, очередь по умолчанию 'celery').
+CELERY_MAINTENANCE_QUEUE = 'maintenance'
+CELERY_TASK_ROUTES = {
+    'ai_core.tasks.task_sync_schema': {'queue': CELERY_MAINTENANCE_QUEUE},
+    'ai_core.tasks.task_index_column_values': {'queue': CELERY_MAINTENANCE_QUEUE},
+    'ai_core.tasks.task_check_freshness': {'queue': CELERY_MAINTENANCE_QUEUE},
+    'ai_core.tasks.task_reindex_vectors': {'queue': CELERY_MAINTENANCE_QUEUE},
+    'ai_core.tasks.task_curate_tables': {'queue': CELERY_MAINTENANCE_QUEUE},
+    'ai_core.tasks.task_describe_columns': {'queue': CELERY_MAINTENANCE_QUEUE},
+    'ai_core.tasks.task_evict_sql_cache': {'queue': CELERY_MAINTENANCE_QUEUE},
+    'chat.tasks.export_message_data': {'queue': CELERY_MAINTENANCE_QUEUE},
+    'chat.tasks.cleanup_export_files': {'queue': CELERY_MAINTENANCE_QUEUE},
+    # task_check_endpoints остается в очереди чата: короткая и нужна для выбора реплик
+}
+
+# Периодические задачи (celery -A dasm beat)
+CELERY_BEAT_SCHEDULE = {
+    'evict-sql-cache': {
+        'task': 'ai_core.tasks.task_evict_sql_cache',
+        'schedule': 60 * 60,  # раз в час
+    },
+    'cleanup-export-files': {
+        'task': 'chat.tasks.cleanup_export_files',
+        'schedule': 60 * 60,
+    },
+    'check-datasource-endpoints': {
+        'task': 'ai_core.tasks.task_check_endpoints',
+        'schedule': 30,
+    },
+    'check-datasource-freshness': {
+        'task': 'ai_core.tasks.task_check_freshness',
+        'schedule': 5 * 60,
+    },
+}
+
 # OLLAMA_HOST = 'http://localhost:11434'
 OLLAMA_HOST = config('OLLAMA_HOST', default='http://localhost:11434')
 OLLAMA_SQL_MODEL = config('OLLAMA_SQL_MODEL', default='llama2:13b')
 OLLAMA_SUMMARY_MODEL = config('OLLAMA_SUMMARY_MODEL', default='llama2:13b')
 OLLAMA_SQL_TEMPERATURE = 0.0
 OLLAMA_TEMPERATURE = 1.0
+OLLAMA_STREAM_SUMMARY = config('OLLAMA_STREAM_SUMMARY', default=True, cast=bool)  # потоковая сводка
+OLLAMA_MODELS_REFRESH_SECONDS = 300  # как часто обновлять список моделей (client.list())
+
+# Векторизация схемы (run_vector_indexing)
+VECTOR_INDEX_BATCH_SIZE = 64  # текстов в одном запросе /api/embed
+VECTOR_INDEX_CONCURRENCY = 4  # параллельных запросов к Ollama
+VECTOR_INDEX_WRITE_CHUNK = 500  # строк в одном bulk_update
+
+# AI-курирование схемы в фоне (ai_core.curation)
+CURATION_CONCURRENCY = 4  # одновременных запросов generate к Ollama
+CURATION_WRITE_CHUNK = 100  # колонок между записями bulk_update
+CURATION_TIME_LIMIT = 60 * 60  # сек
 
 QUERY_ROW_LIMIT = 1000
 QUERY_TIMEOUT_MS = 30000
+# Лимиты по умолчанию для DataSource (ai_core.query_limits)
+QUERY_MAX_RESULT_BYTES = 200 * 1024 * 1024  # объем DataFrame в памяти воркера
+QUERY_MAX_CONCURRENT = 4  # одновременных запросов к одному источнику (все процессы)
+QUERY_SLOT_WAIT = 10  # сек, сколько ждать свободный слот
+# Чтение результата (ai_core.fetch): 'arrow' - пачками в pyarrow-колонки, 'legacy' - pd.read_sql_query целиком
+QUERY_FETCH_MODE = config('QUERY_FETCH_MODE', default='arrow')
+QUERY_FETCH_CHUNK_SIZE = 2000  # строк в пачке
+
+# EXPLAIN перед выполнением (ai_core.query_guard). Пороги DataSource важнее этих
+QUERY_EXPLAIN_ENABLED = config('QUERY_EXPLAIN_ENABLED', default=True, cast=bool)
+QUERY_EXPLAIN_MAX_COST = 10_000_000  # условные единицы планировщика; None - без проверки
+QUERY_EXPLAIN_MAX_ROWS = None  # оценка строк на выходе; None - без проверки
+
+# Линейные графики длиннее - прореживаются LTTB (ai_core.downsampling)
+LINE_CHART_MAX_POINTS = 500
+
+# Полная выгрузка (chat.views.export_data, серверный курсор)
+EXPORT_CHUNK_SIZE = 5000  # строк в одной пачке из курсора
+EXPORT_TIMEOUT_MS = 10 * 60 * 1000
+EXPORT_MAX_ROWS = config('EXPORT_MAX_ROWS', default=0, cast=int) or None  # None - без ограничения
+
+# Фоновые выгрузки (chat.tasks.export_message_data)
+EXPORT_ROOT = config('EXPORT_ROOT', default=str(BASE_DIR / 'exports'))
+EXPORT_RETENTION_HOURS = 24  # через сколько удалять готовые файлы
+EXPORT_JOB_TIME_LIMIT = 60 * 60  # сек
+EXPORT_PROGRESS_INTERVAL = 2.0  # сек, как часто писать прогресс в ExportJob
+
+# Фоновая синхронизация схемы (ai_core.tasks.task_sync_schema)
+SCHEMA_SYNC_BATCH_TABLES = 200  # таблиц в одной пачке (отражение + запись + точка возобновления)
+SCHEMA_SYNC_WRITE_BATCH = 1000  # строк в одном bulk_create/bulk_update
+SCHEMA_SYNC_MAX_RETRIES = 3
+SCHEMA_SYNC_RETRY_DELAY = 60  # сек между повторами после сбоя
+SCHEMA_SYNC_LOCK_TTL = 10 * 60  # сек, блокировка источника (продлевается после каждой пачки)
+SCHEMA_SYNC_TIME_LIMIT = 60 * 60  # сек
+
+# Проверка свежести источников (ai_core.freshness, task_check_freshness)
+FRESHNESS_AUTO_SYNC = config('FRESHNESS_AUTO_SYNC', default=True, cast=bool)  # синхронизировать схему при изменении
+
+# Индекс значений измерений (ai_core.value_index)
+VALUE_INDEX_MAX_DISTINCT = 200  # больше различных значений в выборке - колонка не индексируется
+VALUE_INDEX_SAMPLE_ROWS = 100_000  # строк выборки на колонку
+VALUE_INDEX_MIN_SIMILARITY = 0.5  # триграммная близость литерала вопроса и значения
+VALUE_INDEX_MAX_MATCHES = 10  # значений-подсказок на вопрос
+
+# Пулы соединений к DataSource (ai_core.engine_registry)
+DB_POOL_SIZE = config('DB_POOL_SIZE', default=5, cast=int)
+DB_POOL_MAX_OVERFLOW = config('DB_POOL_MAX_OVERFLOW', default=5, cast=int)
+DB_POOL_RECYCLE = 30 * 60  # сек, пересоздавать соединение старше
+DB_POOL_PRE_PING = True  # проверять соединение перед выдачей из пула
+DB_POOL_IDLE_TIMEOUT = 60 * 60  # сек, закрывать неиспользуемые пулы
+
+# Выбор источника по найденным таблицам (SQLGenerator.route_sources)
+ROUTER_MIN_SOURCE_SHARE = 0.3  # доля от веса лучшего источника, чтобы подключить еще один
+ROUTER_MAX_SOURCES = 3  # максимум источников (параллельных подзапросов) в одном ответе
+
+# Реплики DataSource (ai_core.replica_router)
+REPLICA_SELECTION = config('REPLICA_SELECTION', default='latency')  # 'latency' | 'round_robin'
+REPLICA_FAILOVER_COOLDOWN = 30  # сек, сколько не слать запросы на упавший узел
+
+# Кэш результатов SQL (чат + выгрузка Excel, ai_core.result_cache)
+RESULT_CACHE_ENABLED = config('RESULT_CACHE_ENABLED', default=True, cast=bool)
+RESULT_CACHE_TTL = 10 * 60  # сек
+RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024  # общий бюджет памяти в Redis
+RESULT_CACHE_MAX_ENTRY_BYTES = 32 * 1024 * 1024  # больше - не кэшируем
+
+# Семантический кэш "вопрос -> SQL"
+SQL_CACHE_ENABLED = config('SQL_CACHE_ENABLED', default=True, cast=bool)
+SQL_CACHE_SIMILARITY = config('SQL_CACHE_SIMILARITY', default=0.95, cast=float)  # косинусная близость
+SQL_CACHE_TTL = 60 * 60 * 24 * 7  # сек
+SQL_CACHE_MAX_ENTRIES = 5000
 
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 10000